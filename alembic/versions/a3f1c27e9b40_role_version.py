@@ -0,0 +1,46 @@
+"""role version
+
+Revision ID: a3f1c27e9b40
+Revises: 07535dd6f801
+Create Date: 2026-10-18 09:12:31.482106
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f1c27e9b40'
+down_revision: Union[str, None] = '07535dd6f801'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('roles', sa.Column('version', sa.Integer(), nullable=False, server_default='1'))
+    # Any change of the permissions of a role bumps its version, which
+    # invalidates tokens carrying the old permissions, and tells every
+    # worker to drop its permission cache
+    op.execute("""
+        CREATE FUNCTION bump_role_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE roles SET version = version + 1
+            WHERE id IN (NEW.role_id, OLD.role_id);
+            PERFORM pg_notify('role_permission_changed', '');
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE TRIGGER role_permission_changed
+        AFTER INSERT OR UPDATE OR DELETE ON role_permission
+        FOR EACH ROW EXECUTE FUNCTION bump_role_version();
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER role_permission_changed ON role_permission")
+    op.execute("DROP FUNCTION bump_role_version()")
+    op.drop_column('roles', 'version')
@@ -0,0 +1,69 @@
+"""records indexes
+
+Revision ID: b8e3d1a6c094
+Revises: f7a2c9d4b813
+Create Date: 2026-10-18 22:14:08.561370
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8e3d1a6c094'
+down_revision: Union[str, None] = 'f7a2c9d4b813'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+OPEN_LOAN = sa.text('returned = false')
+
+
+def upgrade() -> None:
+    # Older borrows added the association row before refusing an issued or out of
+    # stock item, drop the rows that no open record backs
+    op.execute("""
+        DELETE FROM member_book association
+        WHERE NOT EXISTS (
+            SELECT 1 FROM records
+            WHERE records.member_id = association.user_id AND records.book_id = association.book_id
+            AND records.returned = false
+        )
+    """)
+    op.execute("""
+        DELETE FROM member_magazine association
+        WHERE NOT EXISTS (
+            SELECT 1 FROM records
+            WHERE records.member_id = association.user_id AND records.magazine_id = association.magazine_id
+            AND records.returned = false
+        )
+    """)
+    # Older returns could leave a user holding the same item twice, keep the first row
+    op.execute("""
+        DELETE FROM member_book duplicate USING member_book kept
+        WHERE duplicate.user_id = kept.user_id AND duplicate.book_id = kept.book_id AND duplicate.id > kept.id
+    """)
+    op.execute("""
+        DELETE FROM member_magazine duplicate USING member_magazine kept
+        WHERE duplicate.user_id = kept.user_id AND duplicate.magazine_id = kept.magazine_id AND duplicate.id > kept.id
+    """)
+    op.create_unique_constraint('uq_member_book_user_id_book_id', 'member_book', ['user_id', 'book_id'])
+    op.create_unique_constraint('uq_member_magazine_user_id_magazine_id', 'member_magazine', ['user_id', 'magazine_id'])
+    # records only grows, build its indexes without blocking borrows and returns
+    with op.get_context().autocommit_block():
+        op.create_index('ix_records_open_member_id_book_id', 'records', ['member_id', 'book_id'],
+                        postgresql_where=OPEN_LOAN, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_records_open_member_id_magazine_id', 'records', ['member_id', 'magazine_id'],
+                        postgresql_where=OPEN_LOAN, postgresql_concurrently=True, if_not_exists=True)
+        op.create_index('ix_records_open_expected_return_date', 'records', ['expected_return_date'],
+                        postgresql_where=OPEN_LOAN, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_records_open_expected_return_date', table_name='records', postgresql_concurrently=True)
+        op.drop_index('ix_records_open_member_id_magazine_id', table_name='records', postgresql_concurrently=True)
+        op.drop_index('ix_records_open_member_id_book_id', table_name='records', postgresql_concurrently=True)
+    op.drop_constraint('uq_member_magazine_user_id_magazine_id', 'member_magazine', type_='unique')
+    op.drop_constraint('uq_member_book_user_id_book_id', 'member_book', type_='unique')
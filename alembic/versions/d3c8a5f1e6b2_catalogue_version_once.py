@@ -0,0 +1,50 @@
+"""catalogue version once per transaction
+
+Revision ID: d3c8a5f1e6b2
+Revises: b8e3d1a6c094
+Create Date: 2026-10-18 23:02:41.318506
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd3c8a5f1e6b2'
+down_revision: Union[str, None] = 'b8e3d1a6c094'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The trigger fires for every changed row, a batch of 50 books updated the
+    # version row 50 times. One bump per table and transaction is enough for the
+    # ETag, the flag is a transaction local setting so it is gone at commit and
+    # reverted with a rolled back savepoint.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION bump_catalogue_version() RETURNS trigger AS $$
+        BEGIN
+            IF current_setting('lms.version_bumped_' || TG_TABLE_NAME, true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            PERFORM set_config('lms.version_bumped_' || TG_TABLE_NAME, 'on', true);
+            UPDATE catalogue_versions SET version = version + 1
+            WHERE table_name = TG_TABLE_NAME;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE OR REPLACE FUNCTION bump_catalogue_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE catalogue_versions SET version = version + 1
+            WHERE table_name = TG_TABLE_NAME;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
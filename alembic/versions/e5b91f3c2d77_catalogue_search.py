@@ -0,0 +1,51 @@
+"""catalogue search
+
+Revision ID: e5b91f3c2d77
+Revises: c41d8e2f7a15
+Create Date: 2026-10-18 19:41:52.730215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b91f3c2d77'
+down_revision: Union[str, None] = 'c41d8e2f7a15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def search_document(title: str, by: str):
+    # Same expression as utils.search.search_document, else the index is not used
+    return (f"(setweight(to_tsvector('simple'::regconfig, coalesce({title}, '')), 'A'::\"char\") || "
+            f"setweight(to_tsvector('simple'::regconfig, coalesce({by}, '')), 'B'::\"char\"))")
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(f"CREATE INDEX ix_books_search ON books USING gin ({search_document('title', 'author')})")
+    op.execute(f"CREATE INDEX ix_magazines_search ON magazines USING gin ({search_document('title', 'editor')})")
+    # Trigram indexes for typo tolerant matching with %>
+    for table, column in (('books', 'title'), ('books', 'author'), ('magazines', 'title'),
+                          ('magazines', 'editor'), ('genre', 'name'), ('publishers', 'name')):
+        op.execute(f"CREATE INDEX ix_{table}_{column}_trgm ON {table} USING gin ({column} gin_trgm_ops)")
+    # Matches through genre and publisher names and the filters
+    op.create_index('ix_books_genre_id', 'books', ['genre_id'])
+    op.create_index('ix_books_publisher_id', 'books', ['publisher_id'])
+    op.create_index('ix_magazines_genre_id', 'magazines', ['genre_id'])
+    op.create_index('ix_magazines_publisher_id', 'magazines', ['publisher_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_magazines_publisher_id', table_name='magazines')
+    op.drop_index('ix_magazines_genre_id', table_name='magazines')
+    op.drop_index('ix_books_publisher_id', table_name='books')
+    op.drop_index('ix_books_genre_id', table_name='books')
+    for table, column in (('books', 'title'), ('books', 'author'), ('magazines', 'title'),
+                          ('magazines', 'editor'), ('genre', 'name'), ('publishers', 'name')):
+        op.execute(f"DROP INDEX ix_{table}_{column}_trgm")
+    op.execute("DROP INDEX ix_magazines_search")
+    op.execute("DROP INDEX ix_books_search")
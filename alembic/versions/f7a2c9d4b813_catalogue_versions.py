@@ -0,0 +1,56 @@
+"""catalogue versions
+
+Revision ID: f7a2c9d4b813
+Revises: e5b91f3c2d77
+Create Date: 2026-10-18 21:05:17.204963
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7a2c9d4b813'
+down_revision: Union[str, None] = 'e5b91f3c2d77'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+CATALOGUE_TABLES = ('books', 'magazines', 'genre', 'publishers')
+
+
+def upgrade() -> None:
+    op.create_table('catalogue_versions',
+    sa.Column('table_name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.BigInteger(), server_default='1', nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+    op.execute("INSERT INTO catalogue_versions (table_name) VALUES "
+               + ", ".join(f"('{table}')" for table in CATALOGUE_TABLES))
+    # The version is the ETag source of the catalogue routes. The triggers are
+    # deferred to commit, so readers never see a new version with old rows and
+    # the version row is only locked while the transaction commits.
+    op.execute("""
+        CREATE FUNCTION bump_catalogue_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE catalogue_versions SET version = version + 1
+            WHERE table_name = TG_TABLE_NAME;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    for table in CATALOGUE_TABLES:
+        op.execute(f"""
+            CREATE CONSTRAINT TRIGGER {table}_version
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            DEFERRABLE INITIALLY DEFERRED
+            FOR EACH ROW EXECUTE FUNCTION bump_catalogue_version();
+        """)
+
+
+def downgrade() -> None:
+    for table in CATALOGUE_TABLES:
+        op.execute(f"DROP TRIGGER {table}_version ON {table}")
+    op.execute("DROP FUNCTION bump_catalogue_version()")
+    op.drop_table('catalogue_versions')
@@ -5,6 +5,8 @@ from passlib.context import CryptContext
 from decouple import config
 import utils.constant_messages as constant_messages 
 import bcrypt
+from auth.password_pool import password_pool
+from auth.token_cache import token_cache
 
 
 
@@ -14,50 +16,84 @@ ACCESS_SECRET = config('secret_access')
 REFRESH_SECRET = config('secret_refresh')
 # EXPIRE = config('expire_time')
 ALGORITHM = config('algorithm')
+# Put user id, username, permissions and role version in the access token
+# so permission checks don't need the database
+TOKEN_WITH_PERMISSIONS = config('token_with_permissions', default=False, cast=bool)
+# bcrypt cost factor of new hashes, old hashes keep the cost they were made with
+BCRYPT_ROUNDS = config('bcrypt_rounds', default=12, cast=int)
+# 'jose' (default) or 'pyjwt', pyjwt is optional and has to be installed separately
+JWT_BACKEND = config('jwt_backend', default='jose')
 
-def generate_JWT(email:str,role:str):
+if JWT_BACKEND == 'pyjwt':
+    import jwt as pyjwt
+
+    def decode_signed(token:str, secret:str):
+        try:
+            return pyjwt.decode(token, secret, algorithms=[ALGORITHM])
+        except pyjwt.PyJWTError as e:
+            raise JWTError(str(e))
+else:
+    def decode_signed(token:str, secret:str):
+        return jwt.decode(token, secret, ALGORITHM)
+
+def generate_JWT(email:str,role:str, claims:dict | None = None):
+    """
+    Give back access and refresh token, extra claims like permissions
+    are only added to the access token while user id and username
+    are kept in refresh token to build a new access token
+    """
+    claims = claims or {}
     payload = {
         'user_identifier':email, 
         'role': role,
         # 'expiry': (datetime.datetime.now(datetime.UTC) + datetime.timedelta(minutes=ACCESS_EXPIRE_TIME)).date(),
-        'expiry': time.time() + 1200
+        'expiry': time.time() + 1200,
+        **claims
         }
     encoded_access = jwt.encode(payload,ACCESS_SECRET,algorithm=ALGORITHM)
     payload = {
         'user_identifier':email, 
         'role': role,
         # 'expiry': datetime.datetime.now(datetime.UTC) + datetime.timedelta(days=REFRESH_EXPIRE_TIME)
-        'expiry': time.time() + 604800
+        'expiry': time.time() + 604800,
+        **{key: claims[key] for key in ('user_id', 'username') if key in claims}
         }
     encoded_refresh = jwt.encode(payload,REFRESH_SECRET,ALGORITHM)
     return encoded_access, encoded_refresh
 
-def decodAccessJWT(token:str):
+def decodAccessJWT(token:str, use_cache:bool = True):
+    """
+    Verified claims of access token, tokens seen before are served from
+    token_cache without checking the signature again, expiry is always checked
+    """
+    now = time.time()
+    if use_cache:
+        cached = token_cache.get(token, now)
+        if cached is not None:
+            return dict(cached)
     try:
-        decode_token = jwt.decode(token,ACCESS_SECRET,ALGORITHM)
-        # return decode_token if decode_token['expiry'] >= time.time() else None
-        if decode_token['expiry'] >= time.time():
-            return decode_token
-        else:
-            raise HTTPException(
-                status_code=401,
-                detail="Expired Token"
-            )   
-            
+        decode_token = decode_signed(token,ACCESS_SECRET)
     except JWTError:
         raise HTTPException(
                     status_code=401,
                     detail="Token Verification failed"
-                )    
+                )
+    if decode_token['expiry'] >= now:
+        if use_cache:
+            token_cache.put(token, decode_token)
+        return dict(decode_token)
+    else:
+        raise HTTPException(
+            status_code=401,
+            detail="Expired Token"
+        )
 
 
-def decodRefreshJWT(token:str):
+def decodRefreshPayload(token:str):
     try:
-        decode_token = jwt.decode(token,REFRESH_SECRET,ALGORITHM)
-        # return decode_token if decode_token['expiry'] >= time.time() else None
+        decode_token = decode_signed(token,REFRESH_SECRET)
         if decode_token['expiry'] >= time.time():
-            new_token, _ = generate_JWT(decode_token['user_identifier'],decode_token['role'])
-            return new_token
+            return decode_token
         else:
             raise HTTPException(
                 status_code=401,
@@ -70,10 +106,16 @@ def decodRefreshJWT(token:str):
                 ) 
 
 
+def decodRefreshJWT(token:str):
+    decode_token = decodRefreshPayload(token)
+    new_token, _ = generate_JWT(decode_token['user_identifier'],decode_token['role'])
+    return new_token
+
+
 # Hash a password using bcrypt
 def hash_password(password):
     pwd_bytes = password.encode('UTF-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=BCRYPT_ROUNDS)
     hashed_password = bcrypt.hashpw(password=pwd_bytes, salt=salt)
     return hashed_password.decode()
 
@@ -82,4 +124,17 @@ def verify_password(plain_password:str, hashed_password):
     password_byte_enc = plain_password.encode('utf-8')
     hashed_password = hashed_password.encode('utf-8')
     return bcrypt.checkpw(password_byte_enc , hashed_password)
-    
\ No newline at end of file
+
+
+async def hash_password_async(password):
+    """
+    hash_password on the password pool, raises 503 when the pool is full
+    """
+    return await password_pool.run(hash_password, password)
+
+
+async def verify_password_async(plain_password:str, hashed_password):
+    """
+    verify_password on the password pool, raises 503 when the pool is full
+    """
+    return await password_pool.run(verify_password, plain_password, hashed_password)
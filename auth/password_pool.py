@@ -0,0 +1,66 @@
+import asyncio
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from decouple import config
+from fastapi import HTTPException
+import utils.constant_messages as constant_messages
+
+# 'thread' is enough as bcrypt releases the GIL, 'process' keeps
+# the hashing off the api process completely
+PASSWORD_POOL_KIND = config('password_pool_kind', default='thread')
+# Passwords hashed or checked at the same time
+PASSWORD_POOL_SIZE = config('password_pool_size', default=2, cast=int)
+# Password jobs allowed to wait for a worker, more are rejected with 503
+PASSWORD_QUEUE_LIMIT = config('password_queue_limit', default=32, cast=int)
+
+
+class PasswordPool:
+    """
+    Run bcrypt work on its own workers so it never blocks the event loop
+    or the thread pool that serves database calls.
+    At most `size + queue_limit` jobs are accepted at once, the rest
+    fail fast with 503 instead of piling up behind a login storm.
+    """
+
+    def __init__(self, kind: str, size: int, queue_limit: int):
+        self.kind = kind
+        self.size = size
+        self._slots = threading.BoundedSemaphore(size + queue_limit)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so importing the module doesn't fork workers
+        with self._executor_lock:
+            if self._executor is None:
+                if self.kind == 'process':
+                    self._executor = ProcessPoolExecutor(max_workers=self.size)
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='password')
+            return self._executor
+
+    async def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HTTPException(
+                status_code=503,
+                detail={
+                    "error": {
+                        "error_type": constant_messages.SERVICE_UNAVAILABLE,
+                        "error_message": constant_messages.PASSWORD_POOL_BUSY_MESSAGE
+                    }
+                },
+                headers={'Retry-After': '1'}
+            )
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+password_pool = PasswordPool(PASSWORD_POOL_KIND, PASSWORD_POOL_SIZE, PASSWORD_QUEUE_LIMIT)
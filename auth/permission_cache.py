@@ -0,0 +1,109 @@
+import select
+import threading
+import time
+from decouple import config
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# Seconds a loaded role -> permission map is trusted
+PERMISSION_CACHE_TTL = config('permission_cache_ttl', default=300, cast=int)
+# Invalidate the cache of every worker through postgres LISTEN/NOTIFY
+PERMISSION_CACHE_NOTIFY = config('permission_cache_notify', default=False, cast=bool)
+PERMISSION_CHANNEL = 'role_permission_changed'
+
+
+class RolePermissionCache:
+    """
+    In process cache of role id -> frozenset of permission names
+    and role id -> role version.
+    The maps for every role are loaded at once and trusted for `ttl` seconds
+    or until invalidate is called.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+        self.generation = 0
+        self._permissions = {}
+        self._versions = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def get(self, role_id: int):
+        """
+        Return permission names of role or None if the cache needs a reload
+        """
+        if not self.is_fresh():
+            return None
+        return self._permissions.get(role_id, frozenset())
+
+    def get_version(self, role_id: int):
+        """
+        Return version of role or None if the cache needs a reload
+        """
+        if not self.is_fresh():
+            return None
+        return self._versions.get(role_id)
+
+    def replace(self, permissions: dict, versions: dict, generation: int):
+        """
+        Store freshly loaded maps, unless they were invalidated while loading
+        """
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._permissions = permissions
+            self._versions = versions
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._loaded_at = None
+
+
+permission_cache = RolePermissionCache(PERMISSION_CACHE_TTL)
+
+
+def notify_role_change(session: Session):
+    """
+    Queue a notification for other workers, postgres delivers it on commit
+    """
+    if PERMISSION_CACHE_NOTIFY:
+        session.execute(text(f"NOTIFY {PERMISSION_CHANNEL}"))
+
+
+def _listen(engine, cache: RolePermissionCache):
+    while True:
+        try:
+            # Own connection outside of the pool, it is kept for the whole process
+            connection = engine.raw_connection()
+            connection.detach()
+            dbapi_connection = connection.dbapi_connection
+            dbapi_connection.autocommit = True
+            dbapi_connection.cursor().execute(f"LISTEN {PERMISSION_CHANNEL}")
+            # Changes made while we were not listening are unknown
+            cache.invalidate()
+            while True:
+                if select.select([dbapi_connection], [], [], 60) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                if dbapi_connection.notifies:
+                    dbapi_connection.notifies.clear()
+                    cache.invalidate()
+        except Exception as e:
+            print(f"Permission cache listener lost connection: {e}")
+            time.sleep(5)
+
+
+def start_listener(engine, cache: RolePermissionCache = permission_cache):
+    """
+    Start a daemon thread that invalidates the cache on every NOTIFY
+    """
+    if not PERMISSION_CACHE_NOTIFY:
+        return None
+    listener = threading.Thread(target=_listen, args=(engine, cache), daemon=True)
+    listener.start()
+    return listener
@@ -1,21 +1,66 @@
 from fastapi import Depends, HTTPException
 from utils.helper_function import token_in_header
+from database.database_connection import get_session, run_db
+from auth.permission_cache import permission_cache
 from models import Role
 
 # from fastapi.security import OAuth2PasswordBearer
 # token_in_header = OAuth2PasswordBearer(tokenUrl="/login")
 
+
+async def get_role_permissions(session, role_id: int):
+    """
+    Permission names of role, only touches the database when the cache is stale
+    """
+    permissions = permission_cache.get(role_id)
+    if permissions is None:
+        permissions = await run_db(session, Role.get_permissions, role_id)
+    return permissions
+
+
+async def get_role_version(session, role_id: int):
+    version = permission_cache.get_version(role_id)
+    if version is None:
+        version = await run_db(session, Role.get_version, role_id)
+    return version
+
+
+async def get_token_permissions(session, token: dict):
+    """
+    Permission names the token is allowed to use.
+    Tokens carrying permissions are trusted as long as the role
+    version in them still matches the current role version.
+    """
+    if 'permissions' not in token:
+        return await get_role_permissions(session, token['role'])
+    if token.get('role_version') != await get_role_version(session, token['role']):
+        raise HTTPException(
+            status_code=401,
+            detail="Permissions of your role changed, please login again")
+    return frozenset(token['permissions'])
+
+
+async def token_claims(session, user_id: int, username: str, role_id: int):
+    """
+    Extra claims for an access token that carries its permissions
+    """
+    permissions = await get_role_permissions(session, role_id)
+    return {
+        'user_id': user_id,
+        'username': username,
+        'permissions': sorted(permissions),
+        'role_version': await get_role_version(session, role_id)
+    }
+
+
 class PermissionChecker:
     def __init__(self, permissions_required: list):
         self.permissions_required = permissions_required
 
-    def __call__(self, user:dict = Depends(token_in_header)):
+    async def __call__(self, user:dict = Depends(token_in_header), session=Depends(get_session)):
+        permissions = await get_token_permissions(session, user)
         for permission_required in self.permissions_required:
-            print(permission_required)
-            # print(Role.get_role_permissions(user['role']))
-            is_permitted = Role.role_got_permission(permission_required,user['role'])
-            # if permission_required not in Role.get_role_permissions(user['role']):
-            if not is_permitted:
+            if permission_required not in permissions:
                 raise HTTPException(
                     status_code=403,
                     detail="Not enough permissions to access this resource")
@@ -25,15 +70,9 @@ class ContainPermission:
     def __init__(self, permissions_required: list):
         self.permissions_required = permissions_required
 
-    def __call__(self, user:dict = Depends(token_in_header)):
+    async def __call__(self, user:dict = Depends(token_in_header), session=Depends(get_session)):
+        permissions = await get_token_permissions(session, user)
         for permission_required in self.permissions_required:
-            print(permission_required)
-            # print(Role.get_role_permissions(user['role']))
-            is_permitted = Role.role_got_permission(permission_required,user['role'])            
-            # if permission_required not in Role.get_role_permissions(user['role']):
-            if not is_permitted:
-                # raise HTTPException(
-                #     status_code=403,
-                #     detail="Not enough permissions to access this resource")
+            if permission_required not in permissions:
                 return False
-        return True
\ No newline at end of file
+        return True
@@ -0,0 +1,58 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from decouple import config
+
+# Verified access tokens kept in memory, 0 turns the cache off
+TOKEN_CACHE_SIZE = config('token_cache_size', default=10000, cast=int)
+
+
+class TokenCache:
+    """
+    LRU cache of sha256(token) -> verified claims.
+    Only tokens whose signature was verified are put in, and an entry
+    is never given back after the `expiry` claim has passed.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._claims = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token: str):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str, now: float):
+        """
+        Claims of token or None when it is not cached or has expired
+        """
+        if not self.maxsize:
+            return None
+        key = self.key(token)
+        with self._lock:
+            claims = self._claims.get(key)
+            if claims is None:
+                return None
+            if claims['expiry'] < now:
+                del self._claims[key]
+                return None
+            self._claims.move_to_end(key)
+            return claims
+
+    def put(self, token: str, claims: dict):
+        if not self.maxsize:
+            return
+        key = self.key(token)
+        with self._lock:
+            self._claims[key] = claims
+            self._claims.move_to_end(key)
+            while len(self._claims) > self.maxsize:
+                self._claims.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._claims.clear()
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)
@@ -0,0 +1,104 @@
+"""
+Concurrency stress test of the borrow path against the database in .env
+
+Creates a book with `--copies` copies and `--borrowers` users, lets every
+user borrow the book at the same time from its own thread and session,
+then checks that exactly `--copies` borrows succeeded and that stock,
+records and the member_book table agree. Everything it creates is
+removed at the end.
+
+    python benchmarks/borrow_stress.py --copies 10 --borrowers 200
+
+Exits with status 1 when the book was oversold.
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+from sqlalchemy import Select, delete, func
+from database.database_connection import session_scope
+from models import Book, Genre, MemberBook, Publisher, Record, User
+
+
+def create_fixtures(prefix: str, copies: int, borrowers: int):
+    isbn = str(uuid.uuid4().int)[:13]
+    with session_scope() as session:
+        genre = Genre(name=f'{prefix}-genre')
+        publisher = Publisher(name=f'{prefix}-publisher')
+        session.add_all([genre, publisher])
+        session.flush()
+        session.add(Book(isbn_number=isbn, title=f'{prefix} book', author='stress', price=1,
+                         genre_id=genre.id, publisher_id=publisher.id, available_number=copies))
+        session.add_all([
+            User(username=f'{prefix}-{index}', email=f'{prefix}-{index}@stress.test',
+                 address='stress', password='-', role_id=4)
+            for index in range(borrowers)
+        ])
+        session.commit()
+    return isbn
+
+
+def remove_fixtures(prefix: str, isbn: str):
+    with session_scope() as session:
+        user_ids = Select(User.id).where(User.username.like(f'{prefix}-%'))
+        session.execute(delete(MemberBook).where(MemberBook.user_id.in_(user_ids)))
+        session.execute(delete(Record).where(Record.member_id.in_(user_ids)))
+        session.execute(delete(User).where(User.username.like(f'{prefix}-%')))
+        session.execute(delete(Book).where(Book.isbn_number == isbn))
+        session.execute(delete(Genre).where(Genre.name == f'{prefix}-genre'))
+        session.execute(delete(Publisher).where(Publisher.name == f'{prefix}-publisher'))
+        session.commit()
+
+
+def main(args):
+    prefix = f'stress-{uuid.uuid4().hex[:8]}'
+    isbn = create_fixtures(prefix, args.copies, args.borrowers)
+    start = threading.Barrier(args.borrowers)
+    user = User()
+
+    def borrow(index: int):
+        with session_scope() as session:
+            start.wait()
+            try:
+                user.borrow_book(session, f'{prefix}-{index}', isbn)
+                return 200
+            except HTTPException as e:
+                return e.status_code
+
+    try:
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.borrowers) as executor:
+            statuses = list(executor.map(borrow, range(args.borrowers)))
+        elapsed = time.perf_counter() - began
+
+        with session_scope() as session:
+            available = session.scalar(Select(Book.available_number).where(Book.isbn_number == isbn))
+            records = session.scalar(Select(func.count(Record.id)).where(Record.book_id == isbn))
+            members = session.scalar(Select(func.count(MemberBook.id)).where(MemberBook.book_id == isbn))
+    finally:
+        remove_fixtures(prefix, isbn)
+
+    borrowed = statuses.count(200)
+    print(f"borrowers={args.borrowers} copies={args.copies} borrowed={borrowed} "
+          f"rejected={statuses.count(409)} other={len(statuses) - borrowed - statuses.count(409)} "
+          f"available_after={available} records={records} member_book={members} "
+          f"elapsed={elapsed:.3f}s borrows/s={args.borrowers / elapsed:.0f}")
+    oversold = borrowed > args.copies or available < 0 or records != borrowed or members != borrowed
+    if oversold:
+        print("FAIL: book was oversold or records don't match the stock")
+        sys.exit(1)
+    print("OK: no oversell")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--copies', type=int, default=10)
+    parser.add_argument('--borrowers', type=int, default=200)
+    main(parser.parse_args())
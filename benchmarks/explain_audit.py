@@ -0,0 +1,173 @@
+"""
+Index audit of the queries models.py sends, against the database in .env
+
+Runs the borrow, return, batch, lookup and listing paths of models.py, the
+catalogue search (two pages, by a word of the sample book's title and with a
+typo) and the daily mail query on a sample user, book and magazine of the database,
+records every statement they send and runs EXPLAIN ANALYZE on each of them.
+Sequential scans of tables with more than `--min-rows` rows are flagged,
+small tables like roles or genre are fine to scan. Everything runs in one
+transaction that is rolled back, the database is left as it was.
+
+Seed the database with a realistic amount of history first, an empty
+records table gives no useful plans.
+
+    python benchmarks/explain_audit.py --min-rows 1000
+
+Exits with status 1 when a flagged scan is found.
+"""
+import argparse
+import datetime
+import os
+import sys
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import HTTPException
+from sqlalchemy import Select, event, text
+from sqlalchemy.orm import Session
+from database.database_connection import engine
+from daily_mail import open_loans_statement
+from models import Book, Genre, Magazine, Publisher, User
+from utils.search import search_catalogue
+
+EXPLAINED = ('select', 'insert', 'update', 'delete', 'with')
+
+
+@contextmanager
+def capture(connection, statements: list, step: list):
+    """
+    Append (step name, statement, parameters) of every statement sent on connection
+    """
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().lower().startswith(EXPLAINED):
+            statements.append((step[0], statement, parameters))
+
+    event.listen(connection, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield
+    finally:
+        event.remove(connection, 'before_cursor_execute', before_cursor_execute)
+
+
+def sample(session: Session):
+    """
+    A member, a book and a magazine in stock to run the paths with,
+    and the longest word of the book's title to search for
+    """
+    username = session.scalar(Select(User.username).where(User.role_id >= 2).order_by(User.id).limit(1))
+    isbn = session.scalar(Select(Book.isbn_number).where(Book.available_number > 0).limit(1))
+    issn = session.scalar(Select(Magazine.issn_number).where(Magazine.available_number > 0).limit(1))
+    if not (username and isbn and issn):
+        sys.exit("The database needs at least one member and one book and magazine in stock")
+    word = max(session.scalar(Select(Book.title).where(Book.isbn_number == isbn)).split(), key=len)
+    return username, isbn, issn, word
+
+
+def search_pages(session: Session, q: str):
+    """
+    First and second page of a search, the second one goes through the cursor
+    """
+    _, next_cursor = search_catalogue(session, q, limit=5)
+    if next_cursor:
+        search_catalogue(session, q, limit=5, cursor=next_cursor)
+
+
+def workload(session: Session, username: str, isbn: str, issn: str, word: str):
+    """
+    (step name, callable) of every path to audit, in the order they run
+    """
+    user, book, magazine = User(), Book(), Magazine()
+    return [
+        ('user.get_from_username', lambda: user.get_from_username(session, username)),
+        ('user.get_all_borrowed', lambda: user.get_all_borrowed(session, username)),
+        ('book.get_from_id', lambda: book.get_from_id(session, isbn)),
+        ('magazine.get_from_id', lambda: magazine.get_from_id(session, issn)),
+        ('genre.get_from_id', lambda: Genre().get_from_id(session, 1)),
+        ('publisher.get_from_id', lambda: Publisher().get_from_id(session, 1)),
+        ('book.get_all', lambda: book.get_all(session, False, 1, 10)),
+        ('magazine.get_all', lambda: magazine.get_all(session, 1, False, 10)),
+        ('user.borrow_book', lambda: user.borrow_book(session, username, isbn)),
+        ('user.return_book', lambda: user.return_book(session, username, isbn)),
+        ('user.borrow_magazine', lambda: user.borrow_magazine(session, username, issn)),
+        ('user.return_magazine', lambda: user.return_magazine(session, username, issn)),
+        ('user.borrow_batch', lambda: user.borrow_batch(session, username, [isbn], [issn])),
+        ('user.return_batch', lambda: user.return_batch(session, username, [isbn], [issn])),
+        ('search_catalogue', lambda: search_pages(session, word)),
+        ('search_catalogue typo', lambda: search_pages(session, word[:-1] + 'x')),
+        ('daily_mail.open_loans_statement',
+         lambda: session.execute(open_loans_statement(datetime.date.today())).all()),
+    ]
+
+
+def seq_scans(plan: dict):
+    """
+    Yield every Seq Scan node of a json plan
+    """
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+
+def table_sizes(connection):
+    return dict(connection.execute(text(
+        "SELECT relname, reltuples::bigint FROM pg_class WHERE relkind = 'r' "
+        "AND relnamespace = 'public'::regnamespace")).all())
+
+
+def audit(min_rows: int):
+    """
+    Returns -> number of flagged sequential scans
+    """
+    flagged = 0
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            # Commits of the model methods only release a savepoint
+            session = Session(bind=connection, join_transaction_mode='create_savepoint')
+            username, isbn, issn, word = sample(session)
+            statements = []
+            step = [None]
+            with capture(connection, statements, step):
+                for step[0], run in workload(session, username, isbn, issn, word):
+                    try:
+                        run()
+                    except HTTPException as e:
+                        print(f"{step[0]}: {e.detail}")
+                        session.rollback()
+            session.close()
+
+            sizes = table_sizes(connection)
+            for step_name, statement, parameters in statements:
+                savepoint = connection.begin_nested()
+                plan = connection.exec_driver_sql(
+                    "EXPLAIN (ANALYZE, FORMAT JSON) " + statement, parameters).scalar()[0]
+                savepoint.rollback()
+                scans = [scan for scan in seq_scans(plan['Plan'])
+                         if sizes.get(scan['Relation Name'], 0) > min_rows]
+                flagged += len(scans)
+                print(f"{'SEQ SCAN' if scans else 'ok':<8} {plan['Execution Time']:>9.3f} ms  {step_name}: "
+                      f"{' '.join(statement.split())[:100]}")
+                for scan in scans:
+                    print(f"         seq scan on {scan['Relation Name']} ({sizes[scan['Relation Name']]} rows)"
+                          f"{', filter ' + scan['Filter'] if 'Filter' in scan else ''}")
+        finally:
+            transaction.rollback()
+    return flagged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--min-rows', type=int, default=1000,
+                        help='sequential scans of smaller tables are not flagged')
+    args = parser.parse_args()
+
+    flagged = audit(args.min_rows)
+    print(f"{flagged} sequential scans on tables over {args.min_rows} rows")
+    sys.exit(1 if flagged else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Access tokens verified per second by decodAccessJWT, with and without
+the decoded token cache, for every installed JWT backend.
+
+Every backend runs in its own process because it is picked at import.
+
+    python benchmarks/jwt_benchmark.py --tokens 100 --seconds 2
+
+`--tokens` distinct tokens are verified round robin, like that many
+clients each sending their own bearer token.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def measure(decode, tokens: list, seconds: float):
+    verified = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for token in tokens:
+            decode(token)
+        verified += len(tokens)
+    return verified / (time.perf_counter() - start)
+
+
+def run(tokens: int, seconds: float):
+    from auth import auth
+    from auth.token_cache import token_cache
+
+    token_list = [
+        auth.generate_JWT(f'user{index}@lms.com', role=4,
+                          claims={'user_id': index, 'username': f'user{index}'})[0]
+        for index in range(tokens)
+    ]
+    uncached = measure(lambda token: auth.decodAccessJWT(token, use_cache=False), token_list, seconds)
+    token_cache.clear()
+    cached = measure(auth.decodAccessJWT, token_list, seconds)
+    return {'backend': auth.JWT_BACKEND, 'uncached': uncached, 'cached': cached}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--backend', choices=['jose', 'pyjwt'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        print(json.dumps(run(args.tokens, args.seconds)))
+        return
+
+    for backend in ('jose', 'pyjwt'):
+        process = subprocess.run(
+            [sys.executable, __file__, '--backend', backend,
+             '--tokens', str(args.tokens), '--seconds', str(args.seconds)],
+            capture_output=True, text=True, env={**os.environ, 'jwt_backend': backend})
+        if process.returncode:
+            print(f"{backend:<6} skipped: {process.stderr.strip().splitlines()[-1]}")
+            continue
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        print(f"{result['backend']:<6} uncached={result['uncached']:>10.0f}/s "
+              f"cached={result['cached']:>10.0f}/s "
+              f"speedup={result['cached'] / result['uncached']:>6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Load benchmark for `/book` and `/user/borrow_book`
+
+Start the api once with `database_mode=sync` and once with
+`database_mode=async` in .env, run this script against each and
+compare the requests/sec and p99 printed for every route.
+
+    uvicorn main:app --workers 1
+    python benchmarks/load_benchmark.py --label sync \\
+        --email admin@lms.com --password admin \\
+        --isbn 9780000000001 --usernames test1,test2,test3
+
+Each borrow is followed by a return of the same book so the
+benchmark can run repeatedly against the same data.
+"""
+import argparse
+import asyncio
+import time
+import httpx
+
+
+def percentile(values: list[float], percent: float):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def report(label: str, route: str, latencies: list[float], statuses: dict, elapsed: float):
+    print(
+        f"[{label}] {route:<20} requests={len(latencies):<6} "
+        f"rps={len(latencies) / elapsed:>8.1f} "
+        f"p50={percentile(latencies, 50) * 1000:>7.1f}ms "
+        f"p99={percentile(latencies, 99) * 1000:>7.1f}ms "
+        f"status={statuses}"
+    )
+
+
+async def timed(client: httpx.AsyncClient, method: str, path: str, latencies: list, statuses: dict, **kwargs):
+    start = time.perf_counter()
+    response = await client.request(method, path, **kwargs)
+    latencies.append(time.perf_counter() - start)
+    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return response
+
+
+async def run_list_books(client, total: int, concurrency: int, limit: int):
+    latencies, statuses = [], {}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await timed(client, 'GET', '/book', latencies, statuses, params={'limit': limit})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+async def run_borrow_books(client, total: int, usernames: list[str], isbn: str, headers: dict):
+    # One worker per username, a user can only hold one copy of a book at once
+    latencies, statuses = [], {}
+    per_user = max(1, total // len(usernames))
+
+    async def worker(username: str):
+        body = {'username': username, 'isbn': isbn}
+        for _ in range(per_user):
+            await timed(client, 'POST', '/user/borrow_book', latencies, statuses, json=body, headers=headers)
+            await client.post('/user/return_book', json=body, headers=headers)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(username) for username in usernames))
+    return latencies, statuses, time.perf_counter() - start
+
+
+async def main(args):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        login = await client.post('/login', json={'email': args.email, 'password': args.password})
+        login.raise_for_status()
+        headers = {'Authorization': f"Bearer {login.json()['access_token']}"}
+
+        report(args.label, '/book', *await run_list_books(client, args.requests, args.concurrency, args.limit))
+        usernames = args.usernames.split(',')
+        report(args.label, '/user/borrow_book',
+               *await run_borrow_books(client, args.requests, usernames, args.isbn, headers))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--label', default='api', help='name printed with results, e.g. sync or async')
+    parser.add_argument('--email', required=True, help='email of an admin user')
+    parser.add_argument('--password', required=True)
+    parser.add_argument('--isbn', required=True, help='isbn of a book with enough copies available')
+    parser.add_argument('--usernames', required=True, help='comma separated usernames to borrow for')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--limit', type=int, default=20, help='page size used for /book')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,200 @@
+"""
+Load test of a mixed member workload against a running api
+
+Every virtual user logs in as its own seeded member and then, until
+`--duration` is over, picks a route from `--mix` by weight: list books,
+get one book, borrow a book, return a book it holds, list its own loans,
+or log in again. Throughput, latency percentiles and status codes are
+reported per route. Run it against a database filled by seed_data.py:
+
+    alembic upgrade head
+    python benchmarks/seed_data.py --truncate
+    uvicorn main:app --workers 4
+    python benchmarks/load_test.py --users 100 --duration 60 --output after.json --baseline before.json
+
+With `--baseline` every route is compared with the json of an earlier run
+and the script exits with status 1 when a route got `--tolerance` slower
+at p99 or lost that much throughput.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_benchmark import percentile
+
+DEFAULT_MIX = 'book=30,book_item=30,borrow_book=12,return_book=12,me_borrowed=15,login=1'
+
+
+# Same members and books as seed_data.py creates, without importing the app
+def username(index: int):
+    return f'member{index}'
+
+
+def email(index: int):
+    return f'member{index}@lms.com'
+
+
+def isbn(index: int):
+    return str(9780000000000 + index)
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+
+    def add(self, latency: float, status: int):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def summary(self, elapsed: float):
+        return {
+            'requests': len(self.latencies),
+            'rps': len(self.latencies) / elapsed,
+            'p50_ms': percentile(self.latencies, 50) * 1000,
+            'p95_ms': percentile(self.latencies, 95) * 1000,
+            'p99_ms': percentile(self.latencies, 99) * 1000,
+            'server_errors': sum(count for status, count in self.statuses.items() if status >= 500),
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+        }
+
+
+class VirtualUser:
+    """
+    One member clicking through the api, borrowed books are remembered
+    so returns hit books it really holds
+    """
+
+    def __init__(self, client: httpx.AsyncClient, index: int, args, stats: dict, rng: random.Random):
+        self.client = client
+        self.username = username(index)
+        self.email = email(index)
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.headers = {}
+        self.borrowed = []
+
+    async def request(self, route: str, method: str, path: str, **kwargs):
+        start = time.perf_counter()
+        response = await self.client.request(method, path, **kwargs)
+        self.stats.setdefault(route, RouteStats()).add(time.perf_counter() - start, response.status_code)
+        return response
+
+    async def login(self):
+        response = await self.request('/login', 'POST', '/login',
+                                      json={'email': self.email, 'password': self.args.password})
+        if response.status_code == 200:
+            self.headers = {'Authorization': f"Bearer {response.json()['access_token']}"}
+
+    async def book(self):
+        await self.request('/book', 'GET', '/book', params={'limit': self.args.limit})
+
+    async def book_item(self):
+        await self.request('/book/{isbn}', 'GET', f'/book/{isbn(self.rng.randrange(self.args.books))}')
+
+    async def borrow_book(self):
+        book = isbn(self.rng.randrange(self.args.books))
+        response = await self.request('/user/borrow_book', 'POST', '/user/borrow_book', headers=self.headers,
+                                      json={'username': self.username, 'isbn': book})
+        if response.status_code == 200:
+            self.borrowed.append(book)
+
+    async def return_book(self):
+        if not self.borrowed:
+            return await self.borrow_book()
+        book = self.borrowed.pop(self.rng.randrange(len(self.borrowed)))
+        await self.request('/user/return_book', 'POST', '/user/return_book', headers=self.headers,
+                           json={'username': self.username, 'isbn': book})
+
+    async def me_borrowed(self):
+        await self.request('/me/borrowed', 'GET', '/me/borrowed', headers=self.headers)
+
+    async def run(self, actions: list, weights: list, until: float):
+        await self.login()
+        while time.perf_counter() < until:
+            await getattr(self, self.rng.choices(actions, weights)[0])()
+        # Give back what was borrowed so the next run starts from the same stock
+        while self.borrowed:
+            await self.client.post('/user/return_book', headers=self.headers,
+                                   json={'username': self.username, 'isbn': self.borrowed.pop()})
+
+
+def parse_mix(mix: str):
+    actions, weights = [], []
+    for part in mix.split(','):
+        action, weight = part.split('=')
+        if not hasattr(VirtualUser, action) or action in ('run', 'request'):
+            raise SystemExit(f"Unknown action {action} in --mix")
+        actions.append(action)
+        weights.append(float(weight))
+    return actions, weights
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """
+    Returns -> list of regression messages
+    """
+    regressions = []
+    for route, result in results.items():
+        before = baseline.get(route)
+        if not before:
+            continue
+        if result['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{route}: p99 {before['p99_ms']:.1f}ms -> {result['p99_ms']:.1f}ms")
+        if result['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f"{route}: rps {before['rps']:.1f} -> {result['rps']:.1f}")
+    return regressions
+
+
+async def main(args):
+    actions, weights = parse_mix(args.mix)
+    stats = {}
+    limits = httpx.Limits(max_connections=args.users)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60) as client:
+        start = time.perf_counter()
+        until = start + args.duration
+        await asyncio.gather(*(
+            VirtualUser(client, index, args, stats, random.Random(args.seed + index)).run(actions, weights, until)
+            for index in range(args.users)
+        ))
+        elapsed = time.perf_counter() - start
+
+    results = {route: route_stats.summary(elapsed) for route, route_stats in sorted(stats.items())}
+    for route, result in results.items():
+        print(f"{route:<20} requests={result['requests']:<7} rps={result['rps']:>8.1f} "
+              f"p50={result['p50_ms']:>7.1f}ms p95={result['p95_ms']:>7.1f}ms p99={result['p99_ms']:>7.1f}ms "
+              f"status={result['statuses']}")
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--users', type=int, default=50, help='virtual users, each one a different seeded member')
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='action=weight pairs')
+    parser.add_argument('--books', type=int, default=100000, help='--books given to seed_data.py')
+    parser.add_argument('--password', default='password', help='--password given to seed_data.py')
+    parser.add_argument('--limit', type=int, default=20, help='page size used for /book')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the results as json')
+    parser.add_argument('--baseline', help='json of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed change against the baseline')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,67 @@
+"""
+Mails per second of the old one connection per mail sending against the
+MailDispatcher, offline against the in process MemoryBackend.
+
+The backend sleeps `--connect-latency` seconds for every new connection
+(TLS handshake and login) and `--send-latency` seconds for every mail,
+roughly what a remote SMTP server costs.
+
+    python benchmarks/mail_benchmark.py --mails 500 --pool-size 8
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.mail_dispatcher import MailDispatcher, MemoryBackend
+from utils.send_mail import digest_message
+
+
+def messages(count: int):
+    for index in range(count):
+        yield digest_message(f'member{index}@lms.com', f'member{index}',
+                             [('Book', f'Book {index}', '2024-05-01')],
+                             [('Magazine', f'Magazine {index}', '2024-04-01', 30)], 30)
+
+
+def serial(backend: MemoryBackend, count: int):
+    """The way send_mail used to work, a new connection for every mail"""
+    for message in messages(count):
+        connection = backend.connect()
+        connection.send_message(message)
+        connection.quit()
+
+
+def dispatched(backend: MemoryBackend, count: int, pool_size: int, rate_limit: float):
+    dispatcher = MailDispatcher(backend, pool_size=pool_size, rate_limit=rate_limit)
+    failed = sum(not result.sent for result in dispatcher.send_all(messages(count)))
+    dispatcher.close()
+    assert not failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mails', type=int, default=500)
+    parser.add_argument('--pool-size', type=int, default=8)
+    parser.add_argument('--rate-limit', type=float, default=0, help='mails per second, 0 for no limit')
+    parser.add_argument('--connect-latency', type=float, default=0.3)
+    parser.add_argument('--send-latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    for name, run in (
+        ('serial', lambda backend: serial(backend, args.mails)),
+        ('dispatcher', lambda backend: dispatched(backend, args.mails, args.pool_size, args.rate_limit)),
+    ):
+        backend = MemoryBackend(args.connect_latency, args.send_latency)
+        start = time.perf_counter()
+        run(backend)
+        elapsed = time.perf_counter() - start
+        assert len(backend.outbox) == args.mails
+        print(f"{name:<10} {args.mails} mails in {elapsed:>7.2f}s "
+              f"({args.mails / elapsed:>7.1f}/s, {backend.connections} connections)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Compare the old buffering BaseHTTPMiddleware logger with the pure ASGI
+LogMiddleware on large list responses.
+
+Every middleware runs in its own process so peak RSS is not shared.
+
+    python benchmarks/middleware_benchmark.py --items 50000 --requests 50
+
+Log records are written to /dev/null so only the middleware cost is measured.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_app(middleware: str, items: int):
+    from fastapi import FastAPI, Response
+    from starlette.middleware.base import BaseHTTPMiddleware
+    from utils.helper_function import LogMiddleware, logger
+
+    logger.handlers = [logging.StreamHandler(open(os.devnull, 'w'))]
+
+    class BufferingLogMiddleware(BaseHTTPMiddleware):
+        """The LogMiddleware this repo used before, kept here for comparison"""
+
+        async def dispatch(self, request, call_next):
+            logger.info(f"Request: {request.url}")
+            start_time = time.time()
+            response = await call_next(request)
+            process_time = time.time() - start_time
+            body = b''.join([section async for section in response.body_iterator])
+            logger.info(f"Response body: {body.decode('utf-8')} Process time: {process_time}")
+            response.headers['X-Process-Time'] = str(process_time)
+            return Response(content=body, status_code=response.status_code,
+                            headers=dict(response.headers), media_type=response.media_type)
+
+    app = FastAPI()
+    catalogue = [
+        {'isbn_number': f'{index:013d}', 'title': f'Book {index}', 'author': 'Author',
+         'price': 100, 'genre_id': 1, 'publisher_id': 1, 'available_number': 5}
+        for index in range(items)
+    ]
+
+    @app.get('/book')
+    async def list_books():
+        return {'Books': catalogue}
+
+    if middleware == 'buffering':
+        app.add_middleware(BufferingLogMiddleware)
+    else:
+        app.add_middleware(LogMiddleware)
+    return app
+
+
+async def run(middleware: str, items: int, requests: int):
+    import httpx
+    app = build_app(middleware, items)
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = await client.get('/book')
+            latencies.append(time.perf_counter() - start)
+            assert 'x-process-time' in response.headers
+    latencies.sort()
+    return {
+        'middleware': middleware,
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        # ru_maxrss is in KiB on linux
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=50000, help='items in the /book response')
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--middleware', choices=['buffering', 'asgi'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.middleware:
+        print(json.dumps(asyncio.run(run(args.middleware, args.items, args.requests))))
+        return
+
+    for middleware in ('buffering', 'asgi'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--middleware', middleware,
+             '--items', str(args.items), '--requests', str(args.requests)],
+            capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{result['middleware']:<10} mean={result['mean_ms']:>8.1f}ms "
+              f"p99={result['p99_ms']:>8.1f}ms peak_rss={result['peak_rss_mb']:>7.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+"""
+Fill the database in .env with a synthetic library through COPY
+
+Meant for a disposable local database with the schema of `alembic upgrade head`:
+
+    docker run --rm -d -p 5432:5432 -e POSTGRES_USER=lms -e POSTGRES_PASSWORD=lms postgres:16
+    alembic upgrade head
+    python benchmarks/seed_data.py --books 1000000 --users 100000 --records 10000000
+
+Rows are generated from `--seed` so every run gives the same data, and are
+streamed into COPY so memory use stays flat for any volume. Members are
+`member<n>` / `member<n>@lms.com`, books have isbn 9780000000000 + n and
+magazines issn 10000000 + n, all sharing `--password`. `--open-share` of
+the records are open loans, the rest is returned history.
+
+COPY runs with session_replication_role=replica when the database user may
+set it, which skips foreign key checks and triggers while loading.
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Select, func, text
+from sqlalchemy.exc import ProgrammingError
+from auth import auth
+from database.database_connection import engine, session_scope
+from models import Book, Permission, Role, RolePermission
+
+ISBN_BASE = 9780000000000
+ISSN_BASE = 10000000
+ADMIN_EMAIL = 'admin@lms.com'
+# Roles the api refers to by id or name, with their permissions
+ROLES = {
+    1: ('admin', ['admin:all', 'user:all', 'user:verified']),
+    2: ('verified user', ['user:verified']),
+    4: ('user', ['user:unverified']),
+}
+SEEDED_TABLES = ['records', 'member_book', 'member_magazine', 'books', 'magazines', 'genre', 'publishers', 'users']
+WORDS = ['river', 'night', 'garden', 'shadow', 'empire', 'silent', 'journey', 'history', 'secret',
+         'stone', 'winter', 'ocean', 'mountain', 'letters', 'kingdom', 'science', 'dream', 'city',
+         'fire', 'golden', 'lost', 'modern', 'house', 'song', 'world', 'life', 'war', 'light']
+NAMES = ['Asha', 'Bikash', 'Chen', 'Diego', 'Emma', 'Farah', 'Gita', 'Hari', 'Ivan', 'Jun',
+         'Kiran', 'Lena', 'Maya', 'Nabin', 'Omar', 'Priya', 'Ravi', 'Sara', 'Tom', 'Uma']
+NULL = '\\N'
+
+
+def isbn(index: int):
+    return str(ISBN_BASE + index)
+
+
+def issn(index: int):
+    return str(ISSN_BASE + index)
+
+
+def username(index: int):
+    return f'member{index}'
+
+
+def email(index: int):
+    return f'member{index}@lms.com'
+
+
+def member_id(index: int):
+    # id 1 is the admin
+    return index + 2
+
+
+class RowStream:
+    """
+    File like object that COPY reads generated rows from in text format
+    """
+
+    def __init__(self, rows):
+        self.lines = (
+            ('\t'.join(NULL if value is None else str(value) for value in row) + '\n').encode()
+            for row in rows
+        )
+        self.buffer = b''
+        self.rows = 0
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+        for line in self.lines:
+            chunks.append(line)
+            length += len(line)
+            self.rows += 1
+            if 0 <= size <= length:
+                break
+        data = b''.join(chunks)
+        if size < 0:
+            self.buffer = b''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def copy(cursor, table: str, columns: list, rows):
+    start = time.perf_counter()
+    stream = RowStream(rows)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", stream, size=1 << 16)
+    elapsed = time.perf_counter() - start
+    print(f"{table:<16} {stream.rows:>10} rows in {elapsed:>7.1f}s ({stream.rows / max(elapsed, 1e-9):>9.0f} rows/s)")
+
+
+def title(rng: random.Random, index: int):
+    return f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {rng.choice(WORDS)} {index}"
+
+
+def person(rng: random.Random):
+    return f"{rng.choice(NAMES)} {rng.choice(NAMES)}"
+
+
+def item_rows(rng: random.Random, count: int, key, args):
+    for index in range(count):
+        yield (key(index), title(rng, index), person(rng), rng.randint(100, 3000),
+               index % args.genres + 1, index % args.publishers + 1, rng.randint(0, 10))
+
+
+def user_rows(rng: random.Random, args, password: str):
+    today = datetime.date.today()
+    yield (1, 'admin', ADMIN_EMAIL, password, today, today + datetime.timedelta(days=3650), 'Library', None, 0, 1)
+    for index in range(args.users):
+        created = today - datetime.timedelta(days=rng.randint(0, 1000))
+        yield (member_id(index), username(index), email(index), password, created,
+               created + datetime.timedelta(days=60), f'{rng.randint(1, 999)} {rng.choice(WORDS).title()} Street',
+               9800000000 + index, 0, 4)
+
+
+def open_loans(args):
+    """
+    Yield (member index, 'book' or 'magazine', item index, issued date) of every open loan.
+    A member never holds the same item twice, like the borrow paths ensure.
+    """
+    rng = random.Random(args.seed + 1)
+    today = datetime.date.today()
+    counters = {'book': 0, 'magazine': 0}
+    sizes = {'book': args.books, 'magazine': args.magazines}
+    for _ in range(int(args.records * args.open_share)):
+        kind = 'magazine' if args.magazines and rng.random() < args.magazine_share else 'book'
+        loan = counters[kind]
+        counters[kind] += 1
+        member = loan % args.users
+        if loan // args.users >= sizes[kind]:
+            continue
+        item = (loan // args.users + member * 7919) % sizes[kind]
+        yield member, kind, item, today - datetime.timedelta(days=rng.randint(0, 25))
+
+
+def record_rows(rng: random.Random, args):
+    today = datetime.date.today()
+    history = args.records - int(args.records * args.open_share)
+    for _ in range(history):
+        issued = today - datetime.timedelta(days=rng.randint(30, 1100))
+        if args.magazines and rng.random() < args.magazine_share:
+            item = rng.randrange(args.magazines)
+            book_id, magazine_id = None, issn(item)
+        else:
+            item = rng.randrange(args.books)
+            book_id, magazine_id = isbn(item), None
+        yield (member_id(rng.randrange(args.users)), book_id, magazine_id, item % args.genres + 1, issued,
+               issued + datetime.timedelta(days=rng.randint(1, 25)), issued + datetime.timedelta(days=15), True)
+    for member, kind, item, issued in open_loans(args):
+        book_id, magazine_id = (isbn(item), None) if kind == 'book' else (None, issn(item))
+        yield (member_id(member), book_id, magazine_id, item % args.genres + 1, issued,
+               None, issued + datetime.timedelta(days=15), False)
+
+
+def seed_roles():
+    """
+    Roles and permissions the api needs, only the missing ones are added
+    """
+    with session_scope() as session:
+        for role_id, (name, permissions) in ROLES.items():
+            if session.get(Role, role_id) is None:
+                session.add(Role(id=role_id, name=name))
+            for permission_name in permissions:
+                permission = Permission.get_permission_object(session, permission_name)
+                if permission is None:
+                    permission = Permission(name=permission_name)
+                    session.add(permission)
+                    session.flush()
+                exists = session.scalar(Select(RolePermission.id).where(
+                    RolePermission.role_id == role_id, RolePermission.permission_id == permission.id))
+                if exists is None:
+                    session.add(RolePermission(role_id=role_id, permission_id=permission.id))
+        session.flush()
+        session.execute(text("SELECT setval(pg_get_serial_sequence('roles', 'id'), (SELECT max(id) FROM roles))"))
+        session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--genres', type=int, default=50)
+    parser.add_argument('--publishers', type=int, default=500)
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--magazines', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--records', type=int, default=1000000)
+    parser.add_argument('--open-share', type=float, default=0.02, help='share of records that are open loans')
+    parser.add_argument('--magazine-share', type=float, default=0.2, help='share of loans that are magazines')
+    parser.add_argument('--password', default='password', help='password of every seeded user')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--truncate', action='store_true', help='empty the seeded tables first')
+    args = parser.parse_args()
+    if args.books < 1 or args.users < 1:
+        parser.error('--books and --users must be at least 1')
+
+    with session_scope() as session:
+        if args.truncate:
+            session.execute(text(f"TRUNCATE {', '.join(SEEDED_TABLES)} RESTART IDENTITY CASCADE"))
+            session.commit()
+        elif session.scalar(Select(func.count()).select_from(Book)):
+            sys.exit('The catalogue is not empty, run with --truncate to replace it')
+    seed_roles()
+
+    rng = random.Random(args.seed)
+    password = auth.hash_password(args.password)
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SET session_replication_role = replica")
+        except Exception as e:
+            connection.rollback()
+            print(f"Loading with triggers and foreign key checks on: {e}".strip())
+            cursor = connection.cursor()
+
+        copy(cursor, 'genre', ['id', 'name'],
+             ((index + 1, f'Genre {index + 1}') for index in range(args.genres)))
+        copy(cursor, 'publishers', ['id', 'name', 'address', 'phone_number'],
+             ((index + 1, f'Publisher {index + 1}', f'{rng.choice(WORDS).title()} Road', 14000000 + index)
+              for index in range(args.publishers)))
+        copy(cursor, 'books', ['isbn_number', 'title', 'author', 'price', 'genre_id', 'publisher_id',
+                               'available_number'], item_rows(rng, args.books, isbn, args))
+        copy(cursor, 'magazines', ['issn_number', 'title', 'editor', 'price', 'genre_id', 'publisher_id',
+                                   'available_number'], item_rows(rng, args.magazines, issn, args))
+        copy(cursor, 'users', ['id', 'username', 'email', 'password', 'date_created', 'expiry_date', 'address',
+                               'phone_number', 'fine', 'role_id'], user_rows(rng, args, password))
+        copy(cursor, 'records', ['member_id', 'book_id', 'magazine_id', 'genre_id', 'issued_date', 'returned_date',
+                                 'expected_return_date', 'returned'], record_rows(rng, args))
+        copy(cursor, 'member_book', ['user_id', 'book_id'],
+             ((member_id(member), isbn(item)) for member, kind, item, _ in open_loans(args) if kind == 'book'))
+        copy(cursor, 'member_magazine', ['user_id', 'magazine_id'],
+             ((member_id(member), issn(item)) for member, kind, item, _ in open_loans(args) if kind == 'magazine'))
+
+        # Explicit ids were copied, move the sequences past them
+        for table in ('genre', 'publishers', 'users'):
+            cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))")
+        connection.commit()
+    finally:
+        connection.close()
+
+    with session_scope() as session:
+        try:
+            # The version triggers were skipped, clients must not keep old ETags
+            session.execute(text("UPDATE catalogue_versions SET version = version + 1"))
+            session.commit()
+        except ProgrammingError:
+            session.rollback()
+    with engine.connect() as connection:
+        connection.execution_options(isolation_level='AUTOCOMMIT').execute(text("ANALYZE"))
+    print(f"Seeded, login as {email(0)} or {ADMIN_EMAIL} with password '{args.password}'")
+
+
+if __name__ == '__main__':
+    main()
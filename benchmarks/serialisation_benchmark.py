@@ -0,0 +1,106 @@
+"""
+Per item cost of turning a page of books into a response body, the way
+FastAPI does it for a route without a response model (jsonable_encoder
+and JSONResponse, how /book answered before) and for a route with
+BookPage as response model and ORJSONResponse, fed with ORM instances,
+with column rows and with the dicts of read_rows that the listings use.
+Loading the page from the database is timed too.
+
+    python benchmarks/serialisation_benchmark.py --items 1000 --repeat 50
+
+The books are loaded from an in memory sqlite database, no server or
+Postgres is needed. All ways must give the same json, the script exits
+with status 1 when they don't.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+from sqlalchemy import Select, create_engine, insert
+from sqlalchemy.orm import Session
+from database.database_connection import read_rows
+from models import Book
+from utils.schema import BookPage
+
+
+def book_database(items: int):
+    engine = create_engine('sqlite://')
+    Book.__table__.create(engine)
+    with engine.begin() as connection:
+        connection.execute(insert(Book), [
+            {'isbn_number': str(9780000000000 + index), 'title': f'Title of book {index}', 'author': 'Folklore',
+             'price': 100 + index % 900, 'genre_id': index % 50 + 1, 'publisher_id': index % 500 + 1,
+             'available_number': index % 10}
+            for index in range(items)
+        ])
+    return engine
+
+
+LOADERS = {
+    'orm': lambda session: session.scalars(Select(Book).order_by(Book.isbn_number)).all(),
+    'rows': lambda session: session.execute(Select(*Book.__table__.columns).order_by(Book.isbn_number)).all(),
+    'read_rows': lambda session: read_rows(session, Select(*Book.__table__.columns).order_by(Book.isbn_number)),
+}
+
+
+async def render(field, response_class, books: list):
+    content = await serialize_response(field=field, response_content={'Books': books, 'next_cursor': None})
+    return response_class(content).body
+
+
+async def measure(engine, loader, field, response_class, repeat: int):
+    """
+    Returns -> (seconds loading, seconds loading and rendering of every repetition, last body)
+    """
+    loading, total = [], []
+    body = None
+    for _ in range(repeat):
+        with Session(engine) as session:
+            start = time.perf_counter()
+            books = loader(session)
+            loaded = time.perf_counter()
+            body = await render(field, response_class, books)
+            loading.append(loaded - start)
+            total.append(time.perf_counter() - start)
+    return loading, total, body
+
+
+async def main(args):
+    engine = book_database(args.items)
+    page_field = create_response_field('Response_list_books', BookPage)
+    cases = [
+        ('orm, jsonable_encoder, json', 'orm', None, JSONResponse),
+        ('orm, BookPage, orjson', 'orm', page_field, ORJSONResponse),
+        ('rows, BookPage, orjson', 'rows', page_field, ORJSONResponse),
+        ('read_rows, BookPage, orjson', 'read_rows', page_field, ORJSONResponse),
+    ]
+    bodies = []
+    baseline = None
+    for name, loader, field, response_class in cases:
+        await measure(engine, LOADERS[loader], field, response_class, 2)
+        loading, total, body = await measure(engine, LOADERS[loader], field, response_class, args.repeat)
+        load, median = statistics.median(loading), statistics.median(total)
+        render_time = median - load
+        baseline = baseline or render_time
+        bodies.append(json.loads(body))
+        print(f"{name:<30} load {load / args.items * 1e6:>6.2f} us/item  render {render_time / args.items * 1e6:>6.2f} "
+              f"us/item ({baseline / render_time:>4.1f}x)  total {median * 1000:>7.2f} ms/page  {len(body)} bytes")
+    if any(body != bodies[0] for body in bodies):
+        print("The bodies differ")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=1000, help='books on the page')
+    parser.add_argument('--repeat', type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,135 @@
+"""
+Render reminder mails (text and html part) with the precompiled
+templates of utils.main_message, with and without the item fragment
+cache, next to the str.format rendering used before.
+
+    python benchmarks/template_benchmark.py --mails 100000 --titles 2000
+
+Every mail has one expiring and one expired item picked from `--titles`
+books, like a daily digest run over a catalogue of that size.
+"""
+import argparse
+import os
+import sys
+import time
+from html import escape
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import main_message
+
+FORMAT_HTML = """\
+    <!DOCTYPE html>
+    <html lang="en">
+      <head>
+        <meta charset="UTF-8" />
+        <meta name="viewport" content="width=device-width, initial-scale=1.0" />
+        <title>Your Library Loans</title>
+        <style>
+          body {{
+            font-family: Arial, sans-serif;
+            margin: 0;
+            padding: 0;
+            background-color: #f0f0f0;
+          }}
+          .header {{
+            background-color: #d32f2f; /* Notification color */
+            color: #ffffff;
+            padding: 20px;
+            text-align: center;
+          }}
+          .content {{
+            padding: 20px;
+            text-align: center;
+          }}
+          table {{
+            margin: 0 auto;
+            border-collapse: collapse;
+          }}
+          td, th {{
+            padding: 6px 12px;
+            border-bottom: 1px solid #cccccc;
+          }}
+        </style>
+      </head>
+      <body>
+        <div class="header">
+          <h1>Your Library Loans</h1>
+        </div>
+
+        <div class="content">
+          <h2>Dear {username},</h2>
+          {expiring_section}
+          {expired_section}
+          <p>Thank you for being a valued member of our library community!</p>
+        </div>
+      </body>
+    </html>
+    """
+
+
+def render_format(username, expiring_items, expired_items, total_fine):
+    """The str.format rendering main_message used before, kept here for comparison"""
+    rows = "".join(
+        f"<tr><td>{escape(object)}</td><td><strong>{escape(name)}</strong></td><td>{due_date}</td></tr>"
+        for object, name, due_date in expiring_items
+    )
+    expiring_section = ("<p>These items are due for return in 3 days, please return them on time to avoid any late fees.</p>"
+                        f"<table><tr><th>Type</th><th>Title</th><th>Due</th></tr>{rows}</table>")
+    rows = "".join(
+        f"<tr><td>{escape(object)}</td><td><strong>{escape(name)}</strong></td><td>{due_date}</td><td>रु {fine}</td></tr>"
+        for object, name, due_date, fine in expired_items
+    )
+    expired_section = ("<p>The borrowing period of these items has expired, please return them as soon as possible to minimize any additional charges.</p>"
+                       f"<table><tr><th>Type</th><th>Title</th><th>Due</th><th>Fine</th></tr>{rows}</table>"
+                       f"<p>Total fine so far: <strong>रु {total_fine}</strong></p>")
+    lines = [f"Dear {username},"]
+    lines += [f"Your borrowed {object} {name} is due for return on {due_date}." for object, name, due_date in expiring_items]
+    lines += [f"Your borrowed {object} {name} have already expired at {due_date}, fine of रु {fine} is due."
+              for object, name, due_date, fine in expired_items]
+    html = FORMAT_HTML.format(username=escape(username), expiring_section=expiring_section, expired_section=expired_section)
+    return "\n".join(lines), html
+
+
+def digests(mails: int, titles: int):
+    for index in range(mails):
+        yield (f'member <{index}>',
+               [('Book', f'Title & {index % titles}', '2024-05-04')],
+               [('Book', f'Title & {(index * 7) % titles}', '2024-04-01', 30)],
+               30)
+
+
+def measure(render, mails: int, titles: int):
+    start = time.perf_counter()
+    for username, expiring_items, expired_items, total_fine in digests(mails, titles):
+        render(username, expiring_items, expired_items, total_fine)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mails', type=int, default=100000)
+    parser.add_argument('--titles', type=int, default=2000)
+    args = parser.parse_args()
+
+    cached_rows = main_message.expiring_row, main_message.expired_row
+
+    def render_uncached(*digest):
+        return main_message.render_digest(*digest)
+
+    for name, render, rows in (
+        ('str.format', render_format, cached_rows),
+        ('compiled', render_uncached, tuple(row.__wrapped__ for row in cached_rows)),
+        ('compiled+cache', main_message.render_digest, cached_rows),
+    ):
+        for row in cached_rows:
+            row.cache_clear()
+        # render_digest looks the row functions up when called
+        main_message.expiring_row, main_message.expired_row = rows
+        elapsed = measure(render, args.mails, args.titles)
+        print(f"{name:<15} {args.mails} mails in {elapsed:>6.2f}s ({args.mails / elapsed:>9.0f} mails/s)")
+    main_message.expiring_row, main_message.expired_row = cached_rows
+
+
+if __name__ == '__main__':
+    main()
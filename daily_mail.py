@@ -1,66 +1,101 @@
 #!/usr/local/bin/python
-from database.database_connection import session
-from models import Magazine, Record, User, Book, Select
+from itertools import groupby
+from decouple import config
+from sqlalchemy import and_, func, or_
+from database.database_connection import session_scope
+from models import MailOutbox, Magazine, Record, User, Book, Select, calculate_fine
 import datetime
-from utils import send_mail
 
-def get_all_expiring_record():
-    now = datetime.datetime.now().date()
-    expiring_records = session.execute(
-        Select(
-            Record.expected_return_date, 
-            Record.book_id,Record.magazine_id, 
-            Record.member_id
-            ).where(
-                Record.expected_return_date == (now + datetime.timedelta(3))
-                )).all()
-    # return expiring_records
-    if expiring_records:
-        for expiring_record in expiring_records:
-            id_to_sent = expiring_record[3]
-            user = session.scalar(Select(User).where(User.id==id_to_sent))
-            user_email = user.email
-            username = user.username
-            if expiring_record[2]:
-                object = "Magazine"
-                name = session.scalar(Select(Magazine.title).where(Magazine.issn_number==expiring_record[2]))
-            elif expiring_record[1]:
-                object = "Book"
-                name = session.scalar(Select(Book.title).where(Book.isbn_number==expiring_record[1]))
-                
-            send_mail.expiring_mail(user_email, username,name, object)
-            print(f'Sent mail to {user_email}')
+# Loans fetched from the server side cursor at once
+DAILY_MAIL_BATCH_SIZE = config('daily_mail_batch_size', default=1000, cast=int)
 
 
-def get_all_expired_records():
-    now = datetime.datetime.now().date()
-    expired_records = session.execute(
-        Select(
-            Record.expected_return_date, 
-            Record.book_id,Record.magazine_id, 
-            Record.member_id
-            ).where(
-                Record.expected_return_date <= (now)
-                )).all()
-    # return expired_records
-    if expired_records:
-        for expired_record in expired_records:
-            id_to_sent = expired_record[3]
-            user = session.scalar(Select(User).where(User.id==id_to_sent))
-            user_email = user.email
-            username = user.username
-            if expired_record[2]:
-                object = "Magazine"
-                name = session.scalar(Select(Magazine.title).where(Magazine.issn_number==expired_record[2]))
-            elif expired_record[1]:
-                object = "Book"
-                name = session.scalar(Select(Book.title).where(Book.isbn_number==expired_record[1]))
-            expired_date = str(expired_record[0].date())
-            extra_days = (now - expired_record[0].date()).days
-            fine = extra_days * 3
-            send_mail.expired_mail(user_email, username,name, object,expired_date,fine)
-            print(f'Sent mail to {user_email}')
-            
+def open_loans_statement(today: datetime.date):
+    """
+    Every unreturned loan that is due in 3 days or already expired,
+    joined with its user and title and ordered by user so loans of
+    one user come one after another
+    """
+    expiring_from = datetime.datetime.combine(today + datetime.timedelta(3), datetime.time())
+    expiring_till = expiring_from + datetime.timedelta(1)
+    expired_till = datetime.datetime.combine(today + datetime.timedelta(1), datetime.time())
+    return Select(
+        Record.member_id,
+        User.email,
+        User.username,
+        Record.expected_return_date,
+        Record.magazine_id,
+        func.coalesce(Book.title, Magazine.title).label('title')
+    ).join(
+        User, User.id == Record.member_id
+    ).outerjoin(
+        Book, Book.isbn_number == Record.book_id
+    ).outerjoin(
+        Magazine, Magazine.issn_number == Record.magazine_id
+    ).where(
+        Record.returned == False,
+        or_(
+            Record.expected_return_date < expired_till,
+            and_(Record.expected_return_date >= expiring_from, Record.expected_return_date < expiring_till)
+        )
+    ).order_by(Record.member_id, Record.expected_return_date)
 
-get_all_expiring_record()
-get_all_expired_records()
\ No newline at end of file
+
+def user_digests(session, today: datetime.date):
+    """
+    Yield (member id, email, username, expiring items, expired items, total fine) for every
+    user with loans to remind about, rows are streamed so memory only holds
+    one batch of rows and the loans of one user
+    """
+    rows = session.execute(
+        open_loans_statement(today).execution_options(yield_per=DAILY_MAIL_BATCH_SIZE)
+    )
+    for member_id, loans in groupby(rows, key=lambda row: row.member_id):
+        expiring_items = []
+        expired_items = []
+        for loan in loans:
+            object = "Magazine" if loan.magazine_id else "Book"
+            due_date = loan.expected_return_date.date()
+            if due_date <= today:
+                expired_items.append((object, loan.title, str(due_date), calculate_fine(loan.expected_return_date, today)))
+            else:
+                expiring_items.append((object, loan.title, str(due_date)))
+        total_fine = sum(item[3] for item in expired_items)
+        yield member_id, loan.email, loan.username, expiring_items, expired_items, total_fine
+
+
+def queue_daily_digests(session):
+    """
+    Queue today's digest of every user in mail_outbox for mail_worker.py.
+    The idempotency key holds the date, so running the job twice a day
+    never mails a user twice. Inserts are committed in batches from their
+    own session while session keeps streaming the loans.
+    Returns -> number of digests queued
+    """
+    today = datetime.datetime.now().date()
+    queued = 0
+    with session_scope() as outbox_session:
+        digests = user_digests(session, today)
+        for count, (member_id, user_email, username, expiring_items, expired_items, total_fine) in enumerate(digests, 1):
+            queued += MailOutbox.enqueue(
+                outbox_session,
+                'digest',
+                f'digest:{member_id}:{today}',
+                {
+                    'email_to_send_to': user_email,
+                    'username': username,
+                    'expiring_items': expiring_items,
+                    'expired_items': expired_items,
+                    'total_fine': total_fine,
+                }
+            )
+            if count % DAILY_MAIL_BATCH_SIZE == 0:
+                outbox_session.commit()
+        outbox_session.commit()
+    return queued
+
+
+if __name__ == '__main__':
+    with session_scope() as session:
+        queued = queue_daily_digests(session)
+    print(f'{queued} digests queued')
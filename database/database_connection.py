@@ -1,6 +1,10 @@
+from contextlib import contextmanager
 from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy import create_engine, URL
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.exc import IntegrityError, OperationalError
 from decouple import config
 import utils.constant_messages as constant_messages
@@ -11,6 +15,17 @@ database = config('database')
 user = config('user')
 password = config('password')
 
+# Connection pool tuning, every value can be overridden from .env
+pool_size = config('pool_size', default=5, cast=int)
+max_overflow = config('max_overflow', default=10, cast=int)
+pool_timeout = config('pool_timeout', default=30, cast=int)
+pool_recycle = config('pool_recycle', default=1800, cast=int)
+pool_pre_ping = config('pool_pre_ping', default=True, cast=bool)
+# Statement timeout in milliseconds, 0 disables it
+statement_timeout = config('statement_timeout', default=30000, cast=int)
+# 'sync' uses psycopg2 sessions in a threadpool, 'async' uses asyncpg sessions
+database_mode = config('database_mode', default='sync')
+
 # Create a connection url using SQL Alchemy's URL class
 url = URL.create(
     database=database,
@@ -21,22 +36,104 @@ url = URL.create(
 )
 
 # create a engine with above created url
-engine = create_engine(url, echo=False)
+engine = create_engine(
+    url,
+    echo=False,
+    poolclass=QueuePool,
+    pool_size=pool_size,
+    max_overflow=max_overflow,
+    pool_timeout=pool_timeout,
+    pool_recycle=pool_recycle,
+    pool_pre_ping=pool_pre_ping,
+    connect_args={'options': f'-c statement_timeout={statement_timeout}'}
+)
 
 try:
     engine.connect().close()
 
 except OperationalError:
     print("No valid credentials, please ensure the presence of .env file")
-# Create a session
-# TODO: make the session with context manager
-session = Session(bind=engine)
+
+# Session factory, each unit of work gets its own session and connection
+SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+
+# Async engine used by the API when database_mode is 'async'
+# The sync engine above is still used by daily_mail.py and alembic
+async_engine = None
+AsyncSessionLocal = None
+if database_mode == 'async':
+    async_engine = create_async_engine(
+        url.set(drivername="postgresql+asyncpg"),
+        echo=False,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=pool_pre_ping,
+        connect_args={'server_settings': {'statement_timeout': str(statement_timeout)}}
+    )
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, expire_on_commit=False)
+
+
+@contextmanager
+def session_scope():
+    """
+    Give a new session from the pool and make sure it is
+    rolled back on error and closed (returned to pool) at the end
+    """
+    session = SessionLocal()
+    try:
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+if AsyncSessionLocal is not None:
+    async def get_session():
+        """
+        FastAPI dependency that gives one AsyncSession per request
+        """
+        async with AsyncSessionLocal() as session:
+            yield session
+else:
+    def get_session():
+        """
+        FastAPI dependency that gives one Session per request, a plain generator
+        so FastAPI runs the rollback and close in the threadpool, off the event loop
+        """
+        with session_scope() as session:
+            yield session
+
+
+async def run_db(session: Session | AsyncSession, fn, *args, **kwargs):
+    """
+    Await a model method that takes the session as first argument
+    without blocking the event loop.
+    With AsyncSession it runs on the asyncpg connection through run_sync,
+    with Session it runs in the threadpool.
+    """
+    if isinstance(session, AsyncSession):
+        return await session.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, session, *args, **kwargs)
+
+
+def read_rows(session: Session, statement):
+    """
+    Rows of a statement selecting columns as plain dicts, for data that is
+    only sent back. Nothing enters the identity map or is tracked for changes.
+    """
+    result = session.execute(statement)
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
 
 #  Get session and try to commit
 # If error occurs, rollback and show generic HTTPException
 
 
-def try_session_commit(session):
+def try_session_commit(session: Session):
     try:
         session.commit()
     except IntegrityError as e:
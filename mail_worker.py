@@ -0,0 +1,89 @@
+#!/usr/local/bin/python
+"""
+Send the mails queued in mail_outbox.
+
+    python mail_worker.py          # run forever
+    python mail_worker.py --once   # send what is due now and exit
+
+Any number of workers can run at once, each claims its own jobs with
+SELECT ... FOR UPDATE SKIP LOCKED.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from decouple import config
+from database.database_connection import session_scope
+from models import MailOutbox
+from utils import send_mail
+from utils.mail_dispatcher import get_dispatcher
+
+# Jobs claimed at once by one worker
+MAIL_OUTBOX_BATCH_SIZE = config('mail_outbox_batch_size', default=50, cast=int)
+# Seconds between polls when nothing is due
+MAIL_OUTBOX_POLL_INTERVAL = config('mail_outbox_poll_interval', default=5.0, cast=float)
+# Seconds a claimed job may take before another worker takes it over
+MAIL_OUTBOX_LEASE = config('mail_outbox_lease', default=300, cast=int)
+# Claims of a job before it is marked failed
+MAIL_OUTBOX_MAX_ATTEMPTS = config('mail_outbox_max_attempts', default=5, cast=int)
+# Seconds before the first retry of a job, doubled for every next one
+MAIL_OUTBOX_RETRY_BACKOFF = config('mail_outbox_retry_backoff', default=60, cast=int)
+
+MESSAGE_BUILDERS = {
+    'verification': send_mail.verification_message,
+    'digest': send_mail.digest_message,
+}
+
+
+def retry_at(attempts: int):
+    if attempts >= MAIL_OUTBOX_MAX_ATTEMPTS:
+        return None
+    return datetime.utcnow() + timedelta(seconds=MAIL_OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1))
+
+
+def process_batch():
+    """
+    Claim due jobs, send them and record the outcome
+    Returns -> number of jobs claimed
+    """
+    with session_scope() as session:
+        jobs = MailOutbox.claim(session, MAIL_OUTBOX_BATCH_SIZE, timedelta(seconds=MAIL_OUTBOX_LEASE),
+                                MAIL_OUTBOX_MAX_ATTEMPTS)
+        if not jobs:
+            return 0
+        ready = []
+        for job in jobs:
+            try:
+                ready.append((job, MESSAGE_BUILDERS[job.kind](**job.payload)))
+            except (KeyError, TypeError) as e:
+                # A broken job will never build, don't retry it
+                MailOutbox.mark_failed(session, job.id, repr(e), None)
+        results = get_dispatcher().send_all(message for _, message in ready)
+        for (job, _), result in zip(ready, results):
+            if result.sent:
+                MailOutbox.mark_sent(session, job.id)
+            else:
+                MailOutbox.mark_failed(session, job.id, result.error, retry_at(job.attempts))
+                print(f'Failed to send {job.kind} mail to {result.to}: {result.error}')
+        session.commit()
+        return len(jobs)
+
+
+def run(once: bool = False):
+    while True:
+        claimed = process_batch()
+        if claimed:
+            print(f'Processed {claimed} mails')
+        elif once:
+            return
+        else:
+            time.sleep(MAIL_OUTBOX_POLL_INTERVAL)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--once', action='store_true', help='exit when no mail is due')
+    args = parser.parse_args()
+    try:
+        run(args.once)
+    finally:
+        get_dispatcher().close()
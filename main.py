@@ -1,16 +1,22 @@
-from fastapi import FastAPI, HTTPException, Depends, Request, Response, BackgroundTasks
-from fastapi.responses import JSONResponse, RedirectResponse
-from sqlalchemy import Select
+from contextlib import asynccontextmanager
+from typing import Literal
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse, ORJSONResponse, RedirectResponse
 from auth import auth
-from auth.permission_checker import PermissionChecker, ContainPermission
+from auth.permission_checker import (PermissionChecker, ContainPermission, get_role_permissions,
+                                     get_token_permissions, token_claims)
+from auth.permission_cache import start_listener
+from auth.password_pool import password_pool
 import utils.constant_messages as constant_messages
-from models import Book, Magazine, User, Publisher, Genre, Role
+from models import Book, Magazine, User, Publisher, Genre, Role, MailOutbox
 from utils.schema import *
-from utils import send_mail
+from utils.export import export_response
+from utils.search import search_catalogue
+from utils.conditional import CACHE_CONTROL, CatalogueETag, cache_headers, check_not_modified, make_etag
 # from utils.helper_function import log_request, log_response, LogMiddleware
 from utils.helper_function import  LogMiddleware, logger
 from utils.helper_function import token_in_header
-from database.database_connection import session
+from database.database_connection import engine, get_session, run_db
 
 # from fastapi.security import HTTPBearer
 # token_in_header = HTTPBearer()
@@ -23,7 +29,19 @@ Please go to  `/` to know about ervery availabe route.
 """
 # testing
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Listen for role changes made by other workers
+    start_listener(engine)
+    yield
+    password_pool.shutdown()
+
+
 app = FastAPI(
+    lifespan=lifespan,
+    # Bodies are checked by the response models of the routes, orjson only encodes them
+    default_response_class=ORJSONResponse,
     title="LibraryManagementSystem",
     description=description,
     summary="All your library related stuff.",
@@ -35,7 +53,12 @@ app = FastAPI(
     },
 )
 
-app.add_middleware(LogMiddleware, exclude_paths=['/docs', '/openapi.json', '/login','/refresh'])
+app.add_middleware(
+    LogMiddleware,
+    exclude_paths=['/docs', '/openapi.json', '/login','/refresh'],
+    # Catalogue listings are large and frequent, only log a few of them
+    sample_rates={'/book': 0.1, '/magazine': 0.1}
+)
 
 # @app.middleware('http')
 # async def log_middleware(request: Request, call_next):
@@ -57,11 +80,42 @@ user = User()
 role = Role()
 
 
-def is_verified(token:dict = Depends(token_in_header)):
-    email = token['user_identifier']
-    username = user.get_username_from_email(email)
-    user_object = user.get_from_username(username)
-    if 'user:verified' in [permission.name for permission in (session.scalars(user_object.roles.permission_id).all()) ]:
+async def user_from_token(session, token: dict):
+    """
+    Database instance of token owner with its role, loaded by id when
+    the token carries it, else by email
+    """
+    user_object = await run_db(session, user.get_principal, token.get('user_id'), token['user_identifier'])
+    if not user_object:
+        raise HTTPException(
+            status_code=404,
+            detail={'error': {
+                'error_type': constant_messages.REQUEST_NOT_FOUND,
+                'error_message': constant_messages.request_not_found("user", "id"),
+            }})
+    return user_object
+
+
+async def current_user(request: Request, token: dict = Depends(token_in_header), session=Depends(get_session)):
+    """
+    User of the access token, loaded once per request and kept on request.state
+    """
+    if getattr(request.state, 'user', None) is None:
+        request.state.user = await user_from_token(session, token)
+    return request.state.user
+
+
+# Staff with user:all borrow and return for the user they name, members for themselves
+acts_for_others = ContainPermission(['user:all'])
+
+
+async def is_verified(token:dict = Depends(token_in_header), principal: User = Depends(current_user),
+                      session=Depends(get_session)):
+    permissions = await get_token_permissions(session, token)
+    if principal.role_id != token['role']:
+        # The role changed after login, e.g. by an earlier /verify
+        permissions = await get_role_permissions(session, principal.role_id)
+    if 'user:verified' in permissions:
         return "You are already verified"
     return token
 
@@ -86,21 +140,26 @@ FastAPI Please find all the available path below',
     }
 
 
-@app.get('/publisher', tags=['Publisher'])
+@app.get('/publisher', dependencies=[Depends(CatalogueETag(['publishers'], CACHE_CONTROL['publisher']))], response_model=PublisherPage, tags=['Publisher'])
 async def list_publishers(
-    page: int | None = 1,
+    page: int | None = Query(1, deprecated=True),
     all: bool | None = None,
-    limit: int | None = 3
+    limit: int | None = 3,
+    cursor: str | None = None,
+    session=Depends(get_session)
 ):
+    publisher_list, next_cursor = await run_db(session, publisher.get_all, page=page, all=all, limit=limit, cursor=cursor)
     return {
-        'Publishers': publisher.get_all(page=page, all=all, limit=limit)
+        'Publishers': publisher_list,
+        'next_cursor': next_cursor
     }
 
 
-@app.get('/publisher/{publisherId}', tags=['Publisher'])
-async def get_publisher(publisherId: int):
-    publisherFound = publisher.get_from_id(publisherId)
+@app.get('/publisher/{publisherId}', response_model=PublisherDetail, tags=['Publisher'])
+async def get_publisher(publisherId: int, request: Request, response: Response, session=Depends(get_session)):
+    publisherFound = await run_db(session, publisher.get_cached, publisherId)
     if publisherFound:
+        check_not_modified(request, response, make_etag(request.url.path, publisherFound), CACHE_CONTROL['publisher'])
         return {
             'Publisher': publisherFound
         }
@@ -121,9 +180,11 @@ async def get_publisher(publisherId: int):
     tags=['Publisher'],
     status_code=201
 )
-async def add_publisher(publisherItem: PublisherItem):
+async def add_publisher(publisherItem: PublisherItem, session=Depends(get_session)):
     return {
-        'result': publisher.add(
+        'result': await run_db(
+            session,
+            publisher.add,
             publisherItem.name,
             publisherItem.phone_number,
             publisherItem.address
@@ -131,21 +192,26 @@ async def add_publisher(publisherItem: PublisherItem):
     }
 
 
-@app.get('/genre', tags=['Genre'])
+@app.get('/genre', dependencies=[Depends(CatalogueETag(['genre'], CACHE_CONTROL['genre']))], response_model=GenrePage, tags=['Genre'])
 async def list_genre(
-    page: int | None = 1,
+    page: int | None = Query(1, deprecated=True),
     all: bool | None = None,
-    limit: int | None = 3
+    limit: int | None = 3,
+    cursor: str | None = None,
+    session=Depends(get_session)
 ):
+    genre_list, next_cursor = await run_db(session, genre.get_all, page=page, all=all, limit=limit, cursor=cursor)
     return {
-        'Genre': genre.get_all(page=page, all=all, limit=limit)
+        'Genre': genre_list,
+        'next_cursor': next_cursor
     }
 
 
-@app.get('/genre/{genreId}', tags=['Genre'])
-async def get_genre(genreId: int):
-    publisherFound = genre.get_from_id(genreId)
+@app.get('/genre/{genreId}', response_model=GenreDetail, tags=['Genre'])
+async def get_genre(genreId: int, request: Request, response: Response, session=Depends(get_session)):
+    publisherFound = await run_db(session, genre.get_cached, genreId)
     if publisherFound:
+        check_not_modified(request, response, make_etag(request.url.path, publisherFound), CACHE_CONTROL['genre'])
         return {
             'Publisher': publisherFound
         }
@@ -161,31 +227,44 @@ async def get_genre(genreId: int):
 
 
 @app.post('/genre', status_code=201, dependencies=[Depends(PermissionChecker(['user:verified']))], tags=['Genre'])
-async def add_genre(genreItem: GenreItem):
+async def add_genre(genreItem: GenreItem, session=Depends(get_session)):
     return {
-        'result': genre.add(
+        'result': await run_db(
+            session,
+            genre.add,
             genreItem.name,
         )
     }
 
 
-@app.get('/book', tags=['Book'])
+@app.get('/book', dependencies=[Depends(CatalogueETag(['books'], CACHE_CONTROL['book']))], response_model=BookPage, tags=['Book'])
 async def list_books(
-    page: int | None = 1,
+    response: Response,
+    page: int | None = Query(1, deprecated=True),
     all: bool | None = None,
-    limit: int | None = 3
+    limit: int | None = 3,
+    cursor: str | None = None,
+    format: Literal['json', 'ndjson', 'csv'] = 'json',
+    session=Depends(get_session)
 ):
+    if all and format != 'json':
+        # Stream every row instead of building one huge json array, with the ETag of CatalogueETag
+        return export_response(book.export_statement(), format, 'books', cache_headers(response))
+    book_list, next_cursor = await run_db(session, book.get_all, page=page, limit=limit, all=all, cursor=cursor)
     return {
-        'Books': book.get_all(page=page, limit=limit, all=all)
+        'Books': book_list,
+        'next_cursor': next_cursor
     }
 
 
 @app.post('/book', status_code=201, dependencies=[Depends(PermissionChecker(['user:verified']))], tags=['Book'])
-async def add_book(book_item: BookItem):
-    if await get_genre(book_item.genre_id):
-        if await get_publisher(book_item.publisher_id):
+async def add_book(book_item: BookItem, session=Depends(get_session)):
+    if await run_db(session, genre.get_cached, book_item.genre_id):
+        if await run_db(session, publisher.get_cached, book_item.publisher_id):
             return {
-                'Result': book.add(
+                'Result': await run_db(
+                    session,
+                    book.add,
                     book_item.isbn,
                     book_item.author,
                     book_item.title,
@@ -208,8 +287,8 @@ async def add_book(book_item: BookItem):
                 }})
 
 
-@app.get('/book/{isbn}', tags=['Book'])
-async def get_book(isbn: str):
+@app.get('/book/{isbn}', response_model=BookDetail, tags=['Book'])
+async def get_book(isbn: str, request: Request, response: Response, session=Depends(get_session)):
     if len(isbn) != 13:
         raise HTTPException(
             status_code=400,
@@ -218,8 +297,9 @@ async def get_book(isbn: str):
                 'error_message': constant_messages.invalid_length("ISBN number", 13)
             }})
 
-    bookFound = book.get_from_id(isbn)
+    bookFound = await run_db(session, book.get_cached, isbn)
     if bookFound:
+        check_not_modified(request, response, make_etag(request.url.path, bookFound), CACHE_CONTROL['book'])
         return {
             'book': bookFound
         }
@@ -231,23 +311,34 @@ async def get_book(isbn: str):
                 }})
 
 
-@app.get('/magazine', tags=['Magazine'])
+@app.get('/magazine', dependencies=[Depends(CatalogueETag(['magazines'], CACHE_CONTROL['magazine']))], response_model=MagazinePage, tags=['Magazine'])
 async def list_magazines(
-    page: int | None = 1,
+    response: Response,
+    page: int | None = Query(1, deprecated=True),
     all: bool | None = None,
-    limit: int | None = 3
+    limit: int | None = 3,
+    cursor: str | None = None,
+    format: Literal['json', 'ndjson', 'csv'] = 'json',
+    session=Depends(get_session)
 ):
+    if all and format != 'json':
+        # Stream every row instead of building one huge json array, with the ETag of CatalogueETag
+        return export_response(magazine.export_statement(), format, 'magazines', cache_headers(response))
+    magazine_list, next_cursor = await run_db(session, magazine.get_all, page, all, limit, cursor)
     return {
-        'Magazines': magazine.get_all(page, all, limit)
+        'Magazines': magazine_list,
+        'next_cursor': next_cursor
     }
 
 
 @app.post('/magazine', status_code=201, dependencies=[Depends(PermissionChecker(['user:verified']))], tags=['Magazine'])
-async def add_magazine(magazine_item: MagazineItem):
-    if await get_genre(magazine_item.genre_id):
-        if await get_publisher(magazine_item.publisher_id):
+async def add_magazine(magazine_item: MagazineItem, session=Depends(get_session)):
+    if await run_db(session, genre.get_cached, magazine_item.genre_id):
+        if await run_db(session, publisher.get_cached, magazine_item.publisher_id):
             return {
-                'Result': magazine.add(
+                'Result': await run_db(
+                    session,
+                    magazine.add,
                     magazine_item.issn,
                     magazine_item.editor,
                     magazine_item.title,
@@ -270,8 +361,8 @@ async def add_magazine(magazine_item: MagazineItem):
                 }})
 
 
-@app.get('/magazine/{issn}', tags=['Magazine'])
-async def get_magazine(issn: str):
+@app.get('/magazine/{issn}', response_model=MagazineDetail, tags=['Magazine'])
+async def get_magazine(issn: str, request: Request, response: Response, session=Depends(get_session)):
     if len(issn) != 8:
         raise HTTPException(
             status_code=400,
@@ -280,8 +371,9 @@ async def get_magazine(issn: str):
                 'error_message': constant_messages.invalid_length("ISSN number", 8)
             }})
 
-    magazineFound = magazine.get_from_id(issn)
+    magazineFound = await run_db(session, magazine.get_cached, issn)
     if magazineFound:
+        check_not_modified(request, response, make_etag(request.url.path, magazineFound), CACHE_CONTROL['magazine'])
         return {
             'Magazine': magazineFound
         }
@@ -293,31 +385,59 @@ async def get_magazine(issn: str):
                 }})
 
 
-@app.get('/user', dependencies=[Depends(PermissionChecker(['user:verified']))], tags=['User'])
+@app.get('/search', tags=['Search'])
+async def search(
+    q: str = Query(min_length=1, max_length=200),
+    type: Literal['all', 'book', 'magazine'] = 'all',
+    genre_id: int | None = None,
+    publisher_id: int | None = None,
+    in_stock: bool = False,
+    limit: int | None = 10,
+    cursor: str | None = None,
+    session=Depends(get_session)
+):
+    results, next_cursor = await run_db(
+        session, search_catalogue, q, type, genre_id, publisher_id, in_stock, limit, cursor)
+    return {
+        'Results': results,
+        'next_cursor': next_cursor
+    }
+
+
+@app.get('/user', dependencies=[Depends(PermissionChecker(['user:verified']))], response_model=UserPage, tags=['User'])
 async def list_users(
-    page: int | None = 1,
+    page: int | None = Query(1, deprecated=True),
     all: bool | None = None,
-    limit: int | None = 3
+    limit: int | None = 3,
+    cursor: str | None = None,
+    format: Literal['json', 'ndjson', 'csv'] = 'json',
+    session=Depends(get_session)
 ):
+    if all and format != 'json':
+        # Stream every row instead of building one huge json array
+        return export_response(user.export_statement(), format, 'users')
+    user_list, next_cursor = await run_db(session, user.get_all_user, page=page, all=all, limit=limit, cursor=cursor)
     return {
-        'Users': user.get_all_user(page=page, all=all, limit=limit)
+        'Users': user_list,
+        'next_cursor': next_cursor
     }
 
 
 @app.get('/user/borrowed', dependencies=[Depends(PermissionChecker(['user:all']))], tags=['User'])
-async def borrowed_items(username: str):
+async def borrowed_items(username: str, session=Depends(get_session)):
     return {
         "Username": username,
-        'Borrowed': user.get_all_borrowed(username)
+        'Borrowed': await run_db(session, user.get_all_borrowed, username)
 
     }
 
 
 @app.post('/user/borrow_book', tags=['User'])
-async def borrow_book(borrowObject: BorrowBookObject, token=Depends(token_in_header)):
-    if token['role'] != 'user':
+async def borrow_book(borrowObject: BorrowBookObject, principal: User = Depends(current_user),
+                      for_others: bool = Depends(acts_for_others), session=Depends(get_session)):
+    if for_others:
         if borrowObject.username:
-            user.borrow_book(borrowObject.username, borrowObject.isbn)
+            await run_db(session, user.borrow_book, borrowObject.username, borrowObject.isbn)
         else:
             raise HTTPException(
                 status_code=400,
@@ -327,8 +447,7 @@ async def borrow_book(borrowObject: BorrowBookObject, token=Depends(token_in_hea
                 }
             )
     else:
-        username = user.get_username_from_email(token['user_identifier'])
-        user.borrow_book(username, borrowObject.isbn)
+        await run_db(session, user.borrow_book, principal, borrowObject.isbn)
 
     return {
         "Sucess": "Book Borrowed Sucessfully"
@@ -336,10 +455,11 @@ async def borrow_book(borrowObject: BorrowBookObject, token=Depends(token_in_hea
 
 
 @app.post('/user/borrow_magazine', tags=['User'])
-async def borrow_magazine(borrowObject: BorrowMagazineObject, token=Depends(token_in_header)):
-    if token['role'] != 'user':
+async def borrow_magazine(borrowObject: BorrowMagazineObject, principal: User = Depends(current_user),
+                      for_others: bool = Depends(acts_for_others), session=Depends(get_session)):
+    if for_others:
         if borrowObject.username:
-            user.borrow_magazine(borrowObject.username, borrowObject.issn)
+            await run_db(session, user.borrow_magazine, borrowObject.username, borrowObject.issn)
         else:
             raise HTTPException(
                 status_code=400,
@@ -349,19 +469,63 @@ async def borrow_magazine(borrowObject: BorrowMagazineObject, token=Depends(toke
                 }
             )
     else:
-        username = user.get_username_from_email(token['user_identifier'])
-        user.borrow_magazine(username, borrowObject.issn)
+        await run_db(session, user.borrow_magazine, principal, borrowObject.issn)
     return {
         "Sucess": "Magazine Borrowed Sucessfully"
     }
 
 
+@app.post('/user/borrow_batch', tags=['User'])
+async def borrow_batch(borrowObject: BorrowBatchObject, principal: User = Depends(current_user),
+                      for_others: bool = Depends(acts_for_others), session=Depends(get_session)):
+    if for_others:
+        if not borrowObject.username:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    'error': constant_messages.BAD_REQUEST,
+                    'error_message': "No Username in provided, admins must provide username to whom the items should be issued to "
+                }
+            )
+        username = borrowObject.username
+    else:
+        username = principal
+
+    result = await run_db(session, user.borrow_batch, username, borrowObject.isbn, borrowObject.issn)
+    return {
+        "Result": result
+    }
+
+
+@app.post('/user/return_batch', tags=['User'])
+async def return_batch(returnObject: ReturnBatchObject, principal: User = Depends(current_user),
+                      for_others: bool = Depends(acts_for_others), session=Depends(get_session)):
+    if for_others:
+        if not returnObject.username:
+            raise HTTPException(
+                status_code=400,
+                detail={
+                    'error': constant_messages.BAD_REQUEST,
+                    'error_message': "No Username in provided, admins must provide username of user returning items"
+                }
+            )
+        username = returnObject.username
+    else:
+        username = principal
+
+    result, fine = await run_db(session, user.return_batch, username, returnObject.isbn, returnObject.issn)
+    return {
+        "Result": result,
+        "Total Fine": fine
+    }
+
+
 @app.post('/user/return_magazine', tags=['User'])
-async def return_magazine(returnObject: ReturnMagazineObject, token=Depends(token_in_header)):
-    if token['role'] != 'user':
+async def return_magazine(returnObject: ReturnMagazineObject, principal: User = Depends(current_user),
+                      for_others: bool = Depends(acts_for_others), session=Depends(get_session)):
+    if for_others:
         if returnObject.username:
-            fine = user.return_magazine(
-                returnObject.username, returnObject.issn)
+            fine = await run_db(session, user.return_magazine, returnObject.username, returnObject.issn)
             if fine:
                 return {"Sucess": "Sucesfully returned, but fine remaning",
                         "Fine Remaning": {
@@ -378,8 +542,7 @@ async def return_magazine(returnObject: ReturnMagazineObject, token=Depends(toke
                 }
             )
     else:
-        username = user.get_username_from_email(token['user_identifier'])
-        fine = user.return_magazine(username, returnObject.issn)
+        fine = await run_db(session, user.return_magazine, principal, returnObject.issn)
         if fine:
             return {"Sucess": "Sucesfully returned, but fine remaning",
                     "Fine Remaning": {
@@ -392,10 +555,11 @@ async def return_magazine(returnObject: ReturnMagazineObject, token=Depends(toke
 
 
 @app.post('/user/return_book', tags=['User'])
-async def return_book(returnObject: ReturnBookObject, token=Depends(token_in_header)):
-    if token['role'] != 'user':
+async def return_book(returnObject: ReturnBookObject, principal: User = Depends(current_user),
+                      for_others: bool = Depends(acts_for_others), session=Depends(get_session)):
+    if for_others:
         if returnObject.username:
-            fine = user.return_book(returnObject.username, returnObject.isbn)
+            fine = await run_db(session, user.return_book, returnObject.username, returnObject.isbn)
             if fine:
                 return {
                     "Sucess": "Sucesfully returned, but fine remaning",
@@ -413,8 +577,7 @@ async def return_book(returnObject: ReturnBookObject, token=Depends(token_in_hea
                 }
             )
     else:
-        username = user.get_username_from_email(token['user_identifier'])
-        fine = user.return_book(username, returnObject.isbn)
+        fine = await run_db(session, user.return_book, principal, returnObject.isbn)
         if fine:
             return {
                 "Sucess": "Sucesfully returned, but fine remaning",
@@ -426,31 +589,28 @@ async def return_book(returnObject: ReturnBookObject, token=Depends(token_in_hea
     return {"Sucess": "Book Returned Sucessfully"}
 
 
-@app.get('/me', tags=['User'])
-async def get_my_info(token=Depends(token_in_header)):
+@app.get('/me', response_model=UserDetail, tags=['User'])
+async def get_my_info(principal: User = Depends(current_user)):
     # token = auth.decodAccessJWT(token.credentials)
-    username = user.get_username_from_email(token['user_identifier'])
-    user_details = user.get_from_username(username)
     return {
         'User': {
-            'user_details': user_details
+            'user_details': principal.details()
         }
     }
 
 
 @app.get('/me/borrowed', tags=['User'])
-async def borrowed_items(token = Depends(token_in_header)):
+async def borrowed_items(principal: User = Depends(current_user), session=Depends(get_session)):
     # token = auth.decodAccessJWT(token.credentials)
-    username = user.get_username_from_email(token['user_identifier'])
     return {
-        "Username": username,
-        'Borrowed': user.get_all_borrowed(username)
+        "Username": principal.username,
+        'Borrowed': await run_db(session, user.get_all_borrowed, principal)
 
     }
 
-@app.get('/user/{username}', dependencies=[Depends(PermissionChecker(['user:verified']))], tags=['User'])
-async def get_user(username: str):
-    userFound = user.get_from_username(username)
+@app.get('/user/{username}', dependencies=[Depends(PermissionChecker(['user:verified']))], response_model=UserDetail, tags=['User'])
+async def get_user(username: str, session=Depends(get_session)):
+    userFound = await run_db(session, user.get_details, username)
     if userFound:
         return {
             'User': {
@@ -471,41 +631,55 @@ async def get_user(username: str):
 
 
 @app.post('/user', status_code=201, dependencies=[Depends(PermissionChecker(['user:verified']), use_cache=False)], tags=['User'])
-async def add_user(userItem: UserItem, isAdmin:bool = Depends(ContainPermission(['admin:all']))):
+async def add_user(userItem: UserItem, isAdmin:bool = Depends(ContainPermission(['admin:all'])), session=Depends(get_session)):
+    if userItem.role_id and not isAdmin:
+        raise HTTPException(
+            status_code=403,
+            detail="Only admin can add user with different role_id")
+    hashed_password = await auth.hash_password_async(userItem.password)
     if not userItem.role_id:
-        return user.add(
+        return await run_db(
+            session,
+            user.add,
             userItem.username,
             userItem.email,
             userItem.address,
             userItem.phone_number,
-            auth.hash_password(userItem.password)
+            hashed_password
         )
-    elif isAdmin:
-        return user.add(
+    return await run_db(
+        session,
+        user.add,
         userItem.username,
         userItem.email,
         userItem.address,
         userItem.phone_number,
-        auth.hash_password(userItem.password),
+        hashed_password,
         userItem.role_id
-        )
-    else:
-        raise HTTPException(
-            status_code=403,
-            detail="Only admin can add user with different role_id")
+    )
 
 
-@app.get('/admin', tags=['User'], dependencies=[Depends(PermissionChecker(['admin:all']))])
-async def list_admin():
+@app.get('/admin', response_model=UserList, tags=['User'], dependencies=[Depends(PermissionChecker(['admin:all']))])
+async def list_admin(session=Depends(get_session)):
     return {
-        'Users': user.get_all_librarian()
+        'Users': await run_db(session, user.get_all_librarian)
     }
 
 
 @app.post('/login', tags=['Authentication'])
-async def login(login_schema: LoginScheme):
-    valid_user = user.validate_user(login_schema.email, login_schema.password)
-    token = auth.generate_JWT(login_schema.email, role=valid_user.role_id)
+async def login(login_schema: LoginScheme, session=Depends(get_session)):
+    valid_user = await run_db(session, user.get_from_email, login_schema.email)
+    if not valid_user or not await auth.verify_password_async(login_schema.password, valid_user.password):
+        raise HTTPException(
+            status_code=401,
+            detail={
+                'Error': constant_messages.UNAUTHORIZED_MESSAGE
+            }
+        )
+    claims = None
+    if auth.TOKEN_WITH_PERMISSIONS:
+        claims = await token_claims(session, valid_user.id, valid_user.username, valid_user.role_id)
+    token = auth.generate_JWT(login_schema.email, role=valid_user.role_id, claims=claims)
     return {
         'access_token': token[0],
         'refresh_token': token[1],
@@ -514,8 +688,17 @@ async def login(login_schema: LoginScheme):
 
 
 @app.post('/refresh', tags=['Authentication'])
-async def get_new_accessToken(refreshToken:RefreshTokenModel):
-    token = auth.decodRefreshJWT(refreshToken.token)
+async def get_new_accessToken(refreshToken:RefreshTokenModel, session=Depends(get_session)):
+    if auth.TOKEN_WITH_PERMISSIONS:
+        payload = auth.decodRefreshPayload(refreshToken.token)
+        if 'user_id' not in payload:
+            # Refresh token issued before permissions were put in tokens
+            user_object = await user_from_token(session, payload)
+            payload['user_id'], payload['username'] = user_object.id, user_object.username
+        claims = await token_claims(session, payload['user_id'], payload['username'], payload['role'])
+        token, _ = auth.generate_JWT(payload['user_identifier'], payload['role'], claims=claims)
+    else:
+        token = auth.decodRefreshJWT(refreshToken.token)
     if token:
         return {
             'access_token': token
@@ -532,18 +715,15 @@ async def get_new_accessToken(refreshToken:RefreshTokenModel):
 
 
 @app.post('/verify', tags=['Authentication'])
-async def verify_user(background_task:BackgroundTasks,email:EmailModel, token:dict = Depends(is_verified)):
+async def verify_user(email:EmailModel, token:dict = Depends(is_verified), user_object: User = Depends(current_user),
+                      session=Depends(get_session)):
     if isinstance(token,dict):
-        user_email = token['user_identifier']
-        username = user.get_username_from_email(user_email)
-        user_object = user.get_from_username(username)
+        username = user_object.username
         if user_object.email == email.email:
-            role_id = session.scalar(Select(Role.id).where(Role.name == 'verified user'))
-            user_object.role_id = role_id
-            session.add(user_object)
-            session.commit()
-            background_task.add_task(send_mail.send_verification_mail,email.email,username)
-            # await send_mail.send_mail(email.email)
+            # Queued in the same transaction as the role change, mail_worker.py sends it
+            await run_db(session, MailOutbox.enqueue, 'verification', f'verification:{user_object.id}',
+                         {'email_to_send_to': email.email, 'username': username})
+            await run_db(session, user.change_role, user_object, 'verified user')
             return 'Verified Successfully, please login again to get updated token'
         raise HTTPException(
             status_code= 404,
@@ -556,10 +736,11 @@ async def verify_user(background_task:BackgroundTasks,email:EmailModel, token:di
 @app.get(
     '/role', 
     dependencies=[Depends(PermissionChecker(permissions_required=['user:verified']))],
-    tags=['Authentication']
+    tags=['Authentication'],
+    response_model=list[RoleOut]
     )
-def get_all_available_role():
-    return session.scalars(Select(Role)).all()
+async def get_all_available_role(session=Depends(get_session)):
+    return await run_db(session, Role.get_all)
 
 
 @app.post(
@@ -568,9 +749,9 @@ def get_all_available_role():
     tags=['Authentication'],
     status_code=201
     )
-def add_role(roleModel:RoleModel):
+async def add_role(roleModel:RoleModel, session=Depends(get_session)):
     # print(roleModel.name, roleModel.permission)
-    result = Role.add(roleModel.name, roleModel.permission)
+    result = await run_db(session, Role.add, roleModel.name, roleModel.permission)
     if not result:
         return {"sucess":"Sucessfully added role with provided permissions"}
     return {
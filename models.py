@@ -1,11 +1,18 @@
-from sqlalchemy.orm import DeclarativeBase, relationship, mapped_column
-from sqlalchemy import Select, String, DateTime, BigInteger, Integer, ForeignKey, Boolean
+from sqlalchemy.orm import DeclarativeBase, Session, relationship, mapped_column, joinedload, load_only, raiseload
+from sqlalchemy import Select, update, delete, or_, func, text, literal, Index, UniqueConstraint, JSON, Text, String, DateTime, BigInteger, Integer, ForeignKey, Boolean
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timedelta
-from database.database_connection import session, try_session_commit
+from decouple import config
+from database.database_connection import try_session_commit, read_rows
 from fastapi import HTTPException
 import utils.constant_messages as constant_messages
-from auth.auth import verify_password
+from auth.permission_cache import permission_cache, notify_role_change
+from utils.pagination import paginate
+from utils.cache import entity_cache
+
+# Make relationships that a read path didn't load raise instead of lazy loading, for tests and development
+RAISE_ON_LAZY_LOAD = config('raise_on_lazy_load', default=False, cast=bool)
 
 
 class Base(DeclarativeBase):
@@ -20,6 +27,10 @@ class MemberBook(Base):
     user_id = mapped_column('user_id', Integer, ForeignKey('users.id'))
     book_id = mapped_column('book_id', String, ForeignKey('books.isbn_number'))
 
+    __table_args__ = (
+        UniqueConstraint('user_id', 'book_id', name='uq_member_book_user_id_book_id'),
+    )
+
 
 # Assocication table schema of member and magazine
 class MemberMagazine(Base):
@@ -28,6 +39,11 @@ class MemberMagazine(Base):
     user_id = mapped_column(Integer, ForeignKey('users.id'))
     magazine_id = mapped_column(String, ForeignKey('magazines.issn_number'))
 
+    __table_args__ = (
+        UniqueConstraint('user_id', 'magazine_id', name='uq_member_magazine_user_id_magazine_id'),
+    )
+
+
 class RolePermission(Base):
     __tablename__ = 'role_permission'
     id = mapped_column(Integer,primary_key=True)
@@ -39,38 +55,86 @@ class Role(Base):
     __tablename__ = 'roles'
     id = mapped_column(Integer, primary_key=True)
     name = mapped_column(String, nullable=True, unique=True)
+    # Bumped by a database trigger whenever permissions of the role change
+    version = mapped_column(Integer, nullable=False, default=1, server_default='1')
     users = relationship('User', back_populates='roles')
     # permission_id = mapped_column(Integer, ForeignKey('permissions.id'))
     permission_id = relationship('Permission', back_populates='role_id',secondary='role_permission', lazy='dynamic')
     
     
     @classmethod
-    def add(cls, name:str, permission:list[str]):
+    def add(cls, session: Session, name:str, permission:list[str]):
         # permission_object_list = [
-        #     Permission.get_permission_object(permission_name) for permission_name in permission]
+        #     Permission.get_permission_object(session, permission_name) for permission_name in permission]
         permission_object_list = []
         error_permission_list = []
         for permission_name  in permission:
-            permission_object = Permission.get_permission_object(permission_name)
+            permission_object = Permission.get_permission_object(session, permission_name)
             if not permission_object:
                 error_permission_list.append(permission_name)
                 continue
             permission_object_list.append(permission_object)
         role_to_add = cls(name=name,permission_id=permission_object_list)
         session.add(role_to_add)
+        notify_role_change(session)
         try_session_commit(session)
+        permission_cache.invalidate()
         return error_permission_list
 
+    @classmethod
+    def get_permission_map(cls, session: Session):
+        """
+        Load permission names and version of every role with a single join
+        Returns -> (dict of role id to frozenset of permission names,
+                    dict of role id to version)
+        """
+        rows = session.execute(
+            Select(cls.id, cls.version, Permission.name).outerjoin(
+                RolePermission, RolePermission.role_id == cls.id
+                ).outerjoin(
+                Permission, Permission.id == RolePermission.permission_id
+                )).all()
+        permission_map = {}
+        version_map = {}
+        for role_id, version, permission_name in rows:
+            version_map[role_id] = version
+            names = permission_map.setdefault(role_id, set())
+            if permission_name:
+                names.add(permission_name)
+        return {role_id: frozenset(names) for role_id, names in permission_map.items()}, version_map
 
     @classmethod
-    def role_got_permission(cls,permission_name:str, role_id:int):
-        permission_id = Permission.get_permission_id(permission_name)
-        is_permitted = session.scalar(
-            Select(RolePermission).where(
-                RolePermission.role_id==role_id,
-                RolePermission.permission_id == permission_id
-                ))
-        return is_permitted
+    def load_permission_cache(cls, session: Session):
+        generation = permission_cache.generation
+        permission_map, version_map = cls.get_permission_map(session)
+        permission_cache.replace(permission_map, version_map, generation)
+        return permission_map, version_map
+
+    @classmethod
+    def get_permissions(cls, session: Session, role_id:int):
+        """
+        Give back permission names of role, from cache when it is fresh
+        """
+        permissions = permission_cache.get(role_id)
+        if permissions is None:
+            permission_map, _ = cls.load_permission_cache(session)
+            permissions = permission_map.get(role_id, frozenset())
+        return permissions
+
+    @classmethod
+    def get_version(cls, session: Session, role_id:int):
+        """
+        Give back version of role, from cache when it is fresh
+        """
+        version = permission_cache.get_version(role_id)
+        if version is None:
+            _, version_map = cls.load_permission_cache(session)
+            version = version_map.get(role_id)
+        return version
+
+    @classmethod
+    def get_all(cls, session: Session):
+        return read_rows(session, Select(*cls.__table__.columns).order_by(cls.id))
 
 class Permission(Base):
     __tablename__ = 'permissions'
@@ -80,11 +144,7 @@ class Permission(Base):
     role_id = relationship('Role', back_populates='permission_id', secondary='role_permission', lazy='dynamic')
     
     @classmethod
-    def get_permission_id(cls,permission_name:str):
-        return session.scalar(Select(cls.id).where(cls.name==permission_name))
-    
-    @classmethod
-    def get_permission_object(cls,permission_name:str):
+    def get_permission_object(cls, session: Session, permission_name:str):
         return session.scalar(Select(cls).where(cls.name==permission_name))
 
 
@@ -109,33 +169,47 @@ class User(Base):
         'roles.id'), nullable=True, default=4)
     roles = relationship('Role', back_populates='users')
 
-    def get_all_user(self, page, all, limit):
+    def get_all_user(self, session: Session, page, all, limit, cursor=None):
+        """
+        Returns -> (list of user dicts, cursor of next page or None)
+        """
         if all:
-            statement = Select(User).where(User.role_id >= 2)
-            users = session.execute(statement).all()
-        else:
-            statement = Select(User).offset((page-1)*limit).limit(limit)
-            users = session.execute(statement)
-        users = [user[0] for user in users]
-        return users
+            statement = Select(*user_detail_columns()).where(User.role_id >= 2).order_by(User.id)
+            return read_rows(session, statement), None
+        return paginate(session, Select(*user_detail_columns()), User.id, page, limit, cursor)
+
+    def export_statement(self):
+        """
+        Columns of every member for streaming export, password left out
+        """
+        return Select(
+            User.id, User.username, User.email, User.address, User.phone_number,
+            User.fine, User.role_id, User.date_created, User.expiry_date
+        ).where(User.role_id >= 2).order_by(User.id)
 
-    def get_all_librarian(self,):
-        statement = Select(User).where(User.role_id == 1)
-        users = session.execute(statement).all()
-        users = [user[0] for user in users]
-        return users
+    def get_all_librarian(self, session: Session):
+        statement = Select(*user_detail_columns()).where(User.role_id == 1).order_by(User.id)
+        return read_rows(session, statement)
 
     # Get only borrowed books or magazine
 
-    def get_all_borrowed(self, username):
-        userFound = self.get_from_username(username)
+    def get_all_borrowed(self, session: Session, user):
+        """
+        Titles of the books and magazines user holds, read in one query
+        however many there are, plus the user lookup when given a username
+        """
+        user_id = user.id if isinstance(user, User) else self.get_from_username(session, user).id
+        statement = Select(literal('book').label('kind'), Book.title).join(
+            MemberBook, MemberBook.book_id == Book.isbn_number
+        ).where(MemberBook.user_id == user_id).union_all(
+            Select(literal('magazine'), Magazine.title).join(
+                MemberMagazine, MemberMagazine.magazine_id == Magazine.issn_number
+            ).where(MemberMagazine.user_id == user_id)
+        )
         book = []
         magazine = []
-        if userFound.book_id:
-            book = [book.title for book in userFound.book_id]
-
-        if userFound.magazine_id:
-            magazine = [magazine.title for magazine in userFound.magazine_id]
+        for kind, title in session.execute(statement):
+            (book if kind == 'book' else magazine).append(title)
         if book == [] and magazine == []:
             return "No Book Borrowed"
         return {
@@ -143,12 +217,15 @@ class User(Base):
             "Magazine": magazine
         }
 
-    def get_from_username(self, username):
+    def get_from_username(self, session: Session, username, lock=False):
         """
         Give back the database instance of the user object
-        from username
+        from username, with lock the row is locked till the transaction ends
         """
-        user_object = session.scalar(Select(User).where(User.username==username))
+        statement = Select(User).where(User.username==username)
+        if lock:
+            statement = statement.with_for_update()
+        user_object = session.scalar(statement)
         if not user_object:
             raise HTTPException(status_code=404,
                                 detail={
@@ -159,13 +236,30 @@ class User(Base):
                                 })
         return user_object
 
-    def get_username_from_email(self, email):
+    def get_principal(self, session: Session, user_id=None, email=None):
         """
-        Give back the username of user from username
+        User making a request, by id or else by email, with its role joined
+        in the same query. The password is left out.
+        Returns -> User or None
         """
-        user_object = session.query(User).where(
-            User.email == email).one_or_none()
-        if not user_object:
+        statement = Select(User).options(*loader_profile(
+            load_only(*user_detail_columns()),
+            joinedload(User.roles).load_only(Role.id, Role.name)
+        ))
+        if user_id is not None:
+            statement = statement.where(User.id == user_id)
+        else:
+            statement = statement.where(User.email == email)
+        return session.scalar(statement)
+
+    def get_details(self, session: Session, username):
+        """
+        Columns of details() of the user with given username as a dict
+        """
+        user_details = session.execute(
+            Select(*user_detail_columns()).where(User.username == username)
+        ).mappings().one_or_none()
+        if not user_details:
             raise HTTPException(status_code=404,
                                 detail={
                                     "error": {
@@ -173,28 +267,44 @@ class User(Base):
                                         "error_message": constant_messages.request_not_found("user", "username")
                                     }
                                 })
-        return user_object.username
+        return dict(user_details)
+
+    def details(self):
+        """
+        Columns of the user the api shows, the password left out
+        """
+        return {column.key: getattr(self, column.key) for column in user_detail_columns()}
+
+    def resolve(self, session: Session, user, lock=False):
+        """
+        User object of user, which is a username or an already loaded User.
+        With lock the row is locked till the transaction ends.
+        """
+        if isinstance(user, User):
+            if lock:
+                session.execute(Select(User.id).where(User.id == user.id).with_for_update())
+            return user
+        return self.get_from_username(session, user, lock=lock)
+
+    def change_role(self, session: Session, user_object, role_name: str):
+        """
+        Change the role of given user object to role with given name
+        """
+        user_object.role_id = session.scalar(Select(Role.id).where(Role.name == role_name))
+        session.add(user_object)
+        try_session_commit(session)
 
-    def validate_user(self, email: str, password: str):
+    def get_from_email(self, session: Session, email: str):
         """
-        Simply Validate if a librarian with given email and password exsist
-        Return Librarian object or None
+        Row (id, username, role_id, password) of the user with given email or None.
+        The password is checked by the caller so the hashing does not hold a
+        database worker, its hash is selected here since the column is deferred.
         """
-        selected_user = session.query(User).where(
-            User.email == email,
+        return session.execute(
+            Select(User.id, User.username, User.role_id, User.password).where(User.email == email)
         ).one_or_none()
-        if selected_user:
-            verified = verify_password(password, selected_user.password)
-            if verified:
-                return selected_user
-        raise HTTPException(
-            status_code=401,
-            detail={
-                'Error': constant_messages.UNAUTHORIZED_MESSAGE
-            }
-        )
 
-    def add(self, username, email, address, phone_number, password, role_id = None):
+    def add(self, session: Session, username, email, address, phone_number, password, role_id = None):
         if not role_id:
             session.add(User(
                 username=username,
@@ -226,43 +336,42 @@ class User(Base):
                                     }
                                 })
 
-    def borrow_book(self, username, isbn_number, days=15):
+    def borrow_book(self, session: Session, user, isbn_number, days=15):
         """
-        Add book with given isbn number to a user with given username
+        Add book with given isbn number to given user
         """
-        book_to_add = session.query(Book).where(
-            Book.isbn_number == isbn_number).one_or_none()
-        if not book_to_add:
-            raise HTTPException(status_code=404,
+        # Lock the user row so the same user can't borrow the book twice at once
+        user_object = self.resolve(session, user, lock=True)
+
+        user_already_exsist = open_record_exists(
+            session, user_object.id, Record.book_id, isbn_number)
+        if user_already_exsist:
+            raise HTTPException(status_code=400,
                                 detail={
                                     "error": {
-                                        "error_type": constant_messages.REQUEST_NOT_FOUND,
-                                        "error_message": constant_messages.request_not_found(
+                                        "error_type": constant_messages.BAD_REQUEST,
+                                        "error_message": constant_messages.bad_request(
                                             "book",
-                                            "ISBN number"
+                                            "isbn",
+                                            True
                                         )
                                     }
                                 })
 
-        user_object = self.get_from_username(username)
-
-        user_object.book_id += [book_to_add]
-        book_to_add.available_number -= 1
-        user_already_exsist = session.query(Record).where(
-            Record.book_id == book_to_add.isbn_number,
-            Record.member_id == user_object.id,
-            Record.returned == False
-        ).count()
-        if not user_already_exsist and book_to_add.available_number > 0:
-            book_record = Record(
-                user=user_object, book=book_to_add,
-                genre=book_to_add.genre, issued_date=datetime.utcnow().date(),
-                expected_return_date=(
-                    datetime.utcnow().date() + timedelta(days=days))
-            )
-            session.add(book_record)
-            try_session_commit(session)
-        elif book_to_add.available_number == 0:
+        # Take one copy only while there is stock, in a single UPDATE
+        reserved = reserve_copy(session, Book, Book.isbn_number, isbn_number)
+        if not reserved:
+            if not session.get(Book, isbn_number):
+                raise HTTPException(status_code=404,
+                                    detail={
+                                        "error": {
+                                            "error_type": constant_messages.REQUEST_NOT_FOUND,
+                                            "error_message": constant_messages.request_not_found(
+                                                "book",
+                                                "ISBN number"
+                                            )
+                                        }
+                                    })
             raise HTTPException(status_code=409,
                                 detail={
                                     "error": {
@@ -273,22 +382,21 @@ class User(Base):
                                     }
                                 })
 
-        else:
-            raise HTTPException(status_code=400,
-                                detail={
-                                    "error": {
-                                        "error_type": constant_messages.BAD_REQUEST,
-                                        "error_message": constant_messages.bad_request(
-                                            "book",
-                                            "isbn",
-                                            True
-                                        )
-                                    }
-                                })
+        session.add(
+            Record(
+                member_id=user_object.id, book_id=isbn_number,
+                genre_id=reserved.genre_id, issued_date=datetime.utcnow().date(),
+                expected_return_date=(
+                    datetime.utcnow().date() + timedelta(days=days))
+            )
+        )
+        link_items(session, MemberBook, 'book_id', user_object.id, [isbn_number])
+        try_session_commit(session)
+        entity_cache.invalidate('book', isbn_number)
 
-    def return_book(self, username, isbn_number):
+    def return_book(self, session: Session, user, isbn_number):
         """
-        Return book with given isbn number from a user with given username
+        Return book with given isbn number from given user
         """
         book_to_return = session.query(Book).where(
             Book.isbn_number == isbn_number).one_or_none()
@@ -303,31 +411,21 @@ class User(Base):
                                             "ISBN number")
                                     }
                                 })
-        user_object = self.get_from_username(username)
+        user_object = self.resolve(session, user)
 
         # Get Unreturned books
         got_record = session.query(Record).where(
             Record.member_id == user_object.id,
             Record.book_id == isbn_number,
             Record.returned == False
-        ).one_or_none()
-        fine = 0
-
+        ).with_for_update().one_or_none()
         if got_record:
             books_record = got_record
-
-            # Check if the expected return date is 3 days before, if yes no fine is calculated
-            if books_record.expected_return_date.date() < datetime.utcnow().date():
-                extra_days = (datetime.utcnow().date() -
-                              books_record.expected_return_date.date()).days
-
-                # For each days after 3 days, fine is calculated as Rs 3 per day
-                if extra_days > 3:
-                    fine = extra_days * 3
+            fine = calculate_fine(books_record.expected_return_date)
 
             # sucessfull return, increased the available number
             # Also marked the book returned in Record
-            book_to_return.available_number += 1
+            release_copy(session, Book, Book.isbn_number, isbn_number)
             books_record.returned = True
             books_record.returned_date = datetime.utcnow().date()
 
@@ -337,6 +435,7 @@ class User(Base):
                 MemberBook.user_id == user_object.id
             ).delete()
             try_session_commit(session)
+            entity_cache.invalidate('book', isbn_number)
             return fine
         else:
             raise HTTPException(status_code=404,
@@ -351,9 +450,9 @@ class User(Base):
 
                                 })
 
-    def return_magazine(self, username, issn_number):
+    def return_magazine(self, session: Session, user, issn_number):
         """
-        User return magazine with given issn number from a user with given username
+        User return magazine with given issn number from given user
 
         Returns -> fine:int or None
         """
@@ -372,33 +471,22 @@ class User(Base):
                                     }
                                 })
 
-        # Check if username exsist
-        user_object = self.get_from_username(username)
+        # Check if user exsist
+        user_object = self.resolve(session, user)
 
         # Check if record exsist
         got_record = session.query(Record).where(
             Record.member_id == user_object.id,
             Record.magazine_id == issn_number,
             Record.returned == False
-        ).one_or_none()
-        fine = 0
+        ).with_for_update().one_or_none()
         if got_record:
             magazine_record = got_record
-
-            # Check if the expected returned date is expired
-            if magazine_record.expected_return_date.date() < datetime.utcnow().date():
-
-                extra_days = (magazine_record.expected_return_date.date(
-                ) - datetime.utcnow().date()).days
-
-                # if magazine is't returned after 3 days of expected date
-                # Calculate fine as Rs3 per day
-                if extra_days > 3:
-                    fine = extra_days * 3
+            fine = calculate_fine(magazine_record.expected_return_date)
 
             # Magazine Sucessfully returned
             # Increase available number and marked returned
-            magazine_to_return.available_number += 1
+            release_copy(session, Magazine, Magazine.issn_number, issn_number)
             magazine_record.returned = True
             magazine_record.returned_date = datetime.utcnow().date()
 
@@ -408,6 +496,7 @@ class User(Base):
                 MemberMagazine.user_id == user_object.id
             ).delete()
             try_session_commit(session)
+            entity_cache.invalidate('magazine', issn_number)
             return fine
         else:
             raise HTTPException(status_code=404,
@@ -420,47 +509,43 @@ class User(Base):
                                     }
                                 })
 
-    def borrow_magazine(self, username, issn_number, days=15):
+    def borrow_magazine(self, session: Session, user, issn_number, days=15):
         """
-        Add magazine with given issn number to a user with given username
+        Add magazine with given issn number to given user
         """
-        magazine_to_add = session.query(Magazine).where(
-            Magazine.issn_number == issn_number).one_or_none()
-        if not magazine_to_add:
-            raise HTTPException(status_code=404,
+        # Check if user exsist and lock it while the magazine is issued
+        user_object = self.resolve(session, user, lock=True)
+
+        # Check record if the magazine is already issued to same member
+        user_already_exsist = open_record_exists(
+            session, user_object.id, Record.magazine_id, issn_number)
+        if user_already_exsist:
+            raise HTTPException(status_code=400,
                                 detail={
                                     "error": {
-                                        "error_type": constant_messages.REQUEST_NOT_FOUND,
-                                        "error_message": constant_messages.request_not_found(
+                                        "error_type": constant_messages.BAD_REQUEST,
+                                        "error_message": constant_messages.bad_request(
                                             "magazine",
-                                            "ISSN number"
+                                            "ISSN number",
+                                            True
                                         )
                                     }
                                 })
-        # Check if user exsist and add the magazine to that user
-        user_object = self.get_from_username(username)
-        user_object.magazine_id += [magazine_to_add]
 
-        # Check record if the magazine is already issued to same member
-        user_already_exsist = session.query(Record).where(
-            Record.magazine_id == magazine_to_add.issn_number,
-            Record.member_id == user_object.id,
-            Record.returned == False
-        ).count()
-
-        if not user_already_exsist and magazine_to_add.available_number > 0:
-            magazine_to_add.available_number -= 1
-            magazine_record = Record(
-                user=user_object,
-                magazine=magazine_to_add,
-                genre=magazine_to_add.genre,
-                issued_date=datetime.utcnow().date(),
-                expected_return_date=(
-                    datetime.utcnow().date() + timedelta(days=days))
-            )
-            session.add(magazine_record)
-            try_session_commit(session)
-        elif magazine_to_add.available_number == 0:
+        # Take one copy only while there is stock, in a single UPDATE
+        reserved = reserve_copy(session, Magazine, Magazine.issn_number, issn_number)
+        if not reserved:
+            if not session.get(Magazine, issn_number):
+                raise HTTPException(status_code=404,
+                                    detail={
+                                        "error": {
+                                            "error_type": constant_messages.REQUEST_NOT_FOUND,
+                                            "error_message": constant_messages.request_not_found(
+                                                "magazine",
+                                                "ISSN number"
+                                            )
+                                        }
+                                    })
             raise HTTPException(status_code=409,
                                 detail={
                                     "error": {
@@ -470,18 +555,131 @@ class User(Base):
                                         )
                                     }
                                 })
-        else:
-            raise HTTPException(status_code=400,
-                                detail={
-                                    "error": {
-                                        "error_type": constant_messages.BAD_REQUEST,
-                                        "error_message": constant_messages.bad_request(
-                                            "magazine",
-                                            "ISSN number",
-                                            True
-                                        )
-                                    }
-                                })
+
+        session.add(
+            Record(
+                member_id=user_object.id,
+                magazine_id=issn_number,
+                genre_id=reserved.genre_id,
+                issued_date=datetime.utcnow().date(),
+                expected_return_date=(
+                    datetime.utcnow().date() + timedelta(days=days))
+            )
+        )
+        link_items(session, MemberMagazine, 'magazine_id', user_object.id, [issn_number])
+        try_session_commit(session)
+        entity_cache.invalidate('magazine', issn_number)
+
+
+    def borrow_batch(self, session: Session, user, isbn_list: list, issn_list: list, days=15):
+        """
+        Borrow many books and magazines for one user in a single transaction.
+        Items already issued to the user, out of stock or unknown are skipped.
+        Returns -> list of {"isbn"/"issn": id, "status": ...} in request order
+        """
+        user_object = self.resolve(session, user, lock=True)
+        isbn_list = list(dict.fromkeys(isbn_list))
+        issn_list = list(dict.fromkeys(issn_list))
+
+        # Everything the user already holds, in one query
+        open_records = session.execute(
+            Select(Record.book_id, Record.magazine_id).where(
+                Record.member_id == user_object.id,
+                Record.returned == False,
+                or_(Record.book_id.in_(isbn_list), Record.magazine_id.in_(issn_list))
+            )).all()
+        issued_books = {record.book_id for record in open_records}
+        issued_magazines = {record.magazine_id for record in open_records}
+
+        results = []
+        today = datetime.utcnow().date()
+        for item_model, key_column, record_key, association, association_key, item_ids, issued, id_name in (
+            (Book, Book.isbn_number, 'book_id', MemberBook, 'book_id', isbn_list, issued_books, 'isbn'),
+            (Magazine, Magazine.issn_number, 'magazine_id', MemberMagazine, 'magazine_id', issn_list, issued_magazines, 'issn'),
+        ):
+            to_reserve = [item_id for item_id in item_ids if item_id not in issued]
+            reserved = reserve_copies(session, item_model, key_column, to_reserve)
+            missing = [item_id for item_id in to_reserve if item_id not in reserved]
+            existing = set()
+            if missing:
+                existing = set(session.scalars(Select(key_column).where(key_column.in_(missing))).all())
+
+            for item_id in item_ids:
+                if item_id in issued:
+                    status = "already_issued"
+                elif item_id in reserved:
+                    status = "borrowed"
+                    session.add(Record(
+                        member_id=user_object.id, genre_id=reserved[item_id],
+                        issued_date=today, expected_return_date=today + timedelta(days=days),
+                        **{record_key: item_id}
+                    ))
+                elif item_id in existing:
+                    status = "out_of_stock"
+                else:
+                    status = "not_found"
+                results.append({id_name: item_id, "status": status})
+            link_items(session, association, association_key, user_object.id, list(reserved))
+
+        try_session_commit(session)
+        entity_cache.invalidate('book', *isbn_list)
+        entity_cache.invalidate('magazine', *issn_list)
+        return results
+
+    def return_batch(self, session: Session, user, isbn_list: list, issn_list: list):
+        """
+        Return many books and magazines of one user in a single transaction.
+        Returns -> (list of {"isbn"/"issn": id, "status": ..., "fine": int}, total fine)
+        """
+        user_object = self.resolve(session, user)
+        isbn_list = list(dict.fromkeys(isbn_list))
+        issn_list = list(dict.fromkeys(issn_list))
+
+        open_records = session.scalars(
+            Select(Record).where(
+                Record.member_id == user_object.id,
+                Record.returned == False,
+                or_(Record.book_id.in_(isbn_list), Record.magazine_id.in_(issn_list))
+            ).with_for_update()).all()
+
+        results = []
+        total_fine = 0
+        today = datetime.utcnow().date()
+        for item_model, key_column, record_key, association, association_key, item_ids, id_name in (
+            (Book, Book.isbn_number, 'book_id', MemberBook, MemberBook.book_id, isbn_list, 'isbn'),
+            (Magazine, Magazine.issn_number, 'magazine_id', MemberMagazine, MemberMagazine.magazine_id, issn_list, 'issn'),
+        ):
+            records = {}
+            for record in open_records:
+                if getattr(record, record_key) in item_ids:
+                    records.setdefault(getattr(record, record_key), []).append(record)
+
+            for item_id in item_ids:
+                if item_id not in records:
+                    results.append({id_name: item_id, "status": "not_issued", "fine": 0})
+                    continue
+                fine = 0
+                for record in records[item_id]:
+                    fine += calculate_fine(record.expected_return_date)
+                    record.returned = True
+                    record.returned_date = today
+                total_fine += fine
+                results.append({id_name: item_id, "status": "returned", "fine": fine})
+
+            if records:
+                release_copies(session, item_model, key_column, records)
+                session.execute(
+                    delete(association).where(
+                        association.user_id == user_object.id,
+                        association_key.in_(list(records))
+                    ),
+                    execution_options={'synchronize_session': False}
+                )
+
+        try_session_commit(session)
+        entity_cache.invalidate('book', *isbn_list)
+        entity_cache.invalidate('magazine', *issn_list)
+        return results, total_fine
 
 
 # Table schema of publisher
@@ -494,29 +692,35 @@ class Publisher(Base):
     books = relationship('Book', backref='publisher')
     magazine = relationship('Magazine', backref='publisher')
 
-    def get_all(self, page, all, limit):
-        # return session.query(Publisher).all()
+    def get_all(self, session: Session, page, all, limit, cursor=None):
+        """
+        Returns -> (list of publisher dicts, cursor of next page or None)
+        """
         if all:
-            statement = Select(Publisher)
-            publisher_list = session.execute(statement).all()
-        else:
-            statement = Select(Publisher).offset((page-1)*limit).limit(limit)
-            publisher_list = session.execute(statement)
-        publisher_list = [publisher_obj[0] for publisher_obj in publisher_list]
-        return publisher_list
+            statement = Select(*Publisher.__table__.columns).order_by(Publisher.id)
+            return read_rows(session, statement), None
+        return paginate(session, Select(*Publisher.__table__.columns), Publisher.id, page, limit, cursor)
 
-    def get_from_id(self, id):
+    def get_from_id(self, session: Session, id):
         """
         Get a database instance of publisher object with given id
         Return publisher object or None
         """
         return session.query(Publisher).where(Publisher.id == id).one_or_none()
 
-    def add(self, name, phone_number, address):
-        session.add(Publisher(name=name, address=address,
-                    phone_number=phone_number))
+    def get_cached(self, session: Session, id):
+        """
+        Columns of the publisher with given id as a dict or None,
+        read through entity_cache
+        """
+        return entity_cache.get('publisher', id, lambda: row_dict(session, Publisher, Publisher.id == id))
+
+    def add(self, session: Session, name, phone_number, address):
+        new_publisher = Publisher(name=name, address=address, phone_number=phone_number)
+        session.add(new_publisher)
         try:
             session.commit()
+            entity_cache.invalidate('publisher', new_publisher.id)
             return "Publisher Added Sucessfully"
 
         except IntegrityError:
@@ -545,17 +749,18 @@ class Book(Base):
     record = relationship('Record', backref='book')
 
 
-    def get_all(self, all, page, limit):
+    def get_all(self, session: Session, all, page, limit, cursor=None):
+        """
+        Returns -> (list of book dicts, cursor of next page or None)
+        """
         if all:
-            statement = Select(Book)
-            books = session.execute(statement).all()
+            statement = Select(*Book.__table__.columns).order_by(Book.isbn_number)
+            books, next_cursor = read_rows(session, statement), None
         else:
-            statement = Select(Book).offset((page-1)*limit).limit(limit)
-            books = session.execute(statement)
+            books, next_cursor = paginate(session, Select(*Book.__table__.columns), Book.isbn_number, page, limit, cursor)
 
-        books = [book[0] for book in books]
         if books:
-            return books
+            return books, next_cursor
         raise HTTPException(status_code=204,
                             detail={
                                 "error": {
@@ -564,14 +769,30 @@ class Book(Base):
                                 }
                             })
 
-    def get_from_id(self, isbn):
+    def export_statement(self):
+        """
+        Columns of every book for streaming export
+        """
+        return Select(
+            Book.isbn_number, Book.title, Book.author, Book.price,
+            Book.genre_id, Book.publisher_id, Book.available_number
+        ).order_by(Book.isbn_number)
+
+    def get_from_id(self, session: Session, isbn):
         """
         Get a database instance of book object with given isbn number
         Return book object or None
         """
         return session.query(Book).where(Book.isbn_number == str(isbn)).one_or_none()
 
-    def add(self, isbn, author, title, price, genre_id, publisher_id, available_number):
+    def get_cached(self, session: Session, isbn):
+        """
+        Columns of the book with given isbn as a dict or None,
+        read through entity_cache
+        """
+        return entity_cache.get('book', str(isbn), lambda: row_dict(session, Book, Book.isbn_number == str(isbn)))
+
+    def add(self, session: Session, isbn, author, title, price, genre_id, publisher_id, available_number):
         session.add(Book(
             isbn_number=isbn,
             author=author,
@@ -584,6 +805,7 @@ class Book(Base):
 
         try:
             session.commit()
+            entity_cache.invalidate('book', isbn)
             return "Book Added Sucessfully"
         except IntegrityError as e:
             # print(e)
@@ -613,16 +835,18 @@ class Magazine(Base):
     available_number = mapped_column(Integer, default=0)
     record = relationship('Record', backref='magazine')
 
-    def get_all(self, page, all, limit):
+    def get_all(self, session: Session, page, all, limit, cursor=None):
+        """
+        Returns -> (list of magazine dicts, cursor of next page or None)
+        """
         if all:
-            statement = Select(Magazine)
-            magazines = session.execute(statement).all()
+            statement = Select(*Magazine.__table__.columns).order_by(Magazine.issn_number)
+            magazines, next_cursor = read_rows(session, statement), None
         else:
-            statement = Select(Magazine).offset((page-1)*limit).limit(limit)
-            magazines = session.execute(statement)
-        magazines = [magazine[0] for magazine in magazines]
+            magazines, next_cursor = paginate(session, Select(*Magazine.__table__.columns), Magazine.issn_number,
+                                              page, limit, cursor)
         if magazines:
-            return magazines
+            return magazines, next_cursor
         raise HTTPException(status_code=204,
                             detail={
                                 "error": {
@@ -631,14 +855,30 @@ class Magazine(Base):
                                 }
                             })
 
-    def get_from_id(self, issn):
+    def export_statement(self):
+        """
+        Columns of every magazine for streaming export
+        """
+        return Select(
+            Magazine.issn_number, Magazine.title, Magazine.editor, Magazine.price,
+            Magazine.genre_id, Magazine.publisher_id, Magazine.available_number
+        ).order_by(Magazine.issn_number)
+
+    def get_from_id(self, session: Session, issn):
         """
         Get a database instance of magazine object with given issn number
         Return magazine object or None
         """
         return session.query(Magazine).where(Magazine.issn_number == str(issn)).one_or_none()
 
-    def add(self, issn, editor, title, price, genre_id, publisher_id, available_number):
+    def get_cached(self, session: Session, issn):
+        """
+        Columns of the magazine with given issn as a dict or None,
+        read through entity_cache
+        """
+        return entity_cache.get('magazine', str(issn), lambda: row_dict(session, Magazine, Magazine.issn_number == str(issn)))
+
+    def add(self, session: Session, issn, editor, title, price, genre_id, publisher_id, available_number):
         session.add(Magazine(
             issn_number=issn,
             editor=editor,
@@ -651,6 +891,7 @@ class Magazine(Base):
 
         try:
             session.commit()
+            entity_cache.invalidate('magazine', issn)
             return "Magazine Added Sucessfully"
         except IntegrityError as e:
             # print(e)
@@ -674,28 +915,35 @@ class Genre(Base):
     magazine = relationship('Magazine', backref='genre')
     record = relationship('Record', backref='genre')
 
-    def get_all(self, page, all, limit):
-        # return session.query(Genre).all()
+    def get_all(self, session: Session, page, all, limit, cursor=None):
+        """
+        Returns -> (list of genre dicts, cursor of next page or None)
+        """
         if all:
-            statement = Select(Genre)
-            genre_list = session.execute(statement).all()
-        else:
-            statement = Select(Genre).offset((page-1)*limit).limit(limit)
-            genre_list = session.execute(statement)
-        genre_list = [genre_obj[0] for genre_obj in genre_list]
-        return genre_list
+            statement = Select(*Genre.__table__.columns).order_by(Genre.id)
+            return read_rows(session, statement), None
+        return paginate(session, Select(*Genre.__table__.columns), Genre.id, page, limit, cursor)
 
-    def get_from_id(self, id):
+    def get_from_id(self, session: Session, id):
         """
         Get a database instance of genre object with given id
         Return genre object or None
         """
         return session.query(Genre).where(Genre.id == id).one_or_none()
 
-    def add(self, name):
-        session.add(Genre(name=name))
+    def get_cached(self, session: Session, id):
+        """
+        Columns of the genre with given id as a dict or None,
+        read through entity_cache
+        """
+        return entity_cache.get('genre', id, lambda: row_dict(session, Genre, Genre.id == id))
+
+    def add(self, session: Session, name):
+        new_genre = Genre(name=name)
+        session.add(new_genre)
         try:
             session.commit()
+            entity_cache.invalidate('genre', new_genre.id)
             return "Genre Added Sucessfully"
         except IntegrityError:
             session.rollback()
@@ -722,3 +970,231 @@ class Record(Base):
     expected_return_date = mapped_column(DateTime(), default=(
         datetime.utcnow().date() + timedelta(days=15)))
     returned = mapped_column(Boolean, default=False)
+
+    # Only open loans are looked up, returned ones are history and stay out of the indexes
+    __table_args__ = (
+        Index('ix_records_open_member_id_book_id', 'member_id', 'book_id', postgresql_where=text('returned = false')),
+        Index('ix_records_open_member_id_magazine_id', 'member_id', 'magazine_id',
+              postgresql_where=text('returned = false')),
+        Index('ix_records_open_expected_return_date', 'expected_return_date', postgresql_where=text('returned = false')),
+    )
+
+
+# Mails waiting to be sent by mail_worker.py
+class MailOutbox(Base):
+    __tablename__ = 'mail_outbox'
+    id = mapped_column(BigInteger, primary_key=True)
+    # Same key is only queued once, e.g. one digest per user per day
+    idempotency_key = mapped_column(String, nullable=False, unique=True)
+    kind = mapped_column(String, nullable=False)
+    payload = mapped_column(JSON, nullable=False)
+    # pending -> sending -> sent, or failed after MAIL_OUTBOX_MAX_ATTEMPTS
+    status = mapped_column(String, nullable=False, default='pending', server_default='pending')
+    attempts = mapped_column(Integer, nullable=False, default=0, server_default='0')
+    last_error = mapped_column(Text)
+    # Not claimed before this time, also the lease of a job being sent
+    available_at = mapped_column(DateTime(), nullable=False, default=datetime.utcnow, server_default=func.now())
+    created_at = mapped_column(DateTime(), nullable=False, default=datetime.utcnow, server_default=func.now())
+    sent_at = mapped_column(DateTime())
+
+    __table_args__ = (
+        Index('ix_mail_outbox_status_available_at', 'status', 'available_at'),
+    )
+
+    @classmethod
+    def enqueue(cls, session: Session, kind: str, idempotency_key: str, payload: dict):
+        """
+        Queue a mail in the transaction of session, a mail with the same
+        idempotency key is never queued twice. Commit is left to the caller.
+        Returns -> True if queued, False if the key was already there
+        """
+        result = session.execute(
+            pg_insert(cls).values(
+                kind=kind,
+                idempotency_key=idempotency_key,
+                payload=payload
+            ).on_conflict_do_nothing(index_elements=[cls.idempotency_key])
+        )
+        return result.rowcount == 1
+
+    @classmethod
+    def claim(cls, session: Session, limit: int, lease: timedelta, max_attempts: int):
+        """
+        Lock and take up to limit due jobs, jobs locked by other workers are
+        skipped. A job whose worker died while sending is taken again once
+        its lease ran out, or marked failed when that was its last attempt.
+        Returns -> list of claimed MailOutbox
+        """
+        now = datetime.utcnow()
+        jobs = session.scalars(
+            Select(cls).where(
+                cls.status.in_(['pending', 'sending']),
+                cls.available_at <= now
+            ).order_by(cls.available_at).limit(limit).with_for_update(skip_locked=True)
+        ).all()
+        claimed = []
+        for job in jobs:
+            if job.status == 'sending' and job.attempts >= max_attempts:
+                # Its send crashed or hung the worker every time, don't try again
+                job.status = 'failed'
+                job.last_error = f'Lease expired on attempt {job.attempts}'
+                continue
+            job.status = 'sending'
+            job.attempts += 1
+            job.available_at = now + lease
+            claimed.append(job)
+        try_session_commit(session)
+        return claimed
+
+    @classmethod
+    def mark_sent(cls, session: Session, job_id: int):
+        session.execute(
+            update(cls).where(cls.id == job_id).values(status='sent', sent_at=datetime.utcnow(), last_error=None)
+        )
+
+    @classmethod
+    def mark_failed(cls, session: Session, job_id: int, error: str, retry_at: datetime | None):
+        """
+        Give the job back for retry_at, or give up on it when retry_at is None
+        """
+        values = {'status': 'pending', 'available_at': retry_at} if retry_at else {'status': 'failed'}
+        session.execute(update(cls).where(cls.id == job_id).values(last_error=error, **values))
+
+
+
+# Version of every catalogue table, bumped by a trigger on each commit changing it
+class CatalogueVersion(Base):
+    __tablename__ = 'catalogue_versions'
+    table_name = mapped_column(String(50), primary_key=True)
+    version = mapped_column(BigInteger, nullable=False, default=1, server_default='1')
+
+    @classmethod
+    def get_versions(cls, session: Session, table_names: list):
+        """
+        Returns -> dict of table name to its version, 0 for tables without one
+        """
+        versions = dict(session.execute(
+            Select(cls.table_name, cls.version).where(cls.table_name.in_(table_names))).all())
+        return {table_name: versions.get(table_name, 0) for table_name in table_names}
+
+def open_record_exists(session: Session, member_id: int, item_column, item_id: str):
+    """
+    Check if member already got an unreturned record of the item
+    """
+    return session.scalar(
+        Select(Record.id).where(
+            Record.member_id == member_id,
+            item_column == item_id,
+            Record.returned == False
+        ).limit(1)) is not None
+
+
+def reserve_copy(session: Session, item_model, key_column, item_id: str):
+    """
+    Decrease available number of a book or magazine by one in a single
+    conditional UPDATE, so concurrent borrowers can never oversell it.
+    Returns -> row with genre_id of the item, or None when unknown or out of stock
+    """
+    return session.execute(
+        update(item_model).where(
+            key_column == item_id,
+            item_model.available_number > 0
+        ).values(
+            available_number=item_model.available_number - 1
+        ).returning(item_model.genre_id),
+        execution_options={'synchronize_session': False}
+    ).one_or_none()
+
+
+def release_copy(session: Session, item_model, key_column, item_id: str):
+    """
+    Increase available number of a book or magazine by one in the database
+    """
+    session.execute(
+        update(item_model).where(key_column == item_id).values(
+            available_number=item_model.available_number + 1
+        ),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def reserve_copies(session: Session, item_model, key_column, item_ids: list):
+    """
+    reserve_copy for many items of one kind with a single UPDATE
+    Returns -> dict of reserved item id to its genre_id
+    """
+    if not item_ids:
+        return {}
+    rows = session.execute(
+        update(item_model).where(
+            key_column.in_(item_ids),
+            item_model.available_number > 0
+        ).values(
+            available_number=item_model.available_number - 1
+        ).returning(key_column, item_model.genre_id),
+        execution_options={'synchronize_session': False}
+    ).all()
+    return {item_id: genre_id for item_id, genre_id in rows}
+
+
+def link_items(session: Session, association, association_key: str, user_id: int, item_ids: list):
+    """
+    Insert the member - item rows of association in one statement. A row left
+    behind by a refused borrow of older versions is kept, not a unique violation.
+    """
+    if not item_ids:
+        return
+    session.execute(
+        pg_insert(association).values(
+            [{'user_id': user_id, association_key: item_id} for item_id in item_ids]
+        ).on_conflict_do_nothing(index_elements=['user_id', association_key])
+    )
+
+
+def release_copies(session: Session, item_model, key_column, item_ids):
+    """
+    release_copy for many items of one kind with a single UPDATE
+    """
+    session.execute(
+        update(item_model).where(key_column.in_(list(item_ids))).values(
+            available_number=item_model.available_number + 1
+        ),
+        execution_options={'synchronize_session': False}
+    )
+
+
+def calculate_fine(expected_return_date: datetime, today=None):
+    """
+    No fine till 3 days after the expected return date,
+    after that Rs 3 for every day since the expected return date
+    """
+    today = today or datetime.utcnow().date()
+    extra_days = (today - expected_return_date.date()).days
+    if extra_days > 3:
+        return extra_days * 3
+    return 0
+
+
+def row_dict(session: Session, model, *criteria):
+    """
+    Columns of the one row of model matching criteria as a plain dict, or None
+    """
+    row = session.execute(Select(*model.__table__.columns).where(*criteria)).mappings().one_or_none()
+    return dict(row) if row is not None else None
+
+
+def user_detail_columns():
+    """
+    Columns of users the api shows, the password left out
+    """
+    return [getattr(User, column.key) for column in User.__table__.columns if column.key != 'password']
+
+
+def loader_profile(*options):
+    """
+    Loader options of one read path. Relationships the options don't name
+    stay unloaded, with RAISE_ON_LAZY_LOAD touching one of them raises.
+    """
+    if RAISE_ON_LAZY_LOAD:
+        return (*options, raiseload('*'))
+    return options
@@ -0,0 +1,66 @@
+"""
+Fixtures for tests against the database in .env, schema of `alembic upgrade head`.
+Every test runs in a transaction that is rolled back at the end, commits made
+by the code under test only release a savepoint.
+"""
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from database.database_connection import engine
+from models import Book, Genre, Magazine, Publisher, Role, User
+
+
+@pytest.fixture
+def session():
+    try:
+        connection = engine.connect()
+    except OperationalError:
+        pytest.skip('no database, see .env')
+    transaction = connection.begin()
+    session = Session(bind=connection, join_transaction_mode='create_savepoint', expire_on_commit=False)
+    try:
+        yield session
+    finally:
+        session.close()
+        transaction.rollback()
+        connection.close()
+
+
+@pytest.fixture
+def prefix():
+    return f'test-{uuid.uuid4().hex[:8]}'
+
+
+@pytest.fixture
+def member(session, prefix):
+    role = Role(name=f'{prefix}-role')
+    session.add(role)
+    session.flush()
+    user = User(username=f'{prefix}-member', email=f'{prefix}@test.lms', address='test', password='-', role_id=role.id)
+    session.add(user)
+    session.flush()
+    return user
+
+
+@pytest.fixture
+def catalogue(session, prefix):
+    """
+    Returns -> (Book, Magazine) with 5 copies each
+    """
+    genre = Genre(name=f'{prefix}-genre')
+    publisher = Publisher(name=f'{prefix}-publisher')
+    session.add_all([genre, publisher])
+    session.flush()
+    book = Book(isbn_number=str(uuid.uuid4().int)[:13], title=f'{prefix} book', author='test', price=1,
+                genre_id=genre.id, publisher_id=publisher.id, available_number=5)
+    magazine = Magazine(issn_number=str(uuid.uuid4().int)[:8], title=f'{prefix} magazine', editor='test', price=1,
+                        genre_id=genre.id, publisher_id=publisher.id, available_number=5)
+    session.add_all([book, magazine])
+    session.flush()
+    return book, magazine
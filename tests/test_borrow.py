@@ -0,0 +1,45 @@
+from sqlalchemy import Select, func
+from models import MemberBook, MemberMagazine, Record, User
+
+
+def open_records(session, member):
+    return session.scalar(Select(func.count(Record.id)).where(Record.member_id == member.id, Record.returned == False))
+
+
+def associations(session, association, member):
+    return session.scalar(Select(func.count(association.id)).where(association.user_id == member.id))
+
+
+def leave_associations(session, member, book, magazine):
+    """
+    Association rows without a record, as a refused borrow of older versions left them
+    """
+    session.add_all([
+        MemberBook(user_id=member.id, book_id=book.isbn_number),
+        MemberMagazine(user_id=member.id, magazine_id=magazine.issn_number)
+    ])
+    session.commit()
+
+
+def test_borrow_over_leftover_association(session, member, catalogue):
+    book, magazine = catalogue
+    leave_associations(session, member, book, magazine)
+
+    User().borrow_book(session, member.username, book.isbn_number)
+    User().borrow_magazine(session, member.username, magazine.issn_number)
+
+    assert open_records(session, member) == 2
+    assert associations(session, MemberBook, member) == 1
+    assert associations(session, MemberMagazine, member) == 1
+
+
+def test_borrow_batch_over_leftover_association(session, member, catalogue):
+    book, magazine = catalogue
+    leave_associations(session, member, book, magazine)
+
+    results = User().borrow_batch(session, member.username, [book.isbn_number], [magazine.issn_number])
+
+    assert [result['status'] for result in results] == ['borrowed', 'borrowed']
+    assert open_records(session, member) == 2
+    assert associations(session, MemberBook, member) == 1
+    assert associations(session, MemberMagazine, member) == 1
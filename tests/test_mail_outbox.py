@@ -0,0 +1,77 @@
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+import pytest
+import mail_worker
+from models import MailOutbox
+from utils.mail_dispatcher import MailDispatcher, MemoryBackend
+
+LEASE = timedelta(minutes=5)
+
+
+@pytest.fixture
+def queue_job(session, prefix):
+    """
+    Queue a verification mail due before every other job in the table
+    """
+    def queue(status='pending', attempts=0):
+        job = MailOutbox(kind='verification', idempotency_key=f'{prefix}-{status}-{attempts}',
+                         payload={'email_to_send_to': f'{prefix}@test.lms', 'username': prefix},
+                         status=status, attempts=attempts, available_at=datetime(2000, 1, 1))
+        session.add(job)
+        session.commit()
+        return job
+    return queue
+
+
+@pytest.fixture
+def worker(session, monkeypatch):
+    """
+    mail_worker on the test session, sending to a MemoryBackend
+    Returns -> the MemoryBackend
+    """
+    backend = MemoryBackend()
+    dispatcher = MailDispatcher(backend, rate_limit=0)
+    monkeypatch.setattr(mail_worker, 'session_scope', lambda: nullcontext(session))
+    monkeypatch.setattr(mail_worker, 'get_dispatcher', lambda: dispatcher)
+    yield backend
+    dispatcher.close()
+
+
+def test_claim_takes_expired_lease_again(session, queue_job):
+    job = queue_job(status='sending', attempts=1)
+
+    claimed = MailOutbox.claim(session, 1000, LEASE, max_attempts=5)
+
+    assert job in claimed
+    assert (job.status, job.attempts) == ('sending', 2)
+    assert job.available_at > datetime.utcnow()
+
+
+def test_claim_fails_expired_lease_of_last_attempt(session, queue_job):
+    job = queue_job(status='sending', attempts=5)
+
+    claimed = MailOutbox.claim(session, 1000, LEASE, max_attempts=5)
+
+    assert job not in claimed
+    assert (job.status, job.attempts) == ('failed', 5)
+    assert job.last_error
+
+
+def test_worker_sends_job_of_expired_lease(session, queue_job, worker):
+    job = queue_job(status='sending', attempts=1)
+
+    mail_worker.process_batch()
+    session.refresh(job)
+
+    assert (job.status, job.attempts) == ('sent', 2)
+    assert job.payload['email_to_send_to'] in [message['To'] for message in worker.outbox]
+
+
+def test_worker_gives_up_on_job_of_expired_lease(session, queue_job, worker):
+    job = queue_job(status='sending', attempts=mail_worker.MAIL_OUTBOX_MAX_ATTEMPTS)
+
+    mail_worker.process_batch()
+    session.refresh(job)
+
+    assert job.status == 'failed'
+    assert job.payload['email_to_send_to'] not in [message['To'] for message in worker.outbox]
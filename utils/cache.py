@@ -0,0 +1,191 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from decouple import config
+
+# 'memory' keeps entries in every worker, 'redis' shares them through cache_redis_url, 'none' turns caching off
+CACHE_BACKEND = config('cache_backend', default='memory')
+# Entries kept by the memory backend
+CACHE_SIZE = config('cache_size', default=10000, cast=int)
+CACHE_REDIS_URL = config('cache_redis_url', default='redis://localhost:6379/0')
+# Seconds an entry of every entity is trusted, writes through the API drop them earlier
+CACHE_TTLS = {
+    'book': config('cache_ttl_book', default=30, cast=int),
+    'magazine': config('cache_ttl_magazine', default=30, cast=int),
+    'publisher': config('cache_ttl_publisher', default=86400, cast=int),
+    'genre': config('cache_ttl_genre', default=86400, cast=int),
+}
+# Seconds an id that doesn't exist is remembered, short since other workers can add it
+CACHE_TTL_MISSING = config('cache_ttl_missing', default=5, cast=int)
+
+MISSING = object()
+
+
+class MemoryBackend:
+    """
+    In process LRU of key -> (expires at, value)
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value, ttl: int):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisBackend:
+    """
+    Entries stored as json in anything speaking the redis get/set/delete api,
+    shared by every worker
+    """
+
+    def __init__(self, client, prefix: str = 'lms:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str):
+        # Only needed with cache_backend=redis
+        import redis
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key: str):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return MISSING
+        return json.loads(value)
+
+    def set(self, key: str, value, ttl: int):
+        self.client.set(self.prefix + key, json.dumps(value, default=str), ex=ttl)
+
+    def delete(self, *keys: str):
+        if keys:
+            self.client.delete(*(self.prefix + key for key in keys))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class FakeRedis:
+    """
+    Local stand in for a redis client with the calls RedisBackend makes,
+    values go through bytes like they do with a server
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str):
+        with self._lock:
+            value, expires_at = self._values.get(name, (None, None))
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._values[name]
+                return None
+            return value
+
+    def set(self, name: str, value, ex: int = None):
+        with self._lock:
+            self._values[name] = (str(value).encode(), time.monotonic() + ex if ex else None)
+
+    def delete(self, *names: str):
+        with self._lock:
+            return sum(self._values.pop(name, None) is not None for name in names)
+
+    def scan_iter(self, match: str = '*'):
+        prefix = match.rstrip('*')
+        with self._lock:
+            return [name for name in self._values if name.startswith(prefix)]
+
+
+class NullBackend:
+    def get(self, key: str):
+        return MISSING
+
+    def set(self, key: str, value, ttl: int):
+        pass
+
+    def delete(self, *keys: str):
+        pass
+
+    def clear(self):
+        pass
+
+
+class ReadThroughCache:
+    """
+    Single items by entity and id, loaded from the database on a miss.
+    Values have to be json serialisable so every backend can hold them,
+    None is cached for CACHE_TTL_MISSING seconds.
+    """
+
+    def __init__(self, backend, ttls: dict, missing_ttl: int):
+        self.backend = backend
+        self.ttls = ttls
+        self.missing_ttl = missing_ttl
+
+    @staticmethod
+    def key(entity: str, id):
+        return f'{entity}:{id}'
+
+    def get(self, entity: str, id, loader):
+        """
+        Cached value of entity id, or loader() stored and returned
+        """
+        key = self.key(entity, id)
+        value = self.backend.get(key)
+        if value is MISSING:
+            value = loader()
+            self.backend.set(key, value, self.ttls[entity] if value is not None else self.missing_ttl)
+        return value
+
+    def invalidate(self, entity: str, *ids):
+        """
+        Drop entries of entity, called after the change is committed
+        """
+        self.backend.delete(*(self.key(entity, id) for id in ids))
+
+    def clear(self):
+        self.backend.clear()
+
+
+def default_backend():
+    if CACHE_BACKEND == 'redis':
+        return RedisBackend.from_url(CACHE_REDIS_URL)
+    if CACHE_BACKEND == 'fakeredis':
+        return RedisBackend(FakeRedis())
+    if CACHE_BACKEND == 'none':
+        return NullBackend()
+    return MemoryBackend(CACHE_SIZE)
+
+
+entity_cache = ReadThroughCache(default_backend(), CACHE_TTLS, CACHE_TTL_MISSING)
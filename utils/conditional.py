@@ -0,0 +1,68 @@
+import hashlib
+import json
+from decouple import config
+from fastapi import Depends, HTTPException, Request, Response
+from database.database_connection import get_session, run_db
+from models import CatalogueVersion
+
+# Cache-Control sent with the catalogue routes, clients and proxies revalidate with the ETag
+CACHE_CONTROL = {
+    'book': config('cache_control_book', default='public, no-cache'),
+    'magazine': config('cache_control_magazine', default='public, no-cache'),
+    'publisher': config('cache_control_publisher', default='public, max-age=300'),
+    'genre': config('cache_control_genre', default='public, max-age=300'),
+}
+
+
+def make_etag(*parts):
+    """
+    Strong ETag of json serialisable parts
+    """
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str):
+    """
+    If-None-Match uses the weak comparison, W/ tags match their strong tag
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in if_none_match.split(','))
+
+
+def check_not_modified(request: Request, response: Response, etag: str, cache_control: str):
+    """
+    Raise 304 when the client already has etag, else put the headers on response
+    """
+    headers = {'ETag': etag, 'Cache-Control': cache_control}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        raise HTTPException(status_code=304, headers=headers)
+    response.headers.update(headers)
+
+
+def cache_headers(response: Response):
+    """
+    ETag and Cache-Control check_not_modified put on response, for a
+    response the route builds itself instead of returning its body
+    """
+    return {name: response.headers[name] for name in ('ETag', 'Cache-Control') if name in response.headers}
+
+
+class CatalogueETag:
+    """
+    Dependency for list routes, the ETag comes from the version of the tables
+    the route reads, so a client that is up to date costs one primary key lookup
+    instead of the page query
+    """
+
+    def __init__(self, table_names: list, cache_control: str):
+        self.table_names = table_names
+        self.cache_control = cache_control
+
+    async def __call__(self, request: Request, response: Response, session=Depends(get_session)):
+        versions = await run_db(session, CatalogueVersion.get_versions, self.table_names)
+        etag = make_etag(request.url.path, sorted(request.query_params.multi_items()), versions)
+        check_not_modified(request, response, etag, self.cache_control)
@@ -8,6 +8,8 @@ MAGAZINE_REQUEST_NOT_FOUND_MESSAGE = "The Magazine with that ISSN number not fou
 PUBLISHER_REQUEST_NOT_FOUND_MESSAGE = "No publisher with that id"
 GENRE_REQUEST_NOT_FOUND_MESSAGE = "No genre with that id"
 INVALID_REQUEST = "Invalid Request"
+INVALID_CURSOR_MESSAGE = "The cursor is invalid, please use next_cursor from previous page"
+INVALID_SEARCH_MESSAGE = "The search query must contain at least one word"
 UNAUTHORIZED = "Authorization Error"
 UNAUTHORIZED_MESSAGE = "Incorrect credentials"
 TOKEN_ERROR = "Expired Or Invalid Token"
@@ -16,6 +18,8 @@ NO_CONTENT = "No content"
 NO_CONTENT_MESSAGE = "No Content Found"
 INSUFFICIENT_RESOURCES = "Insufficient Resources"
 BAD_REQUEST = "Bad Request"
+SERVICE_UNAVAILABLE = "Service Unavailable"
+PASSWORD_POOL_BUSY_MESSAGE = "Too many logins at the moment, please try again in a moment"
 
 
 def invalid_length(name: str, length: int):
@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+from datetime import date
+from decouple import config
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select
+from database.database_connection import session_scope
+
+# Rows fetched from the server side cursor at once
+EXPORT_BATCH_SIZE = config('export_batch_size', default=1000, cast=int)
+
+MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def _ndjson_lines(columns, partition):
+    return ''.join(
+        json.dumps(dict(zip(columns, row)), default=_json_default) + '\n'
+        for row in partition
+    )
+
+
+def _csv_lines(partition):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(partition)
+    return buffer.getvalue()
+
+
+def stream_rows(statement: Select, format: str):
+    """
+    Yield rows of statement as ndjson or csv, one batch of rows at a time.
+    The rows are read through a server side cursor with its own session
+    because the response is sent after the request session is closed.
+    """
+    columns = [column.key for column in statement.selected_columns]
+    if format == 'csv':
+        yield _csv_lines([columns])
+    with session_scope() as session:
+        result = session.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        for partition in result.partitions():
+            if format == 'csv':
+                yield _csv_lines(partition)
+            else:
+                yield _ndjson_lines(columns, partition)
+
+
+def export_response(statement: Select, format: str, name: str, headers: dict | None = None):
+    """
+    Streaming response with every row of statement, memory use does not
+    depend on the number of rows and the first rows are sent at once.
+    headers are sent along, e.g. the cache headers of the route.
+    """
+    return StreamingResponse(
+        stream_rows(statement, format),
+        media_type=MEDIA_TYPES[format],
+        headers={'Content-Disposition': f'attachment; filename="{name}.{format}"', **(headers or {})}
+    )
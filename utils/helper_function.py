@@ -1,12 +1,20 @@
 import time
+import random
 
 from fastapi.responses import StreamingResponse
 from auth import auth
-from starlette.middleware.base import BaseHTTPMiddleware 
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
 from utils.logger import logger
+from decouple import config
 import json
 from fastapi import HTTPException, Header, Response
 
+# Max bytes of a response body written to the log
+LOG_BODY_LIMIT = config('log_body_limit', default=1024, cast=int)
+# Fraction of response bodies logged for routes without own sample rate
+LOG_BODY_SAMPLE_RATE = config('log_body_sample_rate', default=1.0, cast=float)
+
 
 async def log_request(request):
     log_dict = {
@@ -39,13 +47,33 @@ def token_in_header(Authorization: str = Header(None)):
             detail="Invalid token Scheme"
         )
 
-class LogMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, exclude_paths=None):
-        super().__init__(app)
+class LogMiddleware:
+    """
+    Pure ASGI middleware that logs every request and response.
+    The response is passed through as it is sent, only the first
+    `body_log_limit` bytes of a sampled part of response bodies are kept
+    for the log. Streaming responses (no content-length) are never teed.
+    `sample_rates` maps path prefixes to the fraction of bodies logged.
+    """
+
+    def __init__(self, app, exclude_paths=None, body_log_limit=LOG_BODY_LIMIT, sample_rates=None):
+        self.app = app
         self.exclude_paths = exclude_paths or []
+        self.body_log_limit = body_log_limit
+        # Longest prefix first so the most specific route wins
+        self.sample_rates = sorted((sample_rates or {}).items(), key=lambda item: -len(item[0]))
+
+    def sample_rate(self, path: str):
+        for prefix, rate in self.sample_rates:
+            if path.startswith(prefix):
+                return rate
+        return LOG_BODY_SAMPLE_RATE
 
-    async def dispatch(self, request, call_next):
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
 
+        request = Request(scope)
         # Log the request details
         log_dict = {
             'method': request.method,
@@ -57,27 +85,43 @@ class LogMiddleware(BaseHTTPMiddleware):
         logger.info(f"Request: {log_dict}", extra=log_dict)
 
         if request.url.path in self.exclude_paths:
-            return await call_next(request)
-        start_time = time.time()
-
-        # Get the response
-        response = await call_next(request)
-        
-        process_time = time.time() - start_time
-
-        if response:
-            print(type(response))
-            body = b''.join([section async for section in response.body_iterator])
-            response_body = body.decode('utf-8')
-            print(response.status_code)
-            if response.status_code >=400 and response.status_code <500:
+            return await self.app(scope, receive, send)
+        start_time = time.perf_counter()
+        log_body = random.random() < self.sample_rate(request.url.path)
+        body_prefix = bytearray()
+        response = {'status_code': 500, 'streaming': False, 'truncated': False}
+
+        async def send_with_log(message):
+            if message['type'] == 'http.response.start':
+                process_time = time.perf_counter() - start_time
+                headers = MutableHeaders(scope=message)
+                headers['X-Process-Time'] = str(process_time)
+                response['status_code'] = message['status']
+                response['streaming'] = 'content-length' not in headers
+            elif message['type'] == 'http.response.body' and log_body and not response['streaming']:
+                body = message.get('body', b'')
+                remaining = self.body_log_limit - len(body_prefix)
+                if len(body) > remaining:
+                    response['truncated'] = True
+                body_prefix.extend(body[:max(remaining, 0)])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_log)
+        finally:
+            process_time = time.perf_counter() - start_time
+            if response['streaming']:
+                response_body = "<streamed>"
+            elif log_body:
+                response_body = body_prefix.decode('utf-8', errors='replace')
+                if response['truncated']:
+                    response_body += "..."
+            else:
+                response_body = "<not sampled>"
+            status_code = response['status_code']
+            if status_code >=400 and status_code <500:
                 logger.warning(f"Response body: {response_body} Process time: {process_time}")
-            elif response.status_code >=500 and response.status_code <600:
+            elif status_code >=500 and status_code <600:
                 logger.error(f"Response body: {response_body} Process time: {process_time}")
             else:
                 logger.info(f"Response body: {response_body} Process time: {process_time}")
-            # Create a new response with the logged body to ensure it's not consumed
-            response.headers['X-Process-Time'] = str(process_time)
-            return Response(content=body, status_code=response.status_code, headers=dict(response.headers), media_type=response.media_type)
-        else:
-            return response
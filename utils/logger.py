@@ -1,23 +1,155 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
 import sys
 from decouple import config
 from logtail import LogtailHandler
 
-token = config('logging_token')
+# 'default' logs to stdout, log/app.log and logtail
+# 'memory' keeps records in memory_sink, to be used in tests
+LOG_SINK = config('log_sink', default='default')
+# Records waiting for the sinks, new records are dropped when it is full
+LOG_QUEUE_SIZE = config('log_queue_size', default=10000, cast=int)
+# Records are handed to file and remote sinks in batches of this size
+LOG_BATCH_SIZE = config('log_batch_size', default=100, cast=int)
+# Seconds after which an incomplete batch is flushed anyway
+LOG_FLUSH_INTERVAL = config('log_flush_interval', default=1.0, cast=float)
 
-logger = logging.getLogger("FastAPI Log")
+# Attributes every LogRecord has, everything else came in through `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format a record as one json object per line,
+    fields passed with `extra` are added to the object
+    """
+
+    def format(self, record):
+        log_entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                log_entry[key] = value
+        if record.exc_info:
+            log_entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(log_entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Put records on a bounded queue without ever blocking the caller.
+    When the queue is full the record is dropped and counted, the count
+    is logged as a warning as soon as there is room again.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            if self.dropped:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': record.name,
+                    'levelno': logging.WARNING,
+                    'levelname': 'WARNING',
+                    'msg': f"Log queue full, dropped {self.dropped} records",
+                }))
+                self.dropped = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchingQueueListener(logging.handlers.QueueListener):
+    """
+    QueueListener that flushes its handlers whenever the queue
+    stays empty for `flush_interval` seconds
+    """
+
+    def __init__(self, log_queue, *handlers, flush_interval=LOG_FLUSH_INTERVAL):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval)
+            except queue.Empty:
+                self.flush()
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush()
 
-formater = logging.Formatter(
-    fmt="%(asctime)s - %(levelname)s - %(message)s"
-)
 
-stream_handler = logging.StreamHandler(sys.stdout)
-file_handler = logging.FileHandler('log/app.log')
-online_handler = LogtailHandler(source_token=token)
+class MemorySink(logging.Handler):
+    """
+    Local stand-in for the real sinks, keeps formatted records in a list
+    """
 
-stream_handler.setFormatter(formater)
-file_handler.setFormatter(formater)
+    def __init__(self):
+        super().__init__()
+        self.records = []
 
-logger.handlers = [stream_handler, file_handler, online_handler]
+    def emit(self, record):
+        self.records.append(self.format(record))
 
+
+def batched(handler: logging.Handler):
+    """
+    Buffer records for handler and pass them on in batches,
+    errors are passed on at once
+    """
+    return logging.handlers.MemoryHandler(
+        capacity=LOG_BATCH_SIZE,
+        flushLevel=logging.ERROR,
+        target=handler,
+        flushOnClose=True
+    )
+
+
+formater = JsonFormatter()
+
+memory_sink = MemorySink()
+memory_sink.setFormatter(formater)
+
+if LOG_SINK == 'memory':
+    sinks = [memory_sink]
+else:
+    token = config('logging_token')
+    stream_handler = logging.StreamHandler(sys.stdout)
+    file_handler = logging.FileHandler('log/app.log')
+    online_handler = LogtailHandler(source_token=token)
+
+    stream_handler.setFormatter(formater)
+    file_handler.setFormatter(formater)
+
+    sinks = [stream_handler, batched(file_handler), batched(online_handler)]
+
+log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+queue_handler = DroppingQueueHandler(log_queue)
+listener = BatchingQueueListener(log_queue, *sinks)
+
+logger = logging.getLogger("FastAPI Log")
+logger.handlers = [queue_handler]
 logger.setLevel(logging.INFO)
+
+listener.start()
+
+
+@atexit.register
+def stop_logging():
+    """
+    Write out everything still in the queue before the process exits
+    """
+    listener.stop()
+    for sink in sinks:
+        sink.close()
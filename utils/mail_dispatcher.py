@@ -0,0 +1,215 @@
+import os
+import smtplib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from email.message import EmailMessage
+from decouple import config
+
+# 'smtp' sends through SMTP_HOST, 'memory' keeps messages in process, to be used offline
+MAIL_BACKEND = config('mail_backend', default='smtp')
+SMTP_HOST = config('smtp_host', default='smtp.gmail.com')
+SMTP_PORT = config('smtp_port', default=465, cast=int)
+# Authenticated connections kept open, also the number of mails sent at once
+MAIL_POOL_SIZE = config('mail_pool_size', default=4, cast=int)
+# Most mails sent per second over all connections, 0 for no limit
+MAIL_RATE_LIMIT = config('mail_rate_limit', default=10, cast=float)
+# Attempts of a mail before it is reported as failed
+MAIL_MAX_ATTEMPTS = config('mail_max_attempts', default=3, cast=int)
+# Seconds before the first retry, doubled for every next one
+MAIL_RETRY_BACKOFF = config('mail_retry_backoff', default=1.0, cast=float)
+
+EMAIL = os.environ.get('EMAIL')
+PASSWORD = os.environ.get('PASSWORD')
+
+# Errors after which the same mail is never going to be accepted
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                    smtplib.SMTPAuthenticationError, smtplib.SMTPNotSupportedError)
+
+
+@dataclass
+class MailResult:
+    to: str
+    sent: bool
+    attempts: int
+    error: str | None = None
+
+
+class SMTPBackend:
+    """
+    Open logged in SMTP over SSL connections
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: str):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+
+    def connect(self):
+        connection = smtplib.SMTP_SSL(self.host, self.port)
+        connection.login(self.user, self.password)
+        return connection
+
+
+class MemoryConnection:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def send_message(self, message: EmailMessage):
+        time.sleep(self.backend.send_latency)
+        with self.backend.lock:
+            self.backend.outbox.append(message)
+
+    def quit(self):
+        pass
+
+
+class MemoryBackend:
+    """
+    In process stand-in for an SMTP server, sent messages end up in `outbox`.
+    The latencies make it behave like a remote server in benchmarks.
+    """
+
+    def __init__(self, connect_latency: float = 0.0, send_latency: float = 0.0):
+        self.connect_latency = connect_latency
+        self.send_latency = send_latency
+        self.outbox = []
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        time.sleep(self.connect_latency)
+        with self.lock:
+            self.connections += 1
+        return MemoryConnection(self)
+
+
+class RateLimiter:
+    """
+    Space calls `1 / rate` seconds apart over every thread, 0 for no limit
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        time.sleep(max(slot - now, 0))
+
+
+class MailDispatcher:
+    """
+    Send mails from a pool of worker threads, each keeping one logged in
+    connection of `backend` open for every mail it sends.
+    A mail failing with a temporary error is retried on a new connection
+    after a backoff, every mail gets a MailResult.
+    """
+
+    def __init__(self, backend, pool_size: int = MAIL_POOL_SIZE, rate_limit: float = MAIL_RATE_LIMIT,
+                 max_attempts: int = MAIL_MAX_ATTEMPTS, retry_backoff: float = MAIL_RETRY_BACKOFF):
+        self.backend = backend
+        self.pool_size = pool_size
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.rate_limiter = RateLimiter(rate_limit)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='mail')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self.backend.connect()
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def _drop_connection(self):
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is not None:
+            with self._lock:
+                if connection in self._connections:
+                    self._connections.remove(connection)
+            try:
+                connection.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+
+    def _send(self, message: EmailMessage):
+        for attempt in range(1, self.max_attempts + 1):
+            self.rate_limiter.wait()
+            try:
+                self._connection().send_message(message)
+                return MailResult(message['To'], True, attempt)
+            except PERMANENT_ERRORS as e:
+                return MailResult(message['To'], False, attempt, repr(e))
+            except (smtplib.SMTPException, OSError) as e:
+                # The connection may be broken, the next attempt opens a new one
+                self._drop_connection()
+                if attempt == self.max_attempts:
+                    return MailResult(message['To'], False, attempt, repr(e))
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+
+    def send(self, message: EmailMessage):
+        """
+        Send one mail and wait for its result
+        """
+        return self._executor.submit(self._send, message).result()
+
+    def send_all(self, messages):
+        """
+        Send every mail of the iterable messages in parallel and yield their
+        results in order. Only a few mails per connection are taken from
+        messages ahead of time, so a generator is never read into memory.
+        """
+        pending = deque()
+        for message in messages:
+            pending.append(self._executor.submit(self._send, message))
+            if len(pending) >= self.pool_size * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+
+
+def default_backend():
+    if MAIL_BACKEND == 'memory':
+        return MemoryBackend()
+    return SMTPBackend(SMTP_HOST, SMTP_PORT, EMAIL, PASSWORD)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    Dispatcher shared by the process, created on first use
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = MailDispatcher(default_backend())
+        return _dispatcher
@@ -1,185 +1,206 @@
-def get_verified_html(username:str):
-  html_message = """\
-  <!DOCTYPE html>
-  <html lang="en">
-    <head>
-      <meta charset="UTF-8" />
-      <meta name="viewport" content="width=device-width, initial-scale=1.0" />
-      <title>Welcome to Our Library</title>
-      <style>
-        body {{
-          font-family: Arial, sans-serif;
-          margin: 0;
-          padding: 0;
-          background-color: #f0f0f0; /* Default background color, replace with user's preference */
-        }}
-        .header {{
-          background-color: #004d99; /* Default header color, replace with user's preference */
-          color: #ffffff;
-          padding: 20px;
-          text-align: center;
-        }}
-        .content {{
-          padding: 20px;
-          text-align: center;
-        }}
-        .library-image {{
-          width: 100%;
-          max-width: 600px;
-          display: block;
-          margin: 20px auto;
-        }}
-      </style>
-    </head>
-    <body>
-      <div class="header">
-        <h1>Welcome to Our Library Management System</h1>
-      </div>
-
-      <div class="content">
-        <h2>Dear {username} Your Account Verified Sucesfully </h2>
-        <p>
-          Hello and welcome! We're thrilled to have you join our community of book
-          lovers and knowledge seekers. Our library is your gateway to a vast
-          world of literature, learning, and leisure.
-        </p>
-
-        <img src="https://rohanpudasaini.com.np/wp-content/uploads/2024/04/lms_logo1.png" alt="Library Image" class="library-image" />
-        <!-- Replace "library-image.jpg" with the actual image path -->
-
-        <p>
-          Feel free to explore our collections, participate in our events, and
-          take advantage of all the resources available to you. If you have any
-          questions or need assistance, our staff is always here to help.
-        </p>
-
-        <p>Happy reading!</p>
-      </div>
-    </body>
-  </html>
-
-
-  """
-  return html_message.format(username=username)
-
-def get_return_reminder_html(username:str, name:str, object:str):
-    html_message = """\
-    <!DOCTYPE html>
-    <html lang="en">
-      <head>
-        <meta charset="UTF-8" />
-        <meta name="viewport" content="width=device-width, initial-scale=1.0" />
-        <title>Return Reminder</title>
-        <style>
-          body {{
-            font-family: Arial, sans-serif;
-            margin: 0;
-            padding: 0;
-            background-color: #f0f0f0;
-          }}
-          .header {{
-            background-color: #f44336; /* Alert color */
-            color: #ffffff;
-            padding: 20px;
-            text-align: center;
-          }}
-          .content {{
-            padding: 20px;
-            text-align: center;
-          }}
-          .library-image {{
-            width: 100%;
-            max-width: 600px;
-            display: block;
-            margin: 20px auto;
-          }}
-        </style>
-      </head>
-      <body>
-        <div class="header">
-          <h1>{object} Return Reminder</h1>
-        </div>
-
-        <div class="content">
-          <h2>Dear {username},</h2>
-          <p>
-            This is a friendly reminder that your borrowed {object} <strong>"{name}"</strong> is due for return in 3 days. 
-          </p>
-
-          <img src="https://rohanpudasaini.com.np/wp-content/uploads/2024/04/lms_logo1.png" alt="Library Image" class="library-image" />
-          <!-- Replace "library-image.jpg" with the actual image path -->
-
-          <p>
-            Please make sure to return it on time to avoid any late fees and to help keep our library system efficient for all users.
-          </p>
-          <p>
-            If you have already returned the {object} or need an extension, please disregard this message or contact our staff for assistance.
-          </p>
-          <p>Thank you for being a valued member of our library community!</p>
-        </div>
-      </body>
-    </html>
+from functools import lru_cache
+from html import escape
+from string import Template
+from decouple import config
+
+# Item rows kept rendered across a batch of mails
+MAIL_FRAGMENT_CACHE_SIZE = config('mail_fragment_cache_size', default=10000, cast=int)
+
+
+class Safe(str):
+    """
+    Already rendered html, put in a template as it is
+    """
+
+
+class MailTemplate:
+    """
+    Template using $name placeholders, split once into literal parts and
+    field names so rendering only joins them. In html templates every
+    value that is not Safe is escaped.
+    """
+
+    def __init__(self, source: str, html: bool = True):
+        self.html = html
+        self.literals = ['']
+        self.fields = []
+        position = 0
+        for match in Template.pattern.finditer(source):
+            self.literals[-1] += source[position:match.start()]
+            if match.group('escaped') is not None:
+                self.literals[-1] += '$'
+            elif match.group('named') or match.group('braced'):
+                self.fields.append(match.group('named') or match.group('braced'))
+                self.literals.append('')
+            else:
+                raise ValueError(f"Invalid placeholder in mail template at {match.start()}")
+            position = match.end()
+        self.literals[-1] += source[position:]
+        self._parts = [None] * (len(self.literals) + len(self.fields))
+        self._parts[0::2] = self.literals
+
+    def render(self, **values):
+        if self.html:
+            field_values = [
+                value if isinstance(value, Safe) else escape(str(value))
+                for value in map(values.__getitem__, self.fields)
+            ]
+        else:
+            field_values = [str(values[field]) for field in self.fields]
+        parts = self._parts.copy()
+        parts[1::2] = field_values
+        return ''.join(parts)
+
+
+LAYOUT = Template("""\
+<!DOCTYPE html>
+<html lang="en">
+  <head>
+    <meta charset="UTF-8" />
+    <meta name="viewport" content="width=device-width, initial-scale=1.0" />
+    <title>$title</title>
+    <style>
+      body {
+        font-family: Arial, sans-serif;
+        margin: 0;
+        padding: 0;
+        background-color: #f0f0f0;
+      }
+      .header {
+        background-color: $header_color;
+        color: #ffffff;
+        padding: 20px;
+        text-align: center;
+      }
+      .content {
+        padding: 20px;
+        text-align: center;
+      }
+      .library-image {
+        width: 100%;
+        max-width: 600px;
+        display: block;
+        margin: 20px auto;
+      }
+      table {
+        margin: 0 auto;
+        border-collapse: collapse;
+      }
+      td, th {
+        padding: 6px 12px;
+        border-bottom: 1px solid #cccccc;
+      }
+    </style>
+  </head>
+  <body>
+    <div class="header">
+      <h1>$heading</h1>
+    </div>
+
+    <div class="content">
+$content
+    </div>
+  </body>
+</html>
+""")
+
+
+def page(title: str, header_color: str, heading: str, content: str):
+    """
+    Compile content inside the shared layout, placeholders of content are left for render
+    """
+    return MailTemplate(LAYOUT.safe_substitute(
+        title=title, header_color=header_color, heading=heading, content=content))
+
+
+VERIFIED_HTML = page("Welcome to Our Library", "#004d99", "Welcome to Our Library Management System", """\
+      <h2>Dear $username Your Account Verified Sucesfully </h2>
+      <p>
+        Hello and welcome! We're thrilled to have you join our community of book
+        lovers and knowledge seekers. Our library is your gateway to a vast
+        world of literature, learning, and leisure.
+      </p>
+
+      <img src="https://rohanpudasaini.com.np/wp-content/uploads/2024/04/lms_logo1.png" alt="Library Image" class="library-image" />
+
+      <p>
+        Feel free to explore our collections, participate in our events, and
+        take advantage of all the resources available to you. If you have any
+        questions or need assistance, our staff is always here to help.
+      </p>
+
+      <p>Happy reading!</p>""")
+
+VERIFIED_TEXT = MailTemplate(
+    "Dear $username, welcome to the library management system, Your email is sucessfully verified.",
+    html=False)
+
+DIGEST_HTML = page("Your Library Loans", "#d32f2f", "Your Library Loans", """\
+      <h2>Dear $username,</h2>
+      $expiring_section
+      $expired_section
+      <p>Thank you for being a valued member of our library community!</p>""")
+
+EXPIRING_SECTION_HTML = MailTemplate(
+    "<p>These items are due for return in 3 days, please return them on time to avoid any late fees.</p>"
+    "<table><tr><th>Type</th><th>Title</th><th>Due</th></tr>$rows</table>")
+
+EXPIRED_SECTION_HTML = MailTemplate(
+    "<p>The borrowing period of these items has expired, please return them as soon as possible to minimize any additional charges.</p>"
+    "<table><tr><th>Type</th><th>Title</th><th>Due</th><th>Fine</th></tr>$rows</table>"
+    "<p>Total fine so far: <strong>रु $total_fine</strong></p>")
+
+EXPIRING_ROW_HTML = MailTemplate("<tr><td>$object</td><td><strong>$name</strong></td><td>$due_date</td></tr>")
+EXPIRED_ROW_HTML = MailTemplate("<tr><td>$object</td><td><strong>$name</strong></td><td>$due_date</td><td>रु $fine</td></tr>")
+EXPIRING_ROW_TEXT = MailTemplate("Your borrowed $object $name is due for return on $due_date.\n", html=False)
+EXPIRED_ROW_TEXT = MailTemplate(
+    "Your borrowed $object $name have already expired at $due_date, fine of रु $fine is due.\n", html=False)
+
+
+@lru_cache(maxsize=MAIL_FRAGMENT_CACHE_SIZE)
+def expiring_row(object: str, name: str, due_date: str):
     """
+    (text, html) of one expiring item, the same item due the same day
+    is rendered once for the whole batch
+    """
+    values = {'object': object, 'name': name, 'due_date': due_date}
+    return EXPIRING_ROW_TEXT.render(**values), Safe(EXPIRING_ROW_HTML.render(**values))
+
+
+@lru_cache(maxsize=MAIL_FRAGMENT_CACHE_SIZE)
+def expired_row(object: str, name: str, due_date: str, fine: int):
+    values = {'object': object, 'name': name, 'due_date': due_date, 'fine': fine}
+    return EXPIRED_ROW_TEXT.render(**values), Safe(EXPIRED_ROW_HTML.render(**values))
+
 
-    return html_message.format(object=object,username=username, name=name)
-  
-
-def get_expiry_notification_html(username:str, name:str, object:str, expiry_date:str, fine_amount:str):
-    html_message = """\
-    <!DOCTYPE html>
-    <html lang="en">
-      <head>
-        <meta charset="UTF-8" />
-        <meta name="viewport" content="width=device-width, initial-scale=1.0" />
-        <title>Expiry Notification</title>
-        <style>
-          body {{
-            font-family: Arial, sans-serif;
-            margin: 0;
-            padding: 0;
-            background-color: #f0f0f0;
-          }}
-          .header {{
-            background-color: #d32f2f; /* Notification color */
-            color: #ffffff;
-            padding: 20px;
-            text-align: center;
-          }}
-          .content {{
-            padding: 20px;
-            text-align: center;
-          }}
-          .library-image {{
-            width: 100%;
-            max-width: 600px;
-            display: block;
-            margin: 20px auto;
-          }}
-        </style>
-      </head>
-      <body>
-        <div class="header">
-          <h1>Expiry Notification</h1>
-        </div>
-
-        <div class="content">
-          <h2>Dear {username},</h2>
-          <p>
-            We hope this message finds you well. This is to inform you that the borrowing period for your {object} <strong>"{name}"</strong> has expired on <strong>{expiry_date}</strong>.
-          </p>
-
-          <img src="https://rohanpudasaini.com.np/wp-content/uploads/2024/04/lms_logo1.png" alt="Library Image" class="library-image" />
-
-          <p>
-            As of now, a late return fine of <strong>रु {fine_amount}</strong> has been incurred. We kindly request that you return the {object} as soon as possible to minimize any additional charges.
-          </p>
-          <p>
-            Please visit our library or contact our staff for assistance in returning the {object} or if you have any questions regarding your fine.
-          </p>
-          <p>Thank you for your prompt attention to this matter.</p>
-        </div>
-      </body>
-    </html>
+def render_verified(username: str):
     """
+    Returns -> (text, html) of the welcome mail
+    """
+    return VERIFIED_TEXT.render(username=username), VERIFIED_HTML.render(username=username)
+
 
-    return html_message.format(username=username, name=name, object=object,expiry_date=expiry_date, fine_amount=fine_amount)
+def render_digest(username: str, expiring_items: list, expired_items: list, total_fine: int):
+    """
+    (text, html) of one mail with all loans of a user,
+    expiring_items are (object, name, due date) and expired_items (object, name, due date, fine)
+    """
+    expiring_rows = [expiring_row(*item) for item in expiring_items]
+    expired_rows = [expired_row(*item) for item in expired_items]
+
+    text = [f"Dear {username},\n"]
+    text += [row_text for row_text, _ in expiring_rows]
+    text += [row_text for row_text, _ in expired_rows]
+    if expired_items:
+        text.append(f"Total fine so far: रु {total_fine}\n")
+
+    expiring_section = expired_section = Safe('')
+    if expiring_rows:
+        expiring_section = Safe(EXPIRING_SECTION_HTML.render(
+            rows=Safe(''.join(row_html for _, row_html in expiring_rows))))
+    if expired_rows:
+        expired_section = Safe(EXPIRED_SECTION_HTML.render(
+            rows=Safe(''.join(row_html for _, row_html in expired_rows)), total_fine=total_fine))
+
+    html = DIGEST_HTML.render(username=username, expiring_section=expiring_section, expired_section=expired_section)
+    return ''.join(text), html
@@ -0,0 +1,82 @@
+import base64
+import json
+import math
+from decouple import config
+from fastapi import HTTPException
+from sqlalchemy import Select
+from sqlalchemy.orm import Session
+from database.database_connection import read_rows
+import utils.constant_messages as constant_messages
+
+# Biggest page a client can ask for
+MAX_PAGE_SIZE = config('max_page_size', default=100, cast=int)
+
+
+def encode_cursor(key):
+    """
+    Opaque cursor holding the primary key of the last item of a page
+    """
+    return base64.urlsafe_b64encode(json.dumps({'key': key}).encode()).decode()
+
+
+def invalid_cursor():
+    return HTTPException(status_code=400,
+                         detail={
+                             "error": {
+                                 "error_type": constant_messages.INVALID_REQUEST,
+                                 "error_message": constant_messages.INVALID_CURSOR_MESSAGE
+                             }
+                         })
+
+
+def of_type(value, python_type) -> bool:
+    """
+    isinstance for a value read from json, true/false is no number,
+    an int has to fit an Integer column and a float has to be finite
+    """
+    if isinstance(value, bool):
+        return False
+    if python_type is int:
+        return isinstance(value, int) and -2**31 <= value < 2**31
+    if python_type is float:
+        return isinstance(value, (int, float)) and math.isfinite(value)
+    return isinstance(value, python_type)
+
+
+def decode_cursor(cursor: str, *types):
+    """
+    Key held by cursor, one python type for a plain key or one per item
+    for a key that is a list. A cursor that doesn't match is a 400,
+    it never reaches the database.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))['key']
+    except (ValueError, KeyError, TypeError):
+        raise invalid_cursor()
+    items = key if len(types) > 1 else [key]
+    if not isinstance(items, list) or len(items) != len(types) or not all(map(of_type, items, types)):
+        raise invalid_cursor()
+    return key
+
+
+def paginate(session: Session, statement: Select, key_column, page=1, limit=3, cursor=None):
+    """
+    Give back one page of statement ordered by key_column and the cursor of next page.
+    statement selects the columns to send, items are dicts of them (read_rows).
+    With a cursor the page starts right after the key in it (keyset pagination),
+    without one `page` is used as offset which is kept for old clients.
+    Returns -> (list of dicts, next cursor or None on last page)
+    """
+    limit = max(1, min(limit or 1, MAX_PAGE_SIZE))
+    statement = statement.order_by(key_column)
+    if cursor:
+        statement = statement.where(key_column > decode_cursor(cursor, key_column.type.python_type))
+    elif page and page > 1:
+        statement = statement.offset((page-1)*limit)
+    # One extra row tells if there is a next page
+    items = read_rows(session, statement.limit(limit + 1))
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1][key_column.key])
+    return items, next_cursor
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field, StrictStr
 from typing import Annotated
+from datetime import datetime
 
 class BookItem(BaseModel):
     title: str
@@ -65,6 +66,34 @@ class ReturnMagazineObject(BaseModel):
     )]
 
 
+ISBN = Annotated[StrictStr, Field(
+    min_length=13,
+    max_length=13,
+    description="The ISBN number must be of 13 digit",
+)]
+
+ISSN = Annotated[StrictStr, Field(
+    min_length=8,
+    max_length=8,
+    description="The ISSN number must be of 8 digit",
+)]
+
+# Most items that can be borrowed or returned in one request
+MAX_BATCH_ITEMS = 50
+
+
+class BorrowBatchObject(BaseModel):
+    username: str | None = None
+    isbn: Annotated[list[ISBN], Field(max_length=MAX_BATCH_ITEMS)] = []
+    issn: Annotated[list[ISSN], Field(max_length=MAX_BATCH_ITEMS)] = []
+
+
+class ReturnBatchObject(BaseModel):
+    username: str | None = None
+    isbn: Annotated[list[ISBN], Field(max_length=MAX_BATCH_ITEMS)] = []
+    issn: Annotated[list[ISSN], Field(max_length=MAX_BATCH_ITEMS)] = []
+
+
 class MagazineItem(BaseModel):
     editor: str
     title: str
@@ -138,4 +167,113 @@ class EmailModel(BaseModel):
 
 class RoleModel(BaseModel):
     name:str
-    permission:list[str]
\ No newline at end of file
+    permission:list[str]
+
+
+class ResponseModel(BaseModel):
+    """Response bodies, read from ORM objects, rows or dicts alike"""
+    model_config = {'from_attributes': True}
+
+
+class BookOut(ResponseModel):
+    isbn_number: str
+    title: str
+    author: str
+    price: int
+    genre_id: int | None = None
+    publisher_id: int | None = None
+    available_number: int | None = None
+
+
+class MagazineOut(ResponseModel):
+    issn_number: str
+    title: str
+    editor: str
+    price: int
+    genre_id: int | None = None
+    publisher_id: int | None = None
+    available_number: int | None = None
+
+
+class PublisherOut(ResponseModel):
+    id: int
+    name: str
+    address: str | None = None
+    phone_number: int | None = None
+
+
+class GenreOut(ResponseModel):
+    id: int
+    name: str
+
+
+class UserOut(ResponseModel):
+    id: int
+    username: str
+    email: str
+    date_created: datetime | None = None
+    expiry_date: datetime | None = None
+    address: str
+    phone_number: int | None = None
+    fine: int | None = None
+    role_id: int | None = None
+
+
+class RoleOut(ResponseModel):
+    id: int
+    name: str | None = None
+    version: int
+
+
+class BookPage(ResponseModel):
+    Books: list[BookOut]
+    next_cursor: str | None = None
+
+
+class MagazinePage(ResponseModel):
+    Magazines: list[MagazineOut]
+    next_cursor: str | None = None
+
+
+class PublisherPage(ResponseModel):
+    Publishers: list[PublisherOut]
+    next_cursor: str | None = None
+
+
+class GenrePage(ResponseModel):
+    Genre: list[GenreOut]
+    next_cursor: str | None = None
+
+
+class UserPage(ResponseModel):
+    Users: list[UserOut]
+    next_cursor: str | None = None
+
+
+class UserList(ResponseModel):
+    Users: list[UserOut]
+
+
+class BookDetail(ResponseModel):
+    book: BookOut
+
+
+class MagazineDetail(ResponseModel):
+    Magazine: MagazineOut
+
+
+class PublisherDetail(ResponseModel):
+    Publisher: PublisherOut
+
+
+class GenreDetail(ResponseModel):
+    # Served under the key the route always used
+    Publisher: GenreOut
+
+
+class UserDetails(ResponseModel):
+    user_details: UserOut
+
+
+class UserDetail(ResponseModel):
+    User: UserDetails
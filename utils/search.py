@@ -0,0 +1,133 @@
+import re
+from decouple import config
+from fastapi import HTTPException
+from sqlalchemy import Double, Select, and_, any_, cast, func, literal_column, or_, tuple_, union_all
+from sqlalchemy.orm import Session
+import utils.constant_messages as constant_messages
+from models import Book, Genre, Magazine, Publisher
+from utils.pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor
+
+# Words of a query that are searched for, the rest is ignored
+SEARCH_MAX_TERMS = config('search_max_terms', default=8, cast=int)
+# Text search configuration of the indexes, 'simple' doesn't stem so it fits titles and names.
+# The constants of the indexed expressions are put in the sql as they are, not as bound
+# parameters, or postgres can't match the expression with the index
+SEARCH_CONFIG = literal_column("'simple'::regconfig")
+EMPTY = literal_column("''")
+WEIGHT_TITLE = literal_column("'A'::\"char\"")
+WEIGHT_BY = literal_column("'B'::\"char\"")
+
+
+def search_document(title, by):
+    """
+    tsvector of a catalogue item, title weighted over author/editor.
+    Has to stay the same expression as the GIN indexes of migration e5b91f3c2d77
+    """
+    return func.setweight(func.to_tsvector(SEARCH_CONFIG, func.coalesce(title, EMPTY)), WEIGHT_TITLE).op('||')(
+        func.setweight(func.to_tsvector(SEARCH_CONFIG, func.coalesce(by, EMPTY)), WEIGHT_BY))
+
+
+def name_document(name):
+    return func.to_tsvector(SEARCH_CONFIG, name)
+
+
+def prefix_query(q: str):
+    """
+    tsquery matching items that have every word of q, the last word
+    also as a prefix so results show up while typing
+    """
+    terms = re.findall(r'\w+', q.lower())[:SEARCH_MAX_TERMS]
+    if not terms:
+        raise HTTPException(status_code=400,
+                            detail={
+                                "error": {
+                                    "error_type": constant_messages.INVALID_REQUEST,
+                                    "error_message": constant_messages.INVALID_SEARCH_MESSAGE
+                                }
+                            })
+    return func.to_tsquery(SEARCH_CONFIG, ' & '.join(f'{term}:*' for term in terms))
+
+
+def item_statement(model, kind: str, key, by, q: str, tsquery, genre_id, publisher_id, in_stock):
+    """
+    Matching items of one model with their rank. An item matches on its own
+    title and author/editor, by trigram similarity for typos, or through the
+    name of its genre or publisher.
+    """
+    document = search_document(model.title, by)
+    matching_genres = Select(Genre.id).where(or_(name_document(Genre.name).op('@@')(tsquery), Genre.name.op('%>')(q)))
+    matching_publishers = Select(Publisher.id).where(
+        or_(name_document(Publisher.name).op('@@')(tsquery), Publisher.name.op('%>')(q)))
+    # real, cast so the rank in the cursor goes through a python float and back unchanged
+    rank = cast(func.ts_rank(document, tsquery) + func.greatest(
+        func.word_similarity(q, model.title), func.word_similarity(q, by)), Double)
+
+    statement = Select(
+        literal_column(f"'{kind}'").label('kind'),
+        key.label('key'),
+        model.title.label('title'),
+        by.label('by'),
+        model.genre_id.label('genre_id'),
+        model.publisher_id.label('publisher_id'),
+        model.available_number.label('available_number'),
+        rank.label('rank')
+    ).where(or_(
+        document.op('@@')(tsquery),
+        model.title.op('%>')(q),
+        by.op('%>')(q),
+        # ARRAY(SELECT ..) runs once before the scan, an IN (SELECT ..) inside the OR
+        # would be a filter per row and keep postgres from a BitmapOr of the indexes
+        model.genre_id == any_(func.array(matching_genres.scalar_subquery())),
+        model.publisher_id == any_(func.array(matching_publishers.scalar_subquery()))
+    ))
+    if genre_id:
+        statement = statement.where(model.genre_id == genre_id)
+    if publisher_id:
+        statement = statement.where(model.publisher_id == publisher_id)
+    if in_stock:
+        statement = statement.where(model.available_number > 0)
+    return statement
+
+
+def search_catalogue(session: Session, q: str, kind: str = 'all', genre_id=None, publisher_id=None,
+                     in_stock: bool = False, limit: int = 10, cursor=None):
+    """
+    Books and magazines matching q, best match first.
+    Pages are keyset paginated on (rank, kind, key) through the cursor.
+    Returns -> (list of result dicts, next cursor or None)
+    """
+    limit = max(1, min(limit or 1, MAX_PAGE_SIZE))
+    tsquery = prefix_query(q)
+    filters = (q, tsquery, genre_id, publisher_id, in_stock)
+    statements = []
+    if kind in ('all', 'book'):
+        statements.append(item_statement(Book, 'book', Book.isbn_number, Book.author, *filters))
+    if kind in ('all', 'magazine'):
+        statements.append(item_statement(Magazine, 'magazine', Magazine.issn_number, Magazine.editor, *filters))
+    last = None
+    if cursor:
+        last = decode_cursor(cursor, float, str, str)
+
+    def page(statement):
+        """
+        Rows of statement after the cursor, best first, at most one page and one row
+        """
+        results = statement.subquery()
+        statement = Select(results)
+        if last:
+            last_rank, last_kind, last_key = last
+            statement = statement.where(or_(
+                results.c.rank < last_rank,
+                and_(results.c.rank == last_rank,
+                     tuple_(results.c.kind, results.c.key) > tuple_(last_kind, last_key))
+            ))
+        return statement.order_by(results.c.rank.desc(), results.c.kind, results.c.key).limit(limit + 1)
+
+    # Every kind is cut to one page before they are merged
+    statement = page(union_all(*map(page, statements))) if len(statements) > 1 else page(statements[0])
+    rows = session.execute(statement.limit(limit + 1)).mappings().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1]['rank'], rows[-1]['kind'], rows[-1]['key']])
+    return [dict(row) for row in rows], next_cursor
@@ -1,47 +1,34 @@
 import os
-import smtplib
 from email.message import EmailMessage
-from utils.main_message import get_verified_html, get_return_reminder_html, get_expiry_notification_html
+from utils.main_message import render_verified, render_digest
+from utils.mail_dispatcher import get_dispatcher
 
 EMAIL = os.environ.get('EMAIL')
-PASSWORD = os.environ.get('PASSWORD')
 
-async def send_verification_mail(email_to_send_to:str,username:str):
+def verification_message(email_to_send_to:str,username:str):
     message = EmailMessage()
     message['Subject'] = "Welcome to Library Management System"
     message['From'] = EMAIL
     message['To'] = email_to_send_to
-    message.set_content("welcome to the library management system, Your email is sucessfully verified.")
-    message.add_alternative(get_verified_html(username.title()), subtype='html')
+    text, html = render_verified(username.title())
+    message.set_content(text)
+    message.add_alternative(html, subtype='html')
+    return message
 
 
-    with smtplib.SMTP_SSL('smtp.gmail.com',465) as smtp:
-        smtp.login(EMAIL,PASSWORD)
-        smtp.send_message(message)
-
-def expiring_mail(email_to_send_to:str,username:str, name:str, object:str):
-    message = EmailMessage()
-    message['Subject'] = "Book Soon To Expire"
-    message['From'] = EMAIL
-    message['To'] = email_to_send_to
-    message.set_content(f"This is a friendly reminder that your borrowed {object} {name} is due for return in 3 days.")
-    message.add_alternative(get_return_reminder_html(username,name,object), subtype='html')
+def send_verification_mail(email_to_send_to:str,username:str):
+    return get_dispatcher().send(verification_message(email_to_send_to, username))
 
 
-    with smtplib.SMTP_SSL('smtp.gmail.com',465) as smtp:
-        smtp.login(EMAIL,PASSWORD)
-        smtp.send_message(message)
-
-
-def expired_mail(email_to_send_to:str,username:str, name:str, object:str, expirary_date:str, fine:str):
+def digest_message(email_to_send_to:str, username:str, expiring_items:list, expired_items:list, total_fine:int):
+    """
+    Mail with every expiring and expired loan of a user
+    """
     message = EmailMessage()
-    message['Subject'] = "Book Expired"
+    message['Subject'] = "Library Loans Expired" if expired_items else "Library Loans Soon To Expire"
     message['From'] = EMAIL
     message['To'] = email_to_send_to
-    message.set_content(f"This is a friendly reminder that your borrowed {object} {name} have already expired at {expirary_date} and fine ammount of रु {fine} is due.")
-    message.add_alternative(get_expiry_notification_html(username,name,object, expirary_date, fine), subtype='html')
-
-
-    with smtplib.SMTP_SSL('smtp.gmail.com',465) as smtp:
-        smtp.login(EMAIL,PASSWORD)
-        smtp.send_message(message)
\ No newline at end of file
+    text, html = render_digest(username, expiring_items, expired_items, total_fine)
+    message.set_content(text)
+    message.add_alternative(html, subtype='html')
+    return message